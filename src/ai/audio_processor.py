@@ -1,119 +1,207 @@
+import hashlib
 import os
-import tempfile
-from pydub import AudioSegment
-from openai import OpenAI
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Tuple
 from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler, con_reintentos, PRIORIDAD_STUDIO
+from processing.audio_ffmpeg import EnsambladorAudio
+from utils.storage_manager import storage_manager
+
+# Intentos por intervención antes de dar por fallida la síntesis
+MAX_INTENTOS_TTS = 3
+# Máximo de caracteres que acepta una solicitud de TTS
+LIMITE_CARACTERES_TTS = 4096
+# Subdirectorio de datos con el audio sintetizado por (proveedor, voz, modelo, texto)
+DIRECTORIO_CACHE_TTS = "cache_tts"
+# Pausa entre intervenciones en el audio final
+SILENCIO_ENTRE_LINEAS_MS = 400
 
 class AudioProcessor:
     def __init__(self):
-        # Usar la API key configurada
-        self.api_key = config_manager.get_api_key()
-        if self.api_key:
-            self.client = OpenAI(api_key=self.api_key)
-        else:
-            self.client = None
-            
         # Voces de OpenAI TTS
         self.voz_alex = "onyx"   # Voz masculina
         self.voz_sofi = "nova"   # Voz femenina
         self.modelo_tts = "tts-1" # Más rápido. Para mayor calidad usar "tts-1-hd"
+        # Líneas sintetizadas a la vez (el planificador aplica además los límites del modelo)
+        self.max_concurrencia = max(1, config_manager.get_max_concurrencia_tts())
         
-    def generar_podcast_audio(self, guion_texto: str, libro_id: int, titulo_libro: str) -> str:
+    def compilar_guion(self, guion_texto: str) -> List[Tuple[str, str]]:
         """
-        Toma el guion escrito, genera el audio de las voces usando TTS,
-        los une y rertorna la ruta del archivo mp3 final.
+        Intervenciones a sintetizar como (voz, texto): las líneas consecutivas del
+        mismo hablante se unen hasta el límite de TTS, y una línea que lo supera se
+        parte por oraciones. Menos solicitudes y, al editar un guion, las
+        intervenciones que no cambiaron conservan su texto (y su audio en cache).
         """
-        # Tratar de obtener la API si se configuró después de iniciar
-        if not self.client:
-            self.api_key = config_manager.get_api_key()
-            if self.api_key:
-                self.client = OpenAI(api_key=self.api_key)
+        turnos = []
+        for voz, texto in self._parsear_guion(guion_texto):
+            for parte in self._partir_texto(texto):
+                if turnos and turnos[-1][0] == voz and len(turnos[-1][1]) + 1 + len(parte) <= LIMITE_CARACTERES_TTS:
+                    turnos[-1] = (voz, f"{turnos[-1][1]} {parte}")
+                else:
+                    turnos.append((voz, parte))
+        return turnos
+    
+    def _partir_texto(self, texto: str) -> List[str]:
+        """Dividir un texto más largo que el límite de TTS por oraciones (o palabras)"""
+        if len(texto) <= LIMITE_CARACTERES_TTS:
+            return [texto]
+        partes, actual = [], ""
+        for oracion in re.split(r"(?<=[.!?…])\s+", texto):
+            while len(oracion) > LIMITE_CARACTERES_TTS:
+                corte = oracion.rfind(" ", 0, LIMITE_CARACTERES_TTS)
+                corte = corte if corte > 0 else LIMITE_CARACTERES_TTS
+                if actual:
+                    partes.append(actual)
+                    actual = ""
+                partes.append(oracion[:corte])
+                oracion = oracion[corte:].strip()
+            if actual and len(actual) + 1 + len(oracion) > LIMITE_CARACTERES_TTS:
+                partes.append(actual)
+                actual = oracion
             else:
-                raise ValueError("API Key de OpenAI no configurada.")
-            
-        lineas = guion_texto.split('\n')
-        audios_generados = []
-        temp_dir = tempfile.mkdtemp()
+                actual = f"{actual} {oracion}" if actual else oracion
+        if actual:
+            partes.append(actual)
+        return partes
+    
+    def _parsear_guion(self, guion_texto: str) -> List[Tuple[str, str]]:
+        """Líneas habladas del guion como (voz, texto)"""
+        lineas = []
+        ultimo_hablante = "Alex"
         
-        try:
-            ultimo_hablante = "Alex"
-            
-            for i, linea in enumerate(lineas):
-                linea = linea.strip()
-                if not linea:
-                    continue
-                    
-                hablante = None
-                texto = linea
-                
-                # Eliminar marcas de negrita si existen
-                linea_limpia = linea.replace("**", "")
+        for linea in guion_texto.split('\n'):
+            linea = linea.strip()
+            if not linea:
+                continue
                 
-                if linea_limpia.startswith("Alex:"):
-                    hablante = "Alex"
-                    texto = linea_limpia.split(":", 1)[1].strip()
-                elif linea_limpia.startswith("Sofi:"):
-                    hablante = "Sofi"
-                    texto = linea_limpia.split(":", 1)[1].strip()
+            hablante = None
+            texto = linea
+            
+            # Eliminar marcas de negrita si existen
+            linea_limpia = linea.replace("**", "")
+            
+            if linea_limpia.startswith("Alex:"):
+                hablante = "Alex"
+                texto = linea_limpia.split(":", 1)[1].strip()
+            elif linea_limpia.startswith("Sofi:"):
+                hablante = "Sofi"
+                texto = linea_limpia.split(":", 1)[1].strip()
+            else:
+                # Continuación del hablante anterior o texto descriptivo
+                if len(texto) > 5:
+                    hablante = ultimo_hablante
                 else:
-                    # Continuación del hablante anterior o texto descriptivo
-                    if len(texto) > 5:
-                        hablante = ultimo_hablante
-                    else:
-                        continue
-                        
-                if not texto.strip():
                     continue
                     
-                ultimo_hablante = hablante
-                voz = self.voz_alex if hablante == "Alex" else self.voz_sofi
-                
-                temp_file = os.path.join(temp_dir, f"segment_{i}.mp3")
-                
-                response = self.client.audio.speech.create(
-                    model=self.modelo_tts,
-                    voice=voz,
-                    input=texto
-                )
-                response.stream_to_file(temp_file)
-                
-                segmento = AudioSegment.from_mp3(temp_file)
-                audios_generados.append(segmento)
-                
-            if not audios_generados:
-                raise ValueError("No se pudo extraer texto del guion para generar el audio.")
+            if not texto.strip():
+                continue
                 
-            # Unir segmentos con un ligero silencio para mayor naturalidad (400ms)
-            silencio = AudioSegment.silent(duration=400)
-            audio_final = audios_generados[0]
-            
-            for segmento in audios_generados[1:]:
-                audio_final += silencio + segmento
-                
-            # Directorio final
-            ruta_datos = config_manager.get("almacenamiento", "ruta_datos", "./data")
-            dir_podcasts = os.path.join(ruta_datos, "podcasts")
-            os.makedirs(dir_podcasts, exist_ok=True)
-            
-            # Nombre seguro
-            nombre_seguro = "".join([c for c in titulo_libro if c.isalnum() or c.isspace()]).strip()
-            nombre_archivo = f"podcast_{libro_id}_{nombre_seguro.replace(' ', '_')}.mp3"
-            ruta_final = os.path.join(dir_podcasts, nombre_archivo)
+            ultimo_hablante = hablante
+            lineas.append((self.voz_alex if hablante == "Alex" else self.voz_sofi, texto))
+        return lineas
+    
+    def _ruta_cache(self, texto: str, voz: str) -> str:
+        """Archivo de cache del audio de un texto (depende del proveedor, la voz y el modelo)"""
+        clave = f"{llm_scheduler.proveedor.nombre}|{voz}|{self.modelo_tts}|{texto}"
+        nombre = hashlib.sha256(clave.encode("utf-8")).hexdigest()
+        ruta_datos = config_manager.get("almacenamiento", "ruta_datos", "./data")
+        return os.path.join(ruta_datos, DIRECTORIO_CACHE_TTS, f"{nombre}.mp3")
+    
+    def _sintetizar(self, texto: str, voz: str, ruta: str) -> str:
+        """Generar el MP3 de una intervención en `ruta`, reintentando los fallos transitorios"""
+        parcial = f"{ruta}.parcial"
+        def llamada():
+            response = llm_scheduler.tts(texto, voz, self.modelo_tts, PRIORIDAD_STUDIO,
+                                         origen="podcast_audio")
+            response.stream_to_file(parcial)
+        try:
+            con_reintentos(llamada, MAX_INTENTOS_TTS, descripcion="TTS")
+        except Exception:
+            if os.path.exists(parcial):
+                os.remove(parcial)
+            raise
+        # Solo un archivo completo entra a la cache
+        os.replace(parcial, ruta)
+        return ruta
+    
+    def _sintetizar_lineas(self, lineas: List[Tuple[str, str]],
+                           progreso: Callable[[int, int], None] = None) -> List[str]:
+        """
+        Obtener el audio de cada intervención: las que ya están en cache se
+        reutilizan y el resto se sintetiza en paralelo (pool acotado). Retorna las
+        rutas en el orden del guion.
+        """
+        rutas = [self._ruta_cache(texto, voz) for voz, texto in lineas]
+        # Intervenciones idénticas (p.ej. una muletilla repetida) se sintetizan una vez
+        pendientes = {}
+        for i, ruta in enumerate(rutas):
+            if os.path.exists(ruta):
+                storage_manager.registrar_uso(ruta)
+            else:
+                pendientes.setdefault(ruta, []).append(i)
+        completadas = len(lineas) - sum(len(indices) for indices in pendientes.values())
+        if completadas:
+            print(f"♻️ {completadas} de {len(lineas)} intervenciones reutilizadas de la cache de voz")
+        if progreso:
+            progreso(completadas, len(lineas))
+        if not pendientes:
+            return rutas
+        
+        os.makedirs(os.path.dirname(rutas[0]), exist_ok=True)
+        print(f"🎤 Sintetizando {len(pendientes)} intervenciones ({min(self.max_concurrencia, len(pendientes))} en paralelo)")
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrencia, len(pendientes))) as pool:
+            futuros = {
+                pool.submit(self._sintetizar, lineas[indices[0]][1], lineas[indices[0]][0], ruta): indices
+                for ruta, indices in pendientes.items()
+            }
+            for futuro in as_completed(futuros):
+                indices = futuros[futuro]
+                try:
+                    futuro.result()
+                except Exception as e:
+                    # Sin esa intervención el podcast queda incompleto: no seguir gastando llamadas
+                    for pendiente in futuros:
+                        pendiente.cancel()
+                    raise RuntimeError(f"No se pudo generar la voz de la intervención {indices[0] + 1}: {e}") from e
+                completadas += len(indices)
+                if progreso:
+                    progreso(completadas, len(lineas))
+        
+        return rutas
+        
+    def generar_podcast_audio(self, guion_texto: str, libro_id: int, titulo_libro: str,
+                              progreso: Callable[[int, int], None] = None) -> str:
+        """
+        Toma el guion escrito, genera el audio de las voces usando TTS,
+        los une y rertorna la ruta del archivo mp3 final.
+        `progreso(completadas, total)` se llama al terminar cada intervención.
+        """
+        # La API key se lee al llamar, por si se configuró después de iniciar
+        if not llm_scheduler.disponible():
+            raise ValueError("API Key de OpenAI no configurada.")
             
-            audio_final.export(ruta_final, format="mp3")
-            return ruta_final
+        lineas = self.compilar_guion(guion_texto)
+        if not lineas:
+            raise ValueError("No se pudo extraer texto del guion para generar el audio.")
+        
+        rutas = self._sintetizar_lineas(lineas, progreso)
             
-        finally:
-            # Limpiar
-            for root, dirs, files in os.walk(temp_dir, topdown=False):
-                for name in files:
-                    try:
-                        os.remove(os.path.join(root, name))
-                    except: pass
-                for name in dirs:
-                    try:
-                        os.rmdir(os.path.join(root, name))
-                    except: pass
-            if os.path.exists(temp_dir):
-                try: os.rmdir(temp_dir)
-                except: pass
+        # Directorio final
+        ruta_datos = config_manager.get("almacenamiento", "ruta_datos", "./data")
+        dir_podcasts = os.path.join(ruta_datos, "podcasts")
+        os.makedirs(dir_podcasts, exist_ok=True)
+        
+        # Nombre seguro
+        nombre_seguro = "".join([c for c in titulo_libro if c.isalnum() or c.isspace()]).strip()
+        nombre_archivo = f"podcast_{libro_id}_{nombre_seguro.replace(' ', '_')}.mp3"
+        ruta_final = os.path.join(dir_podcasts, nombre_archivo)
+        
+        # Unir segmentos con un ligero silencio para mayor naturalidad (400ms),
+        # en streaming hacia un único codificador
+        with EnsambladorAudio(ruta_final) as ensamblador:
+            for i, ruta in enumerate(rutas):
+                if i:
+                    ensamblador.agregar_silencio(SILENCIO_ENTRE_LINEAS_MS)
+                ensamblador.agregar_archivo(ruta)
+        return ruta_final
@@ -0,0 +1,150 @@
+"""
+Empaquetado de fragmentos en el contexto de un prompt según un presupuesto de tokens
+"""
+import hashlib
+import re
+from typing import Callable, Dict, List, Tuple
+
+from config.config_manager import config_manager
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    print(f"⚠️ tiktoken no disponible para el empaquetado de contexto, usando aproximación: {e}")
+    _encoding = None
+
+# Ventana de contexto (tokens) de los modelos conocidos
+VENTANAS_MODELO = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4-turbo-preview": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+VENTANA_POR_DEFECTO = 8192
+
+# Por debajo de este espacio restante no vale la pena incluir un fragmento recortado
+MIN_TOKENS_RECORTE = 60
+
+def contar_tokens(texto: str) -> int:
+    """Contar tokens con tiktoken (aproximación por palabras si no está disponible)"""
+    if not texto:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(texto))
+    return len(texto.split()) * 4 // 3
+
+def recortar_a_tokens(texto: str, max_tokens: int) -> str:
+    """Recortar un texto a un máximo de tokens"""
+    if _encoding is not None:
+        tokens = _encoding.encode(texto)
+        if len(tokens) <= max_tokens:
+            return texto
+        return _encoding.decode(tokens[:max_tokens]) + "..."
+    palabras = texto.split()
+    max_palabras = max_tokens * 3 // 4
+    if len(palabras) <= max_palabras:
+        return texto
+    return " ".join(palabras[:max_palabras]) + "..."
+
+def _clave_contenido(texto: str) -> str:
+    """Huella del contenido normalizado (ignora mayúsculas y espacios)"""
+    normalizado = re.sub(r"\s+", " ", texto).strip().lower()
+    return hashlib.sha1(normalizado.encode("utf-8")).hexdigest()
+
+def ordenar_por_cobertura(fragmentos: List[Dict]) -> List[Dict]:
+    """
+    Ordenar fragmentos para que cualquier prefijo quede repartido por todo el
+    documento (secuencia de van der Corput sobre las posiciones), en lugar de
+    concentrarse en las primeras páginas.
+    """
+    n = len(fragmentos)
+    if n <= 2:
+        return list(fragmentos)
+
+    def van_der_corput(i: int) -> float:
+        resultado, denominador = 0.0, 1.0
+        while i:
+            denominador *= 2
+            i, resto = divmod(i, 2)
+            resultado += resto / denominador
+        return resultado
+
+    posiciones = sorted(range(n), key=van_der_corput)
+    return [fragmentos[i] for i in posiciones]
+
+def presupuesto_para_modelo(modelo: str, tokens_reservados: int = 0) -> int:
+    """Presupuesto de contexto configurado para un modelo, acotado por su ventana"""
+    ventana = VENTANAS_MODELO.get(modelo, VENTANA_POR_DEFECTO)
+    return max(0, min(config_manager.get_presupuesto_contexto(modelo), ventana - tokens_reservados))
+
+class ContextPacker:
+    """
+    Selecciona fragmentos hasta llenar un presupuesto de tokens: respeta el orden
+    de relevancia recibido, descarta duplicados y recorta los fragmentos largos.
+    """
+
+    def __init__(self, presupuesto_tokens: int, max_tokens_fragmento: int = None):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_tokens_fragmento = max_tokens_fragmento or config_manager.get_max_tokens_fragmento_contexto()
+
+    def empaquetar(self, fragmentos: List[Dict], formato: Callable[[Dict, str], str],
+                   separador: str = "\n\n", orden_documento: bool = False) -> Tuple[str, Dict]:
+        """
+        Construir el texto de contexto. `fragmentos` debe venir ordenado por
+        prioridad; `formato(fragmento, contenido)` produce el bloque de cada uno.
+        Con `orden_documento` los bloques elegidos se reordenan por libro y página.
+        Retorna (contexto, informe) con los tokens usados y lo descartado.
+        """
+        tokens_separador = contar_tokens(separador)
+        vistos = set()
+        elegidos = []
+        usados = 0
+        duplicados = recortados = 0
+
+        for frag in fragmentos:
+            contenido = frag.get('contenido') or ""
+            clave = _clave_contenido(contenido)
+            if not contenido.strip() or clave in vistos:
+                duplicados += 1
+                continue
+
+            tokens_contenido = frag.get('token_count') or contar_tokens(contenido)
+            if tokens_contenido > self.max_tokens_fragmento:
+                contenido = recortar_a_tokens(contenido, self.max_tokens_fragmento)
+                tokens_contenido = self.max_tokens_fragmento
+                recortados += 1
+
+            tokens_bloque = tokens_contenido + contar_tokens(formato(frag, "")) + tokens_separador
+            restante = self.presupuesto_tokens - usados
+            if tokens_bloque > restante:
+                # Aprovechar el hueco final con una versión recortada del fragmento
+                if restante - (tokens_bloque - tokens_contenido) < MIN_TOKENS_RECORTE:
+                    break
+                tokens_disponibles = restante - (tokens_bloque - tokens_contenido)
+                contenido = recortar_a_tokens(contenido, tokens_disponibles)
+                tokens_bloque = restante
+                recortados += 1
+
+            vistos.add(clave)
+            elegidos.append((frag, contenido))
+            usados += tokens_bloque
+
+        if orden_documento:
+            elegidos.sort(key=lambda e: (e[0].get('libro_id') or 0, e[0].get('pagina') or 0))
+
+        contexto = separador.join(formato(frag, contenido) for frag, contenido in elegidos)
+        informe = {
+            'tokens_usados': usados,
+            'presupuesto_tokens': self.presupuesto_tokens,
+            'fragmentos_incluidos': len(elegidos),
+            'fragmentos_descartados': len(fragmentos) - len(elegidos) - duplicados,
+            'duplicados': duplicados,
+            'recortados': recortados,
+            'fragmentos_ids': [frag.get('id') for frag, _ in elegidos if frag.get('id') is not None]
+        }
+        print(f"📦 Contexto: {usados}/{self.presupuesto_tokens} tokens, "
+              f"{len(elegidos)} fragmentos ({duplicados} duplicados, {recortados} recortados)")
+        return contexto, informe
@@ -0,0 +1,430 @@
+"""
+Planificador central de llamadas a modelos (chat, embeddings, TTS y Whisper)
+
+Todas las llamadas del proceso usan un único proveedor (ai.proveedores; con
+OpenAI, un solo cliente con su pool de conexiones HTTP) y pasan por un control
+de admisión: cada solicitud espera su turno según su clase de prioridad, los
+límites por minuto del modelo (cubetas de solicitudes y de tokens) y los topes
+de concurrencia. La llamada se ejecuta en el hilo de quien la pide; el
+planificador solo decide cuándo.
+Cada llamada queda registrada en uso_modelos (tokens, unidades y latencia).
+"""
+import itertools
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+from config.config_manager import config_manager
+from ai.context_packer import contar_tokens
+from ai.proveedores import ProveedorModelos, crear_proveedor
+
+# Clases de prioridad (menor valor = se atiende antes)
+PRIORIDAD_CHAT = 0
+PRIORIDAD_STUDIO = 1
+PRIORIDAD_INGESTA = 2
+PRIORIDAD_TRANSCRIPCION = 3
+# Trabajo especulativo en segundo plano (p.ej. preparar Studio tras una importación)
+PRIORIDAD_PRECOMPUTO = 4
+
+NOMBRES_PRIORIDAD = {
+    PRIORIDAD_CHAT: "chat",
+    PRIORIDAD_STUDIO: "studio",
+    PRIORIDAD_INGESTA: "ingesta",
+    PRIORIDAD_TRANSCRIPCION: "transcripcion",
+    PRIORIDAD_PRECOMPUTO: "precomputo",
+}
+
+# Clases cuya actividad indica que hay un usuario esperando
+PRIORIDADES_INTERACTIVAS = (PRIORIDAD_CHAT, PRIORIDAD_STUDIO)
+
+# Tokens de respuesta supuestos cuando la llamada no fija max_tokens
+TOKENS_RESPUESTA_ESTIMADOS = 500
+# Esperas de admisión más largas que esto se informan en consola
+AVISO_ESPERA_S = 2.0
+# Pausa de un modelo tras un 429 cuando la API no indica cuánto esperar, y tope
+# para las esperas que sí indica
+ENFRIAMIENTO_LIMITE_S = 5.0
+ENFRIAMIENTO_MAXIMO_S = 60.0
+
+def con_reintentos(funcion: Callable[[], Any], intentos: int = 3, espera_inicial_s: float = 1.0,
+                   descripcion: str = "Llamada") -> Any:
+    """
+    Ejecutar `funcion` reintentando los fallos con espera exponencial y algo de
+    azar (para que los trabajadores de un pool no reintenten todos a la vez).
+    Los ValueError (configuración inválida) no se reintentan. Relanza el último error.
+    """
+    for intento in range(1, intentos + 1):
+        try:
+            return funcion()
+        except ValueError:
+            raise
+        except Exception as e:
+            if intento >= intentos:
+                raise
+            espera = espera_inicial_s * 2 ** (intento - 1) * random.uniform(1.0, 1.5)
+            print(f"🔁 {descripcion} falló ({e}); reintento {intento}/{intentos - 1} en {espera:.1f}s")
+            time.sleep(espera)
+
+class _Cubeta:
+    """Cubeta de tokens con capacidad por minuto que se rellena de forma continua"""
+
+    def __init__(self, por_minuto: int):
+        self.capacidad = max(0, int(por_minuto or 0))
+        self.disponible = float(self.capacidad)
+        self._ultimo = time.monotonic()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.disponible = min(self.capacidad,
+                              self.disponible + (ahora - self._ultimo) * self.capacidad / 60)
+        self._ultimo = ahora
+
+    def espera(self, cantidad: int) -> float:
+        """Segundos hasta poder consumir `cantidad` (0 si ya se puede o si no hay límite)"""
+        if self.capacidad == 0:
+            return 0.0
+        self._rellenar()
+        faltan = min(cantidad, self.capacidad) - self.disponible
+        return 0.0 if faltan <= 0 else faltan * 60 / self.capacidad
+
+    def ajustar(self, cantidad: float):
+        """Sumar (devolver) o restar (cobrar) unidades; el saldo puede quedar negativo"""
+        if self.capacidad == 0:
+            return
+        self._rellenar()
+        self.disponible = min(self.capacidad, self.disponible + cantidad)
+
+    def vaciar(self):
+        if self.capacidad:
+            self._rellenar()
+            self.disponible = min(self.disponible, 0.0)
+
+class _EstadoModelo:
+    def __init__(self, limites: Dict[str, int]):
+        self.rpm = _Cubeta(limites.get('rpm', 0))
+        self.tpm = _Cubeta(limites.get('tpm', 0))
+        self.max_concurrencia = max(1, int(limites.get('max_concurrencia', 1)))
+        self.activas = 0
+        # Tras un 429 no se admite nada de este modelo hasta este instante (monotonic)
+        self.pausa_hasta = 0.0
+
+class _Solicitud:
+    __slots__ = ('prioridad', 'orden', 'modelo', 'tokens', 'encolada', 'espera_s')
+
+    def __init__(self, prioridad: int, orden: int, modelo: str, tokens: int):
+        self.prioridad = prioridad
+        self.orden = orden
+        self.modelo = modelo
+        self.tokens = tokens
+        self.encolada = time.monotonic()
+        self.espera_s = 0.0
+
+class LLMScheduler:
+    """
+    Cola de admisión con prioridades. Una solicitud pasa cuando ninguna anterior
+    (en orden de prioridad y llegada) del mismo modelo sigue esperando, el modelo
+    tiene cupo de concurrencia y saldo en sus cubetas RPM/TPM, y hay cupo global.
+    La última plaza global se reserva para el chat interactivo.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LLMScheduler, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._cond = threading.Condition()
+        self._espera: List[_Solicitud] = []
+        self._modelos: Dict[str, _EstadoModelo] = {}
+        self._orden = itertools.count()
+        self._activas = 0
+        self._activas_por_prioridad = {p: 0 for p in NOMBRES_PRIORIDAD}
+        self._ultima_admision = {p: 0.0 for p in NOMBRES_PRIORIDAD}
+        self.max_concurrencia_global = max(1, config_manager.get_max_concurrencia_global_ia())
+
+        self._db_manager = None
+        self._lock_proveedor = threading.Lock()
+        self._proveedor = None
+
+        # Métricas acumuladas
+        self._atendidas = {p: 0 for p in NOMBRES_PRIORIDAD}
+        self._espera_total_s = {p: 0.0 for p in NOMBRES_PRIORIDAD}
+        self._limitadas = 0
+
+        self._initialized = True
+
+    # ============ PROVEEDOR ============
+
+    @property
+    def proveedor(self) -> ProveedorModelos:
+        """Proveedor configurado en ia.proveedor (se recrea si cambia la configuración)"""
+        nombre = config_manager.get_proveedor_ia()
+        with self._lock_proveedor:
+            if self._proveedor is None or self._proveedor.nombre != nombre:
+                self._proveedor = crear_proveedor(nombre)
+                print(f"🔌 Proveedor de modelos: {self._proveedor.nombre}")
+            return self._proveedor
+
+    def disponible(self) -> bool:
+        return self.proveedor.disponible()
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            from database.db_manager import DatabaseManager
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    # ============ ADMISIÓN ============
+
+    def _estado(self, modelo: str) -> _EstadoModelo:
+        estado = self._modelos.get(modelo)
+        if estado is None:
+            estado = _EstadoModelo(config_manager.get_limites_modelo(modelo))
+            self._modelos[modelo] = estado
+        return estado
+
+    def _siguiente_admisible(self):
+        """(solicitud que puede pasar o None, segundos hasta que una cubeta se rellene o None)"""
+        modelos_bloqueados = set()
+        espera_minima = None
+        for solicitud in self._espera:
+            if self._activas >= self.max_concurrencia_global:
+                break
+            if (solicitud.prioridad > PRIORIDAD_CHAT and self.max_concurrencia_global > 1
+                    and self._activas >= self.max_concurrencia_global - 1):
+                continue
+            if solicitud.modelo in modelos_bloqueados:
+                continue
+
+            estado = self._estado(solicitud.modelo)
+            if estado.activas >= estado.max_concurrencia:
+                modelos_bloqueados.add(solicitud.modelo)
+                continue
+            espera = max(estado.rpm.espera(1), estado.tpm.espera(solicitud.tokens),
+                         estado.pausa_hasta - time.monotonic())
+            if espera > 0:
+                modelos_bloqueados.add(solicitud.modelo)
+                espera_minima = espera if espera_minima is None else min(espera_minima, espera)
+                continue
+            return solicitud, None
+        return None, espera_minima
+
+    def _adquirir(self, modelo: str, prioridad: int, tokens: int) -> _Solicitud:
+        """Bloquear hasta que la solicitud sea admitida y reservar su cupo"""
+        with self._cond:
+            solicitud = _Solicitud(prioridad, next(self._orden), modelo, tokens)
+            self._espera.append(solicitud)
+            self._espera.sort(key=lambda s: (s.prioridad, s.orden))
+
+            while True:
+                siguiente, espera = self._siguiente_admisible()
+                if siguiente is solicitud:
+                    break
+                if siguiente is not None:
+                    self._cond.notify_all()  # Despertar a la que sí puede pasar
+                self._cond.wait(timeout=espera)
+
+            self._espera.remove(solicitud)
+            estado = self._estado(modelo)
+            estado.activas += 1
+            self._activas += 1
+            self._activas_por_prioridad[prioridad] += 1
+            self._ultima_admision[prioridad] = time.monotonic()
+            estado.rpm.ajustar(-1)
+            estado.tpm.ajustar(-min(tokens, estado.tpm.capacidad or tokens))
+
+            esperado = solicitud.espera_s = time.monotonic() - solicitud.encolada
+            self._atendidas[prioridad] += 1
+            self._espera_total_s[prioridad] += esperado
+            # Puede haber más solicitudes admisibles (otros modelos)
+            self._cond.notify_all()
+
+        if esperado > AVISO_ESPERA_S:
+            print(f"⏳ Solicitud {NOMBRES_PRIORIDAD[prioridad]} a {modelo} esperó {esperado:.1f}s en cola")
+        return solicitud
+
+    def _liberar(self, solicitud: _Solicitud, tokens_reales: int = None):
+        with self._cond:
+            estado = self._estado(solicitud.modelo)
+            estado.activas -= 1
+            self._activas -= 1
+            self._activas_por_prioridad[solicitud.prioridad] -= 1
+            if tokens_reales is not None:
+                # Corregir la estimación con el uso informado por la API
+                estado.tpm.ajustar(solicitud.tokens - tokens_reales)
+            self._cond.notify_all()
+
+    def _penalizar(self, modelo: str, espera_s: float = 0.0):
+        """
+        Tras un 429, vaciar las cubetas del modelo y pausarlo el tiempo que pide
+        la API (Retry-After / x-ratelimit-reset-*) o ENFRIAMIENTO_LIMITE_S, para
+        que toda la cola retroceda en lugar de volver a chocar con el límite
+        """
+        espera_s = min(espera_s or ENFRIAMIENTO_LIMITE_S, ENFRIAMIENTO_MAXIMO_S)
+        with self._cond:
+            estado = self._estado(modelo)
+            estado.rpm.vaciar()
+            estado.tpm.vaciar()
+            estado.pausa_hasta = max(estado.pausa_hasta, time.monotonic() + espera_s)
+            self._limitadas += 1
+        print(f"🚦 Límite de la API alcanzado para {modelo}; pausando la cola {espera_s:.1f}s")
+
+    def _registrar(self, solicitud: _Solicitud, operacion: str, origen: str, inicio: float,
+                   uso=None, error: Exception = None, caracteres: int = 0, segundos_audio: float = 0):
+        """Guardar tokens, unidades facturables y latencia de una llamada (nunca interrumpe la llamada)"""
+        try:
+            tokens_entrada = getattr(uso, 'prompt_tokens', None) or 0
+            tokens_salida = getattr(uso, 'completion_tokens', None) or 0
+            if uso is None and operacion == "chat":
+                tokens_entrada = solicitud.tokens  # Sin uso informado: queda la estimación
+            self.db_manager.registrar_uso_modelo({
+                'operacion': operacion,
+                'modelo': solicitud.modelo,
+                'categoria': NOMBRES_PRIORIDAD[solicitud.prioridad],
+                'origen': origen,
+                'tokens_entrada': tokens_entrada,
+                'tokens_salida': tokens_salida,
+                'caracteres': caracteres,
+                'segundos_audio': segundos_audio,
+                'latencia_ms': int((time.monotonic() - inicio) * 1000),
+                'espera_ms': int(solicitud.espera_s * 1000),
+                'exito': error is None,
+                'error': str(error)[:300] if error is not None else None,
+            })
+        except Exception as e:
+            print(f"⚠️ No se pudo registrar el uso de {solicitud.modelo}: {e}")
+
+    def _ejecutar(self, modelo: str, prioridad: int, tokens: int,
+                  llamada: Callable[[ProveedorModelos], Any], operacion: str, origen: str = None,
+                  caracteres: int = 0, segundos_audio: float = 0) -> Any:
+        proveedor = self.proveedor
+        if not proveedor.disponible():
+            raise ValueError("API Key de OpenAI no configurada.")
+        solicitud = self._adquirir(modelo, prioridad, tokens)
+        inicio = time.monotonic()
+        uso = error = None
+        try:
+            respuesta = llamada(proveedor)
+            uso = getattr(respuesta, 'usage', None)
+            return respuesta
+        except Exception as e:
+            error = e
+            if proveedor.es_error_limite(e):
+                self._penalizar(modelo, proveedor.espera_limite(e))
+            raise
+        finally:
+            self._liberar(solicitud, getattr(uso, 'total_tokens', None))
+            self._registrar(solicitud, operacion, origen, inicio, uso, error, caracteres, segundos_audio)
+
+    @staticmethod
+    def _estimar_tokens_chat(mensajes: List[Dict], max_tokens: int = None) -> int:
+        entrada = sum(contar_tokens(m.get('content') or "") + 4 for m in mensajes)
+        return entrada + (max_tokens or TOKENS_RESPUESTA_ESTIMADOS)
+
+    # ============ LLAMADAS ============
+
+    def chat(self, mensajes: List[Dict], modelo: str, prioridad: int = PRIORIDAD_CHAT,
+             origen: str = None, **kwargs):
+        """chat.completions.create planificado; retorna la respuesta completa"""
+        tokens = self._estimar_tokens_chat(mensajes, kwargs.get('max_tokens'))
+        return self._ejecutar(modelo, prioridad, tokens,
+                              lambda proveedor: proveedor.chat(modelo, mensajes, **kwargs), "chat", origen)
+
+    def chat_stream(self, mensajes: List[Dict], modelo: str, prioridad: int = PRIORIDAD_CHAT,
+                    origen: str = None, **kwargs) -> Iterator:
+        """chat.completions.create en streaming; el cupo se mantiene hasta agotar el stream"""
+        tokens = self._estimar_tokens_chat(mensajes, kwargs.get('max_tokens'))
+        proveedor = self.proveedor
+        if not proveedor.disponible():
+            raise ValueError("API Key de OpenAI no configurada.")
+        solicitud = self._adquirir(modelo, prioridad, tokens)
+        inicio = time.monotonic()
+        uso = error = None
+        try:
+            stream = proveedor.chat_stream(modelo, mensajes, **kwargs)
+            for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    uso = chunk.usage
+                yield chunk
+        except Exception as e:
+            error = e
+            if proveedor.es_error_limite(e):
+                self._penalizar(modelo, proveedor.espera_limite(e))
+            raise
+        finally:
+            self._liberar(solicitud, getattr(uso, 'total_tokens', None))
+            self._registrar(solicitud, "chat", origen, inicio, uso, error)
+
+    def embeddings(self, textos, modelo: str, prioridad: int = PRIORIDAD_INGESTA, origen: str = None):
+        """embeddings.create para un texto o una lista de textos"""
+        lista = [textos] if isinstance(textos, str) else textos
+        tokens = sum(contar_tokens(t) for t in lista)
+        return self._ejecutar(modelo, prioridad, tokens,
+                              lambda proveedor: proveedor.embeddings(modelo, textos), "embeddings", origen)
+
+    def tts(self, texto: str, voz: str, modelo: str, prioridad: int = PRIORIDAD_STUDIO,
+            origen: str = None, **kwargs):
+        """audio.speech.create (los límites de TTS son por solicitud, no por tokens)"""
+        return self._ejecutar(modelo, prioridad, 0,
+                              lambda proveedor: proveedor.tts(modelo, voz, texto, **kwargs),
+                              "tts", origen, caracteres=len(texto))
+
+    def transcribir(self, archivo, modelo: str, prioridad: int = PRIORIDAD_TRANSCRIPCION,
+                    origen: str = None, segundos_audio: float = 0, **kwargs):
+        """audio.transcriptions.create sobre un archivo abierto en modo binario"""
+        return self._ejecutar(modelo, prioridad, 0,
+                              lambda proveedor: proveedor.transcribir(modelo, archivo, **kwargs),
+                              "transcripcion", origen, segundos_audio=segundos_audio)
+
+    # ============ MÉTRICAS ============
+
+    def inactivo(self, segundos: float) -> bool:
+        """Sin llamadas interactivas en curso, en cola ni admitidas en los últimos `segundos`"""
+        with self._cond:
+            ahora = time.monotonic()
+            for prioridad in PRIORIDADES_INTERACTIVAS:
+                if self._activas_por_prioridad[prioridad]:
+                    return False
+                if ahora - self._ultima_admision[prioridad] < segundos:
+                    return False
+            return not any(s.prioridad in PRIORIDADES_INTERACTIVAS for s in self._espera)
+
+    def obtener_metricas(self) -> Dict:
+        """Profundidad de cola por prioridad y por modelo, llamadas activas y esperas medias"""
+        with self._cond:
+            en_cola = {nombre: 0 for nombre in NOMBRES_PRIORIDAD.values()}
+            por_modelo = {}
+            for solicitud in self._espera:
+                en_cola[NOMBRES_PRIORIDAD[solicitud.prioridad]] += 1
+            for modelo, estado in self._modelos.items():
+                por_modelo[modelo] = {
+                    'activas': estado.activas,
+                    'en_cola': sum(1 for s in self._espera if s.modelo == modelo),
+                    'max_concurrencia': estado.max_concurrencia,
+                    'rpm_disponible': int(estado.rpm.disponible) if estado.rpm.capacidad else None,
+                    'tpm_disponible': int(estado.tpm.disponible) if estado.tpm.capacidad else None,
+                }
+            return {
+                'en_cola': en_cola,
+                'total_en_cola': len(self._espera),
+                'activas': self._activas,
+                'max_concurrencia_global': self.max_concurrencia_global,
+                'por_modelo': por_modelo,
+                'atendidas': {NOMBRES_PRIORIDAD[p]: n for p, n in self._atendidas.items()},
+                'espera_media_s': {
+                    NOMBRES_PRIORIDAD[p]: (self._espera_total_s[p] / n if n else 0.0)
+                    for p, n in self._atendidas.items()
+                },
+                'limitadas_429': self._limitadas,
+            }
+
+# Instancia global
+llm_scheduler = LLMScheduler()
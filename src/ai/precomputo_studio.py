@@ -0,0 +1,219 @@
+"""
+Precálculo en segundo plano de artefactos de Notebook Studio tras importar un libro
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler, PRIORIDAD_PRECOMPUTO
+from utils.event_bus import event_bus, FRAGMENTOS_AGREGADOS, LIBRO_ELIMINADO
+
+# Cada cuánto se vuelve a comprobar la inactividad mientras hay trabajos pendientes
+INTERVALO_INACTIVIDAD_S = 2
+# Máximo que una petición interactiva espera a que el precálculo cancelado suelte su artefacto
+ESPERA_CESION_S = 5
+
+class PrecomputoStudio:
+    """
+    Cola de baja prioridad: al agregarse los fragmentos de un libro encola los
+    tipos configurados (biblioteca_ia.studio.precomputo) y los genera uno a uno
+    cuando no hay uso interactivo reciente, guardándolos en la cache de
+    artefactos. Sus llamadas pasan por el planificador con la prioridad más baja,
+    así que respetan los límites de la API y nunca se adelantan al chat.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(PrecomputoStudio, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._cond = threading.Condition()
+        self._pendientes = deque()
+        self._en_curso = None
+        self._evento_en_curso = None
+        self._cancelar_en_curso = False
+        self._detener = False
+        self._hilo = None
+        self._query_processor = None
+        self._db_manager = None
+
+        self._initialized = True
+
+    # ============ CONFIGURACIÓN ============
+
+    def iniciar(self):
+        """Escuchar las importaciones y arrancar el hilo de trabajo"""
+        with self._cond:
+            if self._hilo is not None:
+                return
+            self._detener = False
+            self._hilo = threading.Thread(target=self._run, name="PrecomputoStudio", daemon=True)
+            self._hilo.start()
+
+        event_bus.suscribir(FRAGMENTOS_AGREGADOS, self._on_fragmentos_agregados)
+        event_bus.suscribir(LIBRO_ELIMINADO, self._on_libros_eliminados)
+
+    def detener(self):
+        """Cancelar todo y terminar el hilo"""
+        self.cancelar()
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            from database.db_manager import DatabaseManager
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    @property
+    def query_processor(self):
+        if self._query_processor is None:
+            from ai.query_processor import QueryProcessor
+            self._query_processor = QueryProcessor(prioridad_studio=PRIORIDAD_PRECOMPUTO)
+        return self._query_processor
+
+    # ============ COLA ============
+
+    def encolar(self, libro_id: int, tipos: List[str] = None) -> int:
+        """Agregar los artefactos de un libro a la cola. Retorna cuántos se encolaron"""
+        tipos = tipos or config_manager.get_tipos_precomputo_studio()
+        agregados = 0
+        with self._cond:
+            for tipo in tipos:
+                clave = (libro_id, tipo)
+                if clave in self._pendientes or clave == self._en_curso:
+                    continue
+                self._pendientes.append(clave)
+                agregados += 1
+            self._cond.notify_all()
+        if agregados:
+            print(f"🗂️ {agregados} artefacto(s) de Studio en cola de precálculo para libro {libro_id}")
+        return agregados
+
+    def cancelar(self, libro_id: int = None) -> int:
+        """
+        Descartar los trabajos pendientes (de un libro o todos). Si el trabajo en
+        curso coincide, su resultado se descarta al terminar. Retorna los descartados.
+        """
+        with self._cond:
+            antes = len(self._pendientes)
+            self._pendientes = deque(c for c in self._pendientes if libro_id is not None and c[0] != libro_id)
+            descartados = antes - len(self._pendientes)
+            if self._en_curso and (libro_id is None or self._en_curso[0] == libro_id):
+                self._cancelar_en_curso = True
+                descartados += 1
+            self._cond.notify_all()
+        return descartados
+
+    def ceder(self, libro_id: int, tipo: str, timeout: float = ESPERA_CESION_S) -> bool:
+        """
+        Si ese artefacto se está precalculando, cancelarlo para que la interfaz lo
+        genere con prioridad interactiva (el precálculo va en la clase más baja).
+        Espera como máximo `timeout` a que se detenga, para que los resúmenes de
+        las ventanas ya terminadas queden en cache. Retorna True si había uno en curso.
+        """
+        with self._cond:
+            if self._en_curso != (libro_id, tipo):
+                return False
+            self._cancelar_en_curso = True
+            evento = self._evento_en_curso
+        print(f"⏩ Precálculo en curso de {tipo} (libro {libro_id}) cancelado por una petición interactiva")
+        evento.wait(timeout)
+        return True
+
+    def obtener_estado(self) -> Dict:
+        with self._cond:
+            return {'pendientes': list(self._pendientes), 'en_curso': self._en_curso}
+
+    def _on_fragmentos_agregados(self, evento: str, datos: Dict):
+        if config_manager.get_precomputo_studio_activo() and datos.get('libro_id'):
+            self.encolar(datos['libro_id'])
+
+    def _on_libros_eliminados(self, evento: str, datos: Dict):
+        for libro_id in datos.get('libro_ids', []):
+            self.cancelar(libro_id)
+
+    # ============ TRABAJO ============
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._detener:
+                    self._cond.wait()
+                if self._detener:
+                    return
+
+            # Solo avanzar cuando el usuario no está usando chat ni Studio
+            if not llm_scheduler.inactivo(config_manager.get_espera_inactividad_precomputo()):
+                with self._cond:
+                    self._cond.wait(timeout=INTERVALO_INACTIVIDAD_S)
+                continue
+
+            with self._cond:
+                if not self._pendientes:
+                    continue
+                libro_id, tipo = self._pendientes.popleft()
+                self._en_curso = (libro_id, tipo)
+                self._evento_en_curso = threading.Event()
+                self._cancelar_en_curso = False
+                evento = self._evento_en_curso
+
+            try:
+                self._precalcular(libro_id, tipo)
+            except Exception as e:
+                print(f"⚠️ Error precalculando {tipo} del libro {libro_id}: {e}")
+            finally:
+                with self._cond:
+                    self._en_curso = None
+                    self._evento_en_curso = None
+                evento.set()
+
+    def _precalcular(self, libro_id: int, tipo: str):
+        from ai.query_processor import VERSIONES_PROMPT_STUDIO, ErrorStudio, StudioCancelado, hash_fragmentos
+
+        libros = [l for l in self.db_manager.obtener_libros() if l['id'] == libro_id]
+        fragmentos = self.db_manager.obtener_fragmentos_por_libros([libro_id]) if libros else []
+        if not fragmentos:
+            return
+
+        # Misma clave que usa Studio al pedirlo desde la interfaz
+        modelo = self.query_processor.modelo_studio(tipo)
+        version = VERSIONES_PROMPT_STUDIO[tipo]
+        clave = hash_fragmentos(fragmentos)
+        if self.db_manager.obtener_artefacto_studio(tipo, modelo, version, clave) is not None:
+            return
+
+        inicio = time.monotonic()
+        try:
+            contenido = self.query_processor.generar_studio(
+                tipo, libros, fragmentos, cancelado=lambda: self._cancelar_en_curso or self._detener
+            )
+        except StudioCancelado:
+            contenido = None
+        except ErrorStudio as e:
+            print(f"⚠️ Precálculo de {tipo} del libro {libro_id} falló: {e}")
+            return
+        # También si se canceló durante la llamada final (el resultado se descarta)
+        if contenido is None or self._cancelar_en_curso:
+            print(f"🚫 Precálculo de {tipo} del libro {libro_id} cancelado")
+            return
+        if tipo == "mapa":
+            contenido = contenido.replace("```mermaid", "").replace("```", "").strip()
+
+        self.db_manager.guardar_artefacto_studio(tipo, modelo, version, clave, [libro_id], contenido)
+        self.db_manager.actualizar_studio_libro(libro_id, tipo, contenido)
+        print(f"🪄 Studio precalculado: {tipo} del libro {libro_id} ({time.monotonic() - inicio:.1f}s)")
+
+# Instancia global
+precomputo_studio = PrecomputoStudio()
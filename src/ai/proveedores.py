@@ -0,0 +1,338 @@
+"""
+Proveedores de modelos (chat, embeddings, TTS y transcripción)
+
+El planificador (ai.llm_scheduler) llama siempre a través de un proveedor, que
+se elige con la clave de configuración ia.proveedor:
+
+- "openai": la API de OpenAI con un cliente HTTP compartido.
+- "local": un sustituto determinista y sin red (embeddings por hash, respuestas
+  predefinidas y audio sintético) con un perfil configurable de latencia y
+  errores (ia.proveedor_local), para medir el rendimiento de todo el flujo en
+  CI o en equipos sin conexión.
+
+Las respuestas del proveedor local imitan la forma de las de OpenAI
+(choices[0].message.content, usage, data[i].embedding, ...), de modo que el
+código que las consume no distingue el origen.
+"""
+import hashlib
+import io
+import math
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Iterator, List
+
+from config.config_manager import config_manager
+from ai.context_packer import contar_tokens
+
+# Cabeceras de OpenAI que indican cuándo vuelve a haber cupo tras un 429
+CABECERAS_REINTENTO = ("retry-after-ms", "retry-after", "x-ratelimit-reset-requests",
+                       "x-ratelimit-reset-tokens")
+
+def _segundos_duracion(valor: str) -> float:
+    """Segundos de una duración de cabecera: "12", "1.5s", "20ms" o "6m0s" (0 si no se entiende)"""
+    valor = (valor or "").strip()
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+    unidades = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    partes = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", valor)
+    return sum(float(numero) * unidades[unidad] for numero, unidad in partes)
+
+class ProveedorModelos(ABC):
+    """Interfaz común de los proveedores. Las respuestas tienen la forma de las de OpenAI"""
+
+    nombre = ""
+
+    @abstractmethod
+    def disponible(self) -> bool:
+        """Si el proveedor puede atender llamadas (p.ej. hay API key)"""
+
+    @abstractmethod
+    def chat(self, modelo: str, mensajes: List[Dict], **kwargs):
+        pass
+
+    @abstractmethod
+    def chat_stream(self, modelo: str, mensajes: List[Dict], **kwargs) -> Iterator:
+        """Iterador de chunks (choices[0].delta.content; el último puede traer usage)"""
+
+    @abstractmethod
+    def embeddings(self, modelo: str, entrada):
+        pass
+
+    @abstractmethod
+    def tts(self, modelo: str, voz: str, texto: str, **kwargs):
+        """Respuesta con stream_to_file(ruta) que escribe un MP3"""
+
+    @abstractmethod
+    def transcribir(self, modelo: str, archivo, **kwargs):
+        """Respuesta con .text"""
+
+    def es_error_limite(self, error: Exception) -> bool:
+        """Si el error indica que se superó el límite de solicitudes (429)"""
+        return False
+
+    def espera_limite(self, error: Exception) -> float:
+        """Segundos que pide la API esperar tras un 429 (0 si no lo indica)"""
+        return 0.0
+
+# ============ OPENAI ============
+
+class ProveedorOpenAI(ProveedorModelos):
+    nombre = "openai"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cliente = None
+        self._api_key_cliente = None
+
+    def disponible(self) -> bool:
+        return bool(config_manager.get_api_key())
+
+    @property
+    def cliente(self):
+        """Cliente compartido (pool de conexiones); se recrea si cambia la API key"""
+        api_key = config_manager.get_api_key()
+        if not api_key:
+            raise ValueError("API Key de OpenAI no configurada.")
+        with self._lock:
+            if self._cliente is None or api_key != self._api_key_cliente:
+                import httpx
+                import openai
+                conexiones = config_manager.get_max_conexiones_ia()
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=conexiones, max_keepalive_connections=conexiones),
+                    timeout=httpx.Timeout(600.0, connect=10.0)
+                )
+                self._cliente = openai.OpenAI(api_key=api_key, http_client=http_client)
+                self._api_key_cliente = api_key
+            return self._cliente
+
+    def chat(self, modelo: str, mensajes: List[Dict], **kwargs):
+        return self.cliente.chat.completions.create(model=modelo, messages=mensajes, **kwargs)
+
+    def chat_stream(self, modelo: str, mensajes: List[Dict], **kwargs) -> Iterator:
+        return self.cliente.chat.completions.create(model=modelo, messages=mensajes, stream=True, **kwargs)
+
+    def embeddings(self, modelo: str, entrada):
+        return self.cliente.embeddings.create(model=modelo, input=entrada)
+
+    def tts(self, modelo: str, voz: str, texto: str, **kwargs):
+        return self.cliente.audio.speech.create(model=modelo, voice=voz, input=texto, **kwargs)
+
+    def transcribir(self, modelo: str, archivo, **kwargs):
+        return self.cliente.audio.transcriptions.create(model=modelo, file=archivo, **kwargs)
+
+    def es_error_limite(self, error: Exception) -> bool:
+        import openai
+        return isinstance(error, openai.RateLimitError)
+
+    def espera_limite(self, error: Exception) -> float:
+        respuesta = getattr(error, 'response', None)
+        cabeceras = getattr(respuesta, 'headers', None) or {}
+        esperas = []
+        for nombre in CABECERAS_REINTENTO:
+            valor = cabeceras.get(nombre)
+            if valor:
+                segundos = _segundos_duracion(valor)
+                esperas.append(segundos / 1000 if nombre == "retry-after-ms" else segundos)
+        return max(esperas, default=0.0)
+
+# ============ LOCAL (DETERMINISTA) ============
+
+class ErrorProveedorLocal(Exception):
+    """Fallo simulado por el perfil de errores del proveedor local"""
+
+class LimiteProveedorLocal(ErrorProveedorLocal):
+    """429 simulado por el perfil de errores del proveedor local"""
+
+_PALABRAS_TRANSCRIPCION = (
+    "el", "tribunal", "consideró", "que", "la", "norma", "establece", "derechos",
+    "obligaciones", "de", "las", "partes", "en", "el", "marco", "constitucional",
+    "y", "conforme", "a", "la", "jurisprudencia", "vigente", "sobre", "el", "caso",
+)
+
+def _palabras(texto: str) -> List[str]:
+    return re.findall(r"\w+", texto.lower())
+
+class _AudioSintetico:
+    """Respuesta de TTS local: MP3 con un tono cuya duración depende del texto"""
+
+    def __init__(self, contenido: bytes):
+        self.content = contenido
+
+    def stream_to_file(self, ruta: str):
+        with open(ruta, "wb") as f:
+            f.write(self.content)
+
+    write_to_file = stream_to_file
+
+class ProveedorLocal(ProveedorModelos):
+    """
+    Sustituto sin red. Los embeddings son vectores de palabras con hashing
+    (textos parecidos dan vectores cercanos, así la recuperación tiene sentido);
+    las respuestas se derivan del prompt; el audio es un tono sintético.
+    """
+
+    nombre = "local"
+    CARACTERES_POR_SEGUNDO_AUDIO = 15
+
+    def __init__(self):
+        self.perfil = config_manager.get_perfil_proveedor_local()
+        self.dimensiones = config_manager.get("biblioteca_ia", "embeddings.dimensiones", 1536)
+        self._aleatorio = random.Random(self.perfil.get('semilla', 42))
+        self._lock = threading.Lock()
+
+    def disponible(self) -> bool:
+        return True
+
+    # ---- perfil de latencia y errores ----
+
+    def _sortear(self) -> float:
+        with self._lock:
+            return self._aleatorio.random()
+
+    def _simular(self, tokens_salida: int = 0):
+        """Esperar la latencia del perfil y lanzar los errores que correspondan"""
+        jitter = self.perfil.get('jitter_ms', 0)
+        latencia = (self.perfil.get('latencia_base_ms', 0)
+                    + tokens_salida * self.perfil.get('latencia_por_token_ms', 0)
+                    + (self._sortear() * 2 - 1) * jitter)
+        if latencia > 0:
+            time.sleep(latencia / 1000)
+
+        sorteo = self._sortear()
+        tasa_limite = self.perfil.get('tasa_limite', 0.0)
+        if sorteo < tasa_limite:
+            raise LimiteProveedorLocal("Límite de solicitudes simulado (429)")
+        if sorteo < tasa_limite + self.perfil.get('tasa_error', 0.0):
+            raise ErrorProveedorLocal("Error simulado del proveedor local")
+
+    def es_error_limite(self, error: Exception) -> bool:
+        return isinstance(error, LimiteProveedorLocal)
+
+    # ---- chat ----
+
+    @staticmethod
+    def _terminos_clave(texto: str, cantidad: int = 8) -> List[str]:
+        conteo = Counter(p for p in _palabras(texto) if len(p) > 5 and not p.isdigit())
+        return [p for p, _ in sorted(conteo.items(), key=lambda c: (-c[1], c[0]))[:cantidad]]
+
+    def _completar(self, mensajes: List[Dict]) -> str:
+        """Respuesta predefinida según el tipo de prompt"""
+        prompt = mensajes[-1].get('content') or ""
+        terminos = self._terminos_clave(prompt) or ["contenido"]
+
+        if "mindmap" in prompt:
+            lineas = ["mindmap", f"  root(({terminos[0].capitalize()}))"]
+            for termino in terminos[1:]:
+                lineas += [f"    {termino.capitalize()}", f"      Detalle de {termino}"]
+            return "\n".join(lineas)
+        if "Alex:" in prompt and "Sofi:" in prompt:
+            lineas = []
+            for i, termino in enumerate(terminos):
+                lineas.append(f"Alex: Hoy hablamos de {termino}, uno de los ejes del documento.")
+                lineas.append(f"Sofi: ¿Y por qué {termino} importa tanto? Explícalo con un ejemplo.")
+            return "\n".join(lineas)
+        if "JSON" in prompt:
+            return "[]"
+        return ("Respuesta simulada del proveedor local.\n\n"
+                + "\n".join(f"- **{t.capitalize()}**: tema presente en los fragmentos [Libro, pág. 1]"
+                            for t in terminos))
+
+    def _uso(self, mensajes: List[Dict], respuesta: str) -> SimpleNamespace:
+        entrada = sum(contar_tokens(m.get('content') or "") for m in mensajes)
+        salida = contar_tokens(respuesta)
+        return SimpleNamespace(prompt_tokens=entrada, completion_tokens=salida, total_tokens=entrada + salida)
+
+    def chat(self, modelo: str, mensajes: List[Dict], **kwargs):
+        respuesta = self._completar(mensajes)
+        uso = self._uso(mensajes, respuesta)
+        self._simular(uso.completion_tokens)
+        return SimpleNamespace(
+            model=modelo,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=respuesta))],
+            usage=uso
+        )
+
+    def chat_stream(self, modelo: str, mensajes: List[Dict], **kwargs) -> Iterator:
+        respuesta = self._completar(mensajes)
+        uso = self._uso(mensajes, respuesta)
+        self._simular(0)  # Tiempo hasta el primer token
+        por_token = self.perfil.get('latencia_por_token_ms', 0) / 1000
+
+        for parte in re.findall(r"\S+\s*", respuesta):
+            if por_token:
+                time.sleep(por_token * contar_tokens(parte))
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=parte))], usage=None
+            )
+        if (kwargs.get('stream_options') or {}).get('include_usage'):
+            yield SimpleNamespace(choices=[], usage=uso)
+
+    # ---- embeddings ----
+
+    def _vector(self, texto: str) -> List[float]:
+        """Bolsa de palabras con hashing (índice y signo por palabra), normalizada"""
+        vector = [0.0] * self.dimensiones
+        for palabra in _palabras(texto) or [""]:
+            digest = hashlib.sha256(palabra.encode("utf-8")).digest()
+            indice = int.from_bytes(digest[:4], "little") % self.dimensiones
+            vector[indice] += 1.0 if digest[4] & 1 else -1.0
+        norma = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norma for v in vector]
+
+    def embeddings(self, modelo: str, entrada):
+        textos = [entrada] if isinstance(entrada, str) else list(entrada)
+        tokens = sum(contar_tokens(t) for t in textos)
+        self._simular(0)
+        return SimpleNamespace(
+            model=modelo,
+            data=[SimpleNamespace(index=i, embedding=self._vector(t)) for i, t in enumerate(textos)],
+            usage=SimpleNamespace(prompt_tokens=tokens, completion_tokens=0, total_tokens=tokens)
+        )
+
+    # ---- audio ----
+
+    def tts(self, modelo: str, voz: str, texto: str, **kwargs):
+        from pydub.generators import Sine
+
+        self._simular(0)
+        duracion_ms = max(300, int(len(texto) / self.CARACTERES_POR_SEGUNDO_AUDIO * 1000))
+        # Cada voz con su propio tono para distinguir hablantes al escuchar
+        frecuencia = 220 + int(hashlib.sha256(voz.encode("utf-8")).hexdigest(), 16) % 220
+        tono = Sine(frecuencia).to_audio_segment(duration=duracion_ms, volume=-20)
+        buffer = io.BytesIO()
+        tono.export(buffer, format="mp3")
+        return _AudioSintetico(buffer.getvalue())
+
+    def transcribir(self, modelo: str, archivo, **kwargs):
+        contenido = archivo.read()
+        self._simular(0)
+        semilla = int(hashlib.sha256(contenido).hexdigest()[:8], 16)
+        generador = random.Random(semilla)
+        # ~1 palabra por cada 2 KB de audio comprimido, con un mínimo legible
+        cantidad = max(20, len(contenido) // 2048)
+        palabras = [generador.choice(_PALABRAS_TRANSCRIPCION) for _ in range(cantidad)]
+        nombre = os.path.basename(getattr(archivo, 'name', '') or 'audio')
+        return SimpleNamespace(text=f"[Transcripción simulada de {nombre}] " + " ".join(palabras) + ".")
+
+PROVEEDORES = {
+    ProveedorOpenAI.nombre: ProveedorOpenAI,
+    ProveedorLocal.nombre: ProveedorLocal,
+}
+
+def crear_proveedor(nombre: str) -> ProveedorModelos:
+    """Instanciar un proveedor por nombre (OpenAI si el nombre no se reconoce)"""
+    clase = PROVEEDORES.get(nombre)
+    if clase is None:
+        print(f"⚠️ Proveedor de modelos desconocido '{nombre}', usando OpenAI")
+        clase = ProveedorOpenAI
+    return clase()
@@ -1,14 +1,61 @@
-import openai
 import numpy as np
 import threading
-from typing import List, Dict, Tuple
+import hashlib
+import re
+from typing import Callable, List, Dict, Tuple, Iterator
 from sklearn.metrics.pairwise import cosine_similarity
 from config.config_manager import config_manager
+from ai.context_packer import (ContextPacker, contar_tokens, recortar_a_tokens, ordenar_por_cobertura,
+                               presupuesto_para_modelo)
+from ai.studio_engine import StudioEngine, StudioCancelado
+from ai.llm_scheduler import llm_scheduler, PRIORIDAD_CHAT, PRIORIDAD_STUDIO
+
+SIN_INFORMACION_RELEVANTE = (
+    "No encontré información relevante en los libros para responder tu pregunta. "
+    "Por favor, intenta reformular tu pregunta o agrega más libros al sistema."
+)
+
+# Tokens reservados para las instrucciones fijas de cada prompt
+RESERVA_INSTRUCCIONES = 800
+
+MODELO_PODCAST = "gpt-4-turbo-preview"
+
+# Incrementar la versión de un tipo al cambiar su prompt invalida sus artefactos guardados
+VERSIONES_PROMPT_STUDIO = {"guia": 1, "podcast": 1, "mapa": 1, "informe": 1, "cuestionario": 1}
+
+# Nombre de cada tipo de artefacto de Studio en los mensajes de error
+NOMBRES_STUDIO = {"guia": "guía", "podcast": "guion", "mapa": "mapa mental",
+                  "informe": "informe", "cuestionario": "cuestionario"}
+
+# Tokens de cada respuesta que se conservan al anotarla en el resumen de la conversación
+TOKENS_RESPUESTA_TURNO = 150
+# Fracción del presupuesto del resumen a la que se condensa, para dejar sitio a los turnos siguientes
+FRACCION_RESUMEN_CONDENSADO = 0.5
+# Separa los turnos en el resumen; dentro de un turno las líneas en blanco se compactan
+SEPARADOR_TURNOS = "\n\n"
+
+PROMPT_RESUMEN_CONVERSACION = """
+Resume la siguiente conversación entre un usuario y un asistente de análisis documental.
+Conserva los temas tratados, las conclusiones, los libros y páginas citados y lo que
+quedó pendiente, de modo que se puedan interpretar preguntas de seguimiento.
+Máximo {max_palabras} palabras.
+
+CONVERSACIÓN:
+{conversacion}
+
+RESUMEN:
+"""
+
+def hash_fragmentos(fragmentos: List[Dict]) -> str:
+    """Huella del conjunto de fragmentos de origen (los fragmentos no se modifican, solo se reemplazan)"""
+    ids = sorted(f['id'] for f in fragmentos if f.get('id') is not None)
+    return hashlib.sha256(",".join(map(str, ids)).encode("utf-8")).hexdigest()
+
+class ErrorStudio(Exception):
+    """Falló la generación de un artefacto de Studio (el mensaje es apto para mostrar)"""
 
 class QueryProcessor:
-    def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=config_manager.get_api_key())
-        
+    def __init__(self, prioridad_studio: int = PRIORIDAD_STUDIO):
         # Configuraciones desde la sección específica
         self.modelo_chat = config_manager.get_modelo()
         self.temperatura = config_manager.get_temperatura()
@@ -17,18 +64,30 @@ class QueryProcessor:
         self.max_tokens_respuesta = config_manager.get_max_tokens_respuesta()
         self.incluir_referencias = config_manager.get("biblioteca_ia", "consulta.incluir_referencias", True)
         self.modelo_embeddings = config_manager.get_modelo_embeddings()
+        # Clase de prioridad de las llamadas de Studio (más baja al precalcular en segundo plano)
+        self.prioridad_studio = prioridad_studio
+        # Los resúmenes intermedios usan el modelo de chat (más económico que el de podcast)
+        self.studio_engine = StudioEngine(self.modelo_chat, prioridad=prioridad_studio)
         self.instrucciones_base = """
 Eres un Analista Experto en Derecho y Política (al estilo NotebookLM).
 Tu objetivo es asistir al usuario proporcionando análisis profesionales, profundos y fundamentados sobre temas jurídicos, políticos y de derechos, basándote en fuentes proporcionadas.
 """
     
-    def encontrar_fragmentos_relevantes(self, pregunta: str, fragmentos: List[Dict]) -> Tuple[List[Dict], List[int]]:
-        """Encontrar los fragmentos más relevantes para la pregunta usando operaciones vectorizadas"""
+    def encontrar_fragmentos_relevantes(self, pregunta: str, fragmentos: List[Dict],
+                                        embedding_pregunta: List[float] = None,
+                                        candidatos_previos: List[int] = None) -> Tuple[List[Dict], List[int]]:
+        """
+        Encontrar los fragmentos más relevantes para la pregunta usando operaciones
+        vectorizadas. Los `candidatos_previos` (fragmentos del turno anterior de la
+        conversación) entran con un umbral más bajo: las preguntas de seguimiento
+        ("¿y por qué?") se parecen poco al texto que comentan.
+        """
         try:
             print(f"🔍 Buscando fragmentos relevantes para: '{pregunta[:50]}...'")
             
-            # Generar embedding para la pregunta
-            embedding_pregunta = self._generar_embedding(pregunta)
+            # Generar embedding para la pregunta (si no viene ya calculado)
+            if not embedding_pregunta:
+                embedding_pregunta = self._generar_embedding(pregunta)
             if not embedding_pregunta:
                 print("❌ No se pudo generar embedding para la pregunta")
                 return fragmentos[:self.top_k], []
@@ -50,9 +109,12 @@ Tu objetivo es asistir al usuario proporcionando análisis profesionales, profun
             
             fragmentos_con_similitud = []
             libros_referenciados = set()
+            previos = set(candidatos_previos or [])
+            umbral_previos = self.umbral_similitud - config_manager.get_margen_candidatos_conversacion()
             
             for i, similitud in enumerate(similitudes):
-                if similitud >= self.umbral_similitud:
+                umbral = umbral_previos if fragmentos_con_embedding[i].get('id') in previos else self.umbral_similitud
+                if similitud >= umbral:
                     frag = fragmentos_con_embedding[i]
                     fragmentos_con_similitud.append({
                         **frag,
@@ -72,26 +134,63 @@ Tu objetivo es asistir al usuario proporcionando análisis profesionales, profun
             print(f"❌ Error encontrando fragmentos relevantes: {e}")
             return fragmentos[:self.top_k], []
     
-    def generar_respuesta(self, pregunta: str, fragmentos_relevantes: List[Dict], libros_referenciados: List[int]) -> str:
-        """Generar respuesta usando los fragmentos relevantes"""
-        try:
-            if not fragmentos_relevantes:
-                return "No encontré información relevante en los libros para responder tu pregunta. Por favor, intenta reformular tu pregunta o agrega más libros al sistema."
-            
-            print(f"🤖 Generando respuesta usando {len(fragmentos_relevantes)} fragmentos...")
-            
-            # Construir contexto con los fragmentos relevantes
-            contexto = "\n\n".join([
-                f"[Del libro '{frag.get('libro_titulo', 'Desconocido')}', página {frag.get('pagina', 'N/A')}]: {frag['contenido']}"
-                for frag in fragmentos_relevantes
-            ])
-            
-            # Preparar instrucciones basadas en configuración
-            instrucciones_referencias = ""
-            if self.incluir_referencias and len(libros_referenciados) > 0:
-                instrucciones_referencias = "Incluye referencias a los libros y páginas específicas cuando sea relevante."
-            
-            prompt = f"""
+    def _empaquetar_contexto(self, fragmentos: List[Dict], formato, modelo: str = None,
+                             reserva_respuesta: int = 0, max_tokens_fragmento: int = None,
+                             orden_documento: bool = False) -> Tuple[str, Dict]:
+        """Llenar el presupuesto de contexto del modelo con los fragmentos (en orden de prioridad)"""
+        presupuesto = presupuesto_para_modelo(modelo or self.modelo_chat,
+                                              RESERVA_INSTRUCCIONES + reserva_respuesta)
+        packer = ContextPacker(presupuesto, max_tokens_fragmento=max_tokens_fragmento)
+        return packer.empaquetar(fragmentos, formato, orden_documento=orden_documento)
+
+    def _empaquetar_studio(self, fragmentos: List[Dict], formato, modelo: str = None,
+                           cancelado: Callable[[], bool] = None) -> str:
+        """
+        Contexto para Notebook Studio con cobertura del documento completo: si los
+        fragmentos caben se usan tal cual; si no, se condensan con map-reduce.
+        `cancelado` se consulta entre ventanas y niveles del map-reduce.
+        """
+        presupuesto = presupuesto_para_modelo(modelo or self.modelo_chat,
+                                              RESERVA_INSTRUCCIONES + self.max_tokens_respuesta)
+        total = sum(f.get('token_count') or contar_tokens(f.get('contenido', '')) for f in fragmentos)
+        if total > presupuesto:
+            try:
+                return self.studio_engine.condensar(fragmentos, presupuesto, cancelado=cancelado)
+            except StudioCancelado:
+                raise
+            except Exception as e:
+                print(f"⚠️ Map-reduce no disponible ({e}), usando muestra del documento")
+
+        contexto, _ = self._empaquetar_contexto(
+            ordenar_por_cobertura(fragmentos), formato, modelo,
+            reserva_respuesta=self.max_tokens_respuesta, orden_documento=True
+        )
+        return contexto
+
+    def _construir_mensajes_respuesta(self, pregunta: str, fragmentos_relevantes: List[Dict],
+                                      libros_referenciados: List[int],
+                                      resumen_conversacion: str = None) -> Tuple[List[Dict], Dict]:
+        """Construir los mensajes de chat para responder con los fragmentos relevantes"""
+        # Construir contexto con los fragmentos relevantes, dentro del presupuesto del modelo
+        contexto, informe = self._empaquetar_contexto(
+            fragmentos_relevantes,
+            lambda frag, contenido: f"[Del libro '{frag.get('libro_titulo', 'Desconocido')}', página {frag.get('pagina', 'N/A')}]: {contenido}",
+            reserva_respuesta=self.max_tokens_respuesta + contar_tokens(pregunta) + contar_tokens(resumen_conversacion)
+        )
+        
+        conversacion_previa = ""
+        if resumen_conversacion:
+            conversacion_previa = f"""
+CONVERSACIÓN PREVIA (resumen; úsalo solo para interpretar la pregunta, no como evidencia):
+{resumen_conversacion}
+"""
+        
+        # Preparar instrucciones basadas en configuración
+        instrucciones_referencias = ""
+        if self.incluir_referencias and len(libros_referenciados) > 0:
+            instrucciones_referencias = "Incluye referencias a los libros y páginas específicas cuando sea relevante."
+        
+        prompt = f"""
 {self.instrucciones_base}
 
 CONTEXTO DE LOS DOCUMENTOS:
@@ -107,22 +206,33 @@ INSTRUCCIONES DE ANÁLISIS:
 
 FRAGMENTOS DISPONIBLES:
 {contexto}
-
+{conversacion_previa}
 PREGUNTA DE ANÁLISIS:
 {pregunta}
 
 ANÁLISIS EXPERTO:
 """
+        return [
+            {
+                "role": "system", 
+                "content": "Eres un asistente experto en análisis jurídico, político y de derechos. Tu análisis se basa estrictamente en la evidencia documental proporcionada, manteniendo el rigor académico y profesional."
+            },
+            {"role": "user", "content": prompt}
+        ], informe
+
+    def generar_respuesta(self, pregunta: str, fragmentos_relevantes: List[Dict], libros_referenciados: List[int],
+                          resumen_conversacion: str = None) -> str:
+        """Generar respuesta usando los fragmentos relevantes"""
+        try:
+            if not fragmentos_relevantes:
+                return SIN_INFORMACION_RELEVANTE
+            
+            print(f"🤖 Generando respuesta usando {len(fragmentos_relevantes)} fragmentos...")
             
-            response = self.openai_client.chat.completions.create(
-                model=self.modelo_chat,
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "Eres un asistente experto en análisis jurídico, político y de derechos. Tu análisis se basa estrictamente en la evidencia documental proporcionada, manteniendo el rigor académico y profesional."
-                    },
-                    {"role": "user", "content": prompt}
-                ],
+            mensajes, _ = self._construir_mensajes_respuesta(pregunta, fragmentos_relevantes, libros_referenciados,
+                                                             resumen_conversacion)
+            response = llm_scheduler.chat(
+                mensajes, self.modelo_chat, PRIORIDAD_CHAT, origen="respuesta",
                 temperature=self.temperatura,
                 max_tokens=self.max_tokens_respuesta
             )
@@ -133,15 +243,130 @@ ANÁLISIS EXPERTO:
             
         except Exception as e:
             print(f"❌ Error generando respuesta: {e}")
-            return f"Lo siento, hubo un error al procesar tu consulta: {str(e)}\n\nPor favor, verifica tu conexión a internet y tu configuración de API Key."
+            return self._mensaje_error_respuesta(e)
 
-    def generar_guia_fuente(self, libros: List[Dict], fragmentos: List[Dict]) -> str:
-        """Generar una 'Guía de Fuente' similar a NotebookLM"""
+    def generar_respuesta_stream(self, pregunta: str, fragmentos_relevantes: List[Dict],
+                                 libros_referenciados: List[int], uso: Dict = None,
+                                 resumen_conversacion: str = None) -> Iterator[str]:
+        """
+        Generar la respuesta en streaming, produciendo fragmentos de texto a medida
+        que llegan. Si se pasa `uso`, se completa con 'tokens_contexto' y
+        'fragmentos_ids' (lo que entró en el prompt) y, al terminar, 'total_tokens'.
+        """
+        if not fragmentos_relevantes:
+            yield SIN_INFORMACION_RELEVANTE
+            return
+
+        print(f"🤖 Generando respuesta (streaming) usando {len(fragmentos_relevantes)} fragmentos...")
+        recibido = False
+        partes = []
         try:
-            nombres_libros = ", ".join([l['titulo'] for l in libros])
-            contexto = "\n\n".join([f"[{f.get('libro_titulo')}]: {f['contenido'][:500]}..." for f in fragmentos[:15]])
-            
-            prompt = f"""
+            mensajes, informe = self._construir_mensajes_respuesta(pregunta, fragmentos_relevantes, libros_referenciados,
+                                                                   resumen_conversacion)
+            if uso is not None:
+                uso['tokens_contexto'] = informe['tokens_usados']
+                uso['fragmentos_ids'] = informe['fragmentos_ids']
+
+            stream = llm_scheduler.chat_stream(
+                mensajes, self.modelo_chat, PRIORIDAD_CHAT, origen="respuesta",
+                temperature=self.temperatura,
+                max_tokens=self.max_tokens_respuesta,
+                stream_options={"include_usage": True}
+            )
+
+            for chunk in stream:
+                # El último chunk solo trae el uso de tokens (sin choices)
+                if chunk.usage is not None and uso is not None:
+                    uso['total_tokens'] = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    recibido = True
+                    partes.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+            if uso is not None and not uso.get('total_tokens'):
+                # La API no informó el uso: estimarlo para no guardar 0
+                uso['total_tokens'] = (sum(contar_tokens(m['content']) for m in mensajes)
+                                       + contar_tokens("".join(partes)))
+            print("✅ Respuesta generada exitosamente")
+
+        except Exception as e:
+            print(f"❌ Error generando respuesta: {e}")
+            if uso is not None:
+                uso['error'] = True
+            prefijo = "\n\n" if recibido else ""
+            yield prefijo + self._mensaje_error_respuesta(e)
+
+    def actualizar_resumen_conversacion(self, resumen: str, pregunta: str, respuesta: str) -> str:
+        """
+        Añadir un turno al resumen de la conversación sin superar
+        biblioteca_ia.conversacion.tokens_resumen. Mientras cabe, los turnos se
+        anotan tal cual (sin llamar al modelo); al pasarse, se condensa todo con
+        una llamada corta a la mitad del presupuesto (así caben varios turnos más
+        antes de la siguiente) y, si falla, se descartan los turnos más antiguos.
+        """
+        presupuesto = config_manager.get_tokens_resumen_conversacion()
+        turno = f"Usuario: {pregunta}\nAsistente: {recortar_a_tokens(respuesta, TOKENS_RESPUESTA_TURNO)}"
+        # Sin líneas en blanco internas, SEPARADOR_TURNOS solo aparece entre turnos
+        turno = re.sub(r"\n\s*\n", "\n", turno.strip())
+        nuevo = f"{resumen}{SEPARADOR_TURNOS}{turno}" if resumen else turno
+        if contar_tokens(nuevo) <= presupuesto:
+            return nuevo
+
+        objetivo = max(1, int(presupuesto * FRACCION_RESUMEN_CONDENSADO))
+        try:
+            response = llm_scheduler.chat(
+                [{"role": "user", "content": PROMPT_RESUMEN_CONVERSACION.format(
+                    max_palabras=objetivo * 2 // 3, conversacion=nuevo)}],
+                self.modelo_chat, PRIORIDAD_CHAT, origen="resumen_conversacion",
+                temperature=0.2, max_tokens=objetivo
+            )
+            return recortar_a_tokens(response.choices[0].message.content.strip(), objetivo)
+        except Exception as e:
+            print(f"⚠️ No se pudo resumir la conversación ({e}), conservando los últimos turnos")
+            turnos = nuevo.split(SEPARADOR_TURNOS)
+            while len(turnos) > 1 and contar_tokens(SEPARADOR_TURNOS.join(turnos)) > objetivo:
+                turnos.pop(0)
+            return recortar_a_tokens(SEPARADOR_TURNOS.join(turnos), objetivo)
+
+    def _mensaje_error_respuesta(self, error: Exception) -> str:
+        return f"Lo siento, hubo un error al procesar tu consulta: {str(error)}\n\nPor favor, verifica tu conexión a internet y tu configuración de API Key."
+
+    def modelo_studio(self, tipo: str) -> str:
+        """Modelo que genera cada tipo de artefacto de Studio"""
+        return MODELO_PODCAST if tipo == "podcast" else self.modelo_chat
+
+    def generar_studio(self, tipo: str, libros: List[Dict], fragmentos: List[Dict],
+                       cancelado: Callable[[], bool] = None) -> str:
+        """
+        Generar un artefacto de Studio por tipo: guia, podcast, mapa, informe o
+        cuestionario. Lanza StudioCancelado si `cancelado()` lo detuvo y ErrorStudio
+        si falló la generación.
+        """
+        generadores = {
+            "podcast": self.generar_guion_podcast,
+            "mapa": self.generar_mapa_mental,
+            "informe": self.generar_informe,
+            "cuestionario": self.generar_cuestionario,
+        }
+        try:
+            if tipo == "guia":
+                return self.generar_guia_fuente(libros, fragmentos, cancelado=cancelado)
+            return generadores[tipo](fragmentos, cancelado=cancelado)
+        except StudioCancelado:
+            raise
+        except Exception as e:
+            raise ErrorStudio(f"Error al generar {NOMBRES_STUDIO[tipo]}: {e}") from e
+
+    def generar_guia_fuente(self, libros: List[Dict], fragmentos: List[Dict],
+                           cancelado: Callable[[], bool] = None) -> str:
+        """Generar una 'Guía de Fuente' similar a NotebookLM"""
+        nombres_libros = ", ".join([l['titulo'] for l in libros])
+        contexto = self._empaquetar_studio(
+            fragmentos, lambda f, contenido: f"[{f.get('libro_titulo')}]: {contenido}",
+            cancelado=cancelado
+        )
+        
+        prompt = f"""
 {self.instrucciones_base}
 
 Has recibido los siguientes documentos: {nombres_libros}.
@@ -150,26 +375,25 @@ Genera una 'Guía de Fuente' que incluya:
 2. **Temas Clave**: Una lista de los 5 temas más importantes discutidos.
 3. **Preguntas Sugeridas**: 3 preguntas que el usuario podría hacer para profundizar.
 
-FRAGMENTOS DE MUESTRA:
+CONTENIDO DE LOS DOCUMENTOS:
 {contexto}
 
 GUÍA DE FUENTE:
 """
-            response = self.openai_client.chat.completions.create(
-                model=self.modelo_chat,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Error al generar guía: {str(e)}"
+        response = llm_scheduler.chat(
+            [{"role": "user", "content": prompt}], self.modelo_chat, self.prioridad_studio,
+            origen="guia", temperature=0.7
+        )
+        return response.choices[0].message.content
 
-    def generar_guion_podcast(self, fragmentos: List[Dict]) -> str:
+    def generar_guion_podcast(self, fragmentos: List[Dict], cancelado: Callable[[], bool] = None) -> str:
         """Generar un guion para un 'Audio Overview' (Deep Dive)"""
-        try:
-            contexto = "\n\n".join([f"[{f.get('libro_titulo')}]: {f['contenido']}" for f in fragmentos[:20]])
-            
-            prompt = f"""
+        contexto = self._empaquetar_studio(
+            fragmentos, lambda f, contenido: f"[{f.get('libro_titulo')}]: {contenido}",
+            modelo=MODELO_PODCAST, cancelado=cancelado
+        )
+        
+        prompt = f"""
 Eres un productor de podcasts experto. Tu tarea es convertir el contenido técnico de estos documentos en un diálogo de 'Deep Dive' animado y fácil de entender entre dos locutores: **Alex** (un experto entusiasta) y **Sofi** (una periodista curiosa).
 
 INSTRUCCIONES:
@@ -185,19 +409,16 @@ DOCUMENTOS DE REFERENCIA:
 
 GUION DEL PODCAST:
 """
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Error al generar guion: {str(e)}"
+        response = llm_scheduler.chat(
+            [{"role": "user", "content": prompt}], MODELO_PODCAST, self.prioridad_studio, origen="podcast"
+        )
+        return response.choices[0].message.content
 
-    def generar_mapa_mental(self, fragmentos: List[Dict]) -> str:
+    def generar_mapa_mental(self, fragmentos: List[Dict], cancelado: Callable[[], bool] = None) -> str:
         """Generar un mapa mental en formato Mermaid"""
-        try:
-            contexto = "\n\n".join([f"{f['contenido'][:300]}..." for f in fragmentos[:20]])
-            prompt = f"""
+        contexto = self._empaquetar_studio(fragmentos, lambda f, contenido: contenido,
+                                           cancelado=cancelado)
+        prompt = f"""
 Genera un MAPA MENTAL detallado del contenido proporcionado usando la sintaxis de Mermaid (mindmap).
 
 REGLAS:
@@ -213,20 +434,17 @@ CONTENIDO:
 
 MAPA MENTAL (MERMAID):
 """
-            response = self.openai_client.chat.completions.create(
-                model=self.modelo_chat,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Error al generar mapa mental: {str(e)}"
+        response = llm_scheduler.chat(
+            [{"role": "user", "content": prompt}], self.modelo_chat, self.prioridad_studio,
+            origen="mapa", temperature=0.3
+        )
+        return response.choices[0].message.content
 
-    def generar_informe(self, fragmentos: List[Dict]) -> str:
+    def generar_informe(self, fragmentos: List[Dict], cancelado: Callable[[], bool] = None) -> str:
         """Generar un informe profesional estructurado"""
-        try:
-            contexto = "\n\n".join([f"{f['contenido']}" for f in fragmentos[:25]])
-            prompt = f"""
+        contexto = self._empaquetar_studio(fragmentos, lambda f, contenido: contenido,
+                                           cancelado=cancelado)
+        prompt = f"""
 Genera un INFORME PROFESIONAL Y ESTRUCTURADO basado en los documentos.
 
 ESTRUCTURA REQUERIDA:
@@ -243,20 +461,17 @@ CONTENIDO:
 
 INFORME:
 """
-            response = self.openai_client.chat.completions.create(
-                model=self.modelo_chat,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.5
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Error al generar informe: {str(e)}"
+        response = llm_scheduler.chat(
+            [{"role": "user", "content": prompt}], self.modelo_chat, self.prioridad_studio,
+            origen="informe", temperature=0.5
+        )
+        return response.choices[0].message.content
 
-    def generar_cuestionario(self, fragmentos: List[Dict]) -> str:
+    def generar_cuestionario(self, fragmentos: List[Dict], cancelado: Callable[[], bool] = None) -> str:
         """Generar un cuestionario interactivo de autoevaluación"""
-        try:
-            contexto = "\n\n".join([f"{f['contenido']}" for f in fragmentos[:20]])
-            prompt = f"""
+        contexto = self._empaquetar_studio(fragmentos, lambda f, contenido: contenido,
+                                           cancelado=cancelado)
+        prompt = f"""
 Genera un CUESTIONARIO DE AUTOEVALUACIÓN para que el usuario demuestre que ha entendido el texto.
 
 FORMATO:
@@ -269,22 +484,20 @@ CONTENIDO:
 
 CUESTIONARIO:
 """
-            response = self.openai_client.chat.completions.create(
-                model=self.modelo_chat,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Error al generar cuestionario: {str(e)}"
+        response = llm_scheduler.chat(
+            [{"role": "user", "content": prompt}], self.modelo_chat, self.prioridad_studio,
+            origen="cuestionario", temperature=0.7
+        )
+        return response.choices[0].message.content
+
+    def generar_embedding_pregunta(self, pregunta: str) -> List[float]:
+        """Embedding de una pregunta (lista vacía si falla)"""
+        return self._generar_embedding(pregunta)
 
     def _generar_embedding(self, texto: str) -> List[float]:
         """Generar embedding para un texto"""
         try:
-            response = self.openai_client.embeddings.create(
-                model=self.modelo_embeddings,
-                input=texto
-            )
+            response = llm_scheduler.embeddings(texto, self.modelo_embeddings, PRIORIDAD_CHAT, origen="pregunta")
             return response.data[0].embedding
         except Exception as e:
             print(f"❌ Error generando embedding: {e}")
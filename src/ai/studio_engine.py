@@ -0,0 +1,155 @@
+"""
+Motor map-reduce de Notebook Studio: condensa un libro completo en notas que
+caben en el contexto de un solo prompt.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List
+
+from config.config_manager import config_manager
+from ai.context_packer import contar_tokens, recortar_a_tokens
+from ai.llm_scheduler import llm_scheduler, PRIORIDAD_STUDIO
+
+# Cambiar al modificar PROMPT_RESUMEN: invalida los resúmenes en cache
+VERSION_PROMPT_RESUMEN = 1
+# Niveles máximos de reducción (cada nivel reduce ~8 veces el texto)
+MAX_NIVELES_REDUCCION = 5
+
+PROMPT_RESUMEN = """
+Condensa el siguiente texto en notas de estudio densas y fieles al original.
+Conserva: tesis y argumentos, conceptos y definiciones, datos, nombres propios,
+y las referencias [Libro, pág. X] cuando aparezcan. No agregues información externa.
+Máximo {max_palabras} palabras.
+
+TEXTO:
+{texto}
+
+NOTAS:
+"""
+
+class StudioCancelado(Exception):
+    """El map-reduce se detuvo porque `cancelado()` devolvió True"""
+
+class StudioEngine:
+    """
+    Map: los fragmentos se agrupan en ventanas (orden de lectura) que se resumen
+    en paralelo con concurrencia acotada; cada resumen se guarda por hash de su
+    texto. Reduce: los resúmenes se vuelven a agrupar y resumir por niveles hasta
+    caber en el presupuesto del prompt final.
+    """
+
+    def __init__(self, modelo: str, db_manager=None, prioridad: int = PRIORIDAD_STUDIO):
+        self.modelo = modelo
+        self.prioridad = prioridad
+        self._db_manager = db_manager
+        self.max_concurrencia = max(1, config_manager.get_max_concurrencia_studio())
+        self.tokens_ventana = config_manager.get_tokens_ventana_studio()
+        self.max_palabras_resumen = 250
+        # Equivalente en tokens (~4/3 tokens por palabra) para recortar sin el modelo
+        self.max_tokens_resumen = self.max_palabras_resumen * 4 // 3
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            from database.db_manager import DatabaseManager
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    def condensar(self, fragmentos: List[Dict], presupuesto_tokens: int,
+                  progreso: Callable[[str], None] = None,
+                  cancelado: Callable[[], bool] = None) -> str:
+        """
+        Reducir todos los fragmentos a notas de como máximo `presupuesto_tokens`.
+        Si `cancelado()` devuelve True entre ventanas o niveles lanza StudioCancelado
+        (los resúmenes ya terminados quedan en cache).
+        """
+        ordenados = sorted(fragmentos, key=lambda f: (f.get('libro_id') or 0, f.get('pagina') or 0))
+        bloques = [
+            f"[{f.get('libro_titulo', 'Libro')}, pág. {f.get('pagina', 'N/A')}] {f['contenido']}"
+            for f in ordenados if f.get('contenido')
+        ]
+
+        nivel = 0
+        while True:
+            self._comprobar_cancelacion(cancelado)
+            ventanas = self._agrupar(bloques)
+            if progreso:
+                progreso(f"Resumiendo {len(ventanas)} secciones (nivel {nivel + 1})...")
+            print(f"🗺️ Studio map-reduce nivel {nivel + 1}: {len(bloques)} bloques → {len(ventanas)} ventanas")
+            bloques = self._mapear(ventanas, cancelado)
+            nivel += 1
+
+            total = sum(contar_tokens(b) for b in bloques)
+            if total <= presupuesto_tokens or len(bloques) <= 1 or nivel >= MAX_NIVELES_REDUCCION:
+                break
+
+        notas = "\n\n".join(bloques)
+        if contar_tokens(notas) > presupuesto_tokens:
+            notas = recortar_a_tokens(notas, presupuesto_tokens)
+        return notas
+
+    def _agrupar(self, bloques: List[str]) -> List[str]:
+        """Unir bloques consecutivos en ventanas de hasta tokens_ventana"""
+        ventanas, actual, tokens_actual = [], [], 0
+        for bloque in bloques:
+            tokens = contar_tokens(bloque)
+            if actual and tokens_actual + tokens > self.tokens_ventana:
+                ventanas.append("\n\n".join(actual))
+                actual, tokens_actual = [], 0
+            actual.append(bloque)
+            tokens_actual += tokens
+        if actual:
+            ventanas.append("\n\n".join(actual))
+        return ventanas
+
+    def _hash(self, texto: str) -> str:
+        clave = f"{self.modelo}|{VERSION_PROMPT_RESUMEN}|{texto}"
+        return hashlib.sha256(clave.encode("utf-8")).hexdigest()
+
+    def _comprobar_cancelacion(self, cancelado: Callable[[], bool]):
+        if cancelado and cancelado():
+            raise StudioCancelado("Map-reduce de Studio cancelado")
+
+    def _mapear(self, ventanas: List[str], cancelado: Callable[[], bool] = None) -> List[str]:
+        """Resumir ventanas en paralelo, reutilizando los resúmenes en cache"""
+        hashes = [self._hash(v) for v in ventanas]
+        resumenes = self.db_manager.obtener_resumenes_fragmentos(hashes)
+        pendientes = {h: v for h, v in zip(hashes, ventanas) if h not in resumenes}
+        if len(pendientes) < len(hashes):
+            print(f"♻️ {len(hashes) - len(pendientes)} resúmenes reutilizados de cache")
+
+        nuevos = {}
+        if pendientes:
+            interrumpido = False
+            with ThreadPoolExecutor(max_workers=self.max_concurrencia) as pool:
+                futuros = {pool.submit(self._resumir, texto): h for h, texto in pendientes.items()}
+                for futuro in as_completed(futuros):
+                    h = futuros[futuro]
+                    try:
+                        nuevos[h] = futuro.result()
+                    except Exception as e:
+                        # Sin resumen: se conserva el inicio del texto (no se guarda en cache)
+                        print(f"⚠️ Error resumiendo sección: {e}")
+                        resumenes[h] = recortar_a_tokens(pendientes[h], self.max_tokens_resumen)
+                    if cancelado and cancelado():
+                        # Las ventanas que aún no empezaron no llegan a pedirse
+                        for pendiente in futuros:
+                            pendiente.cancel()
+                        interrumpido = True
+                        break
+
+            resumenes.update(nuevos)
+            self.db_manager.guardar_resumenes_fragmentos(nuevos, self.modelo)
+            if interrumpido:
+                self._comprobar_cancelacion(cancelado)
+
+        return [resumenes[h] for h in hashes]
+
+    def _resumir(self, texto: str) -> str:
+        response = llm_scheduler.chat(
+            [{"role": "user", "content": PROMPT_RESUMEN.format(
+                max_palabras=self.max_palabras_resumen, texto=texto)}],
+            self.modelo, self.prioridad, origen="resumen_studio",
+            temperature=0.2
+        )
+        return response.choices[0].message.content
@@ -48,7 +48,16 @@ class BibliotecaAppManager(QObject):
             # 4. FINALMENTE registrar aplicaciones
             self.register_apps()
             
-            # 5. Configurar aplicación inicial con un pequeño delay
+            # 5. Contabilidad de almacenamiento, limpieza, precálculo de Studio y cola
+            #    de transcripción por lotes en segundo plano
+            from utils.storage_manager import storage_manager
+            storage_manager.iniciar()
+            from ai.precomputo_studio import precomputo_studio
+            precomputo_studio.iniciar()
+            from processing.cola_transcripcion import cola_transcripcion
+            cola_transcripcion.iniciar()
+            
+            # 6. Configurar aplicación inicial con un pequeño delay
             QTimer.singleShot(100, self.setup_initial_app)
             
             self.logger.info("✅ Aplicación iniciada correctamente")
@@ -29,7 +29,39 @@ class ConfigManager:
                 "api_key": "",
                 "modelo": "gpt-3.5-turbo",
                 "temperatura": 0.7,
-                "modelo_whisper": "whisper-1"
+                "modelo_whisper": "whisper-1",
+                # "openai" o "local" (sustituto determinista sin red, para pruebas de carga)
+                "proveedor": "openai",
+                "proveedor_local": {
+                    "latencia_base_ms": 300,
+                    "latencia_por_token_ms": 5,
+                    "jitter_ms": 100,
+                    "tasa_error": 0.0,
+                    "tasa_limite": 0.0,
+                    "semilla": 42
+                },
+                "planificador": {
+                    "max_concurrencia_global": 8,
+                    "max_conexiones": 20,
+                    "limites_modelos": {
+                        "gpt-3.5-turbo": {"rpm": 3500, "tpm": 160000, "max_concurrencia": 6},
+                        "gpt-4": {"rpm": 500, "tpm": 10000, "max_concurrencia": 2},
+                        "gpt-4-turbo-preview": {"rpm": 500, "tpm": 30000, "max_concurrencia": 2},
+                        "text-embedding-ada-002": {"rpm": 3000, "tpm": 1000000, "max_concurrencia": 4},
+                        "tts-1": {"rpm": 50, "tpm": 0, "max_concurrencia": 4},
+                        "whisper-1": {"rpm": 50, "tpm": 0, "max_concurrencia": 4}
+                    },
+                    "limite_por_defecto": {"rpm": 500, "tpm": 30000, "max_concurrencia": 2}
+                },
+                # USD por 1K tokens de entrada/salida, 1K caracteres (TTS) o minuto de audio (Whisper)
+                "precios_modelos": {
+                    "gpt-3.5-turbo": {"entrada_1k": 0.0005, "salida_1k": 0.0015},
+                    "gpt-4": {"entrada_1k": 0.03, "salida_1k": 0.06},
+                    "gpt-4-turbo-preview": {"entrada_1k": 0.01, "salida_1k": 0.03},
+                    "text-embedding-ada-002": {"entrada_1k": 0.0001},
+                    "tts-1": {"caracteres_1k": 0.015},
+                    "whisper-1": {"minuto_audio": 0.006}
+                }
             },
             "almacenamiento": {
                 "ruta_datos": "./data",
@@ -39,7 +71,16 @@ class ConfigManager:
             },
             "transcripcion": {
                 "segment_length_min": 10,
-                "formatear_automaticamente": True
+                "formatear_automaticamente": True,
+                "max_concurrencia": 4,
+                "max_concurrencia_formato": 4,  # Fragmentos formateados con GPT a la vez
+                "archivos_simultaneos": 2,      # Archivos de la cola por lotes procesados a la vez
+                "cortar_en_silencios": True,   # Cortar en pausas en lugar de a mitad de palabra
+                "ventana_silencio_s": 30,      # Cuánto antes del corte nominal se busca una pausa
+                "umbral_silencio_db": -35,
+                "duracion_min_silencio_s": 0.4,
+                "solapamiento_s": 0,           # Audio repetido al inicio de cada segmento
+                "limite_subida_mb": 25         # Límite de tamaño por archivo de la API de Whisper
             },
             "database": {  # NUEVA SECCIÓN PARA CONFIGURACIÓN DE BD
                 "tipo": "sqlite",  # postgresql o sqlite
@@ -80,7 +121,34 @@ class ConfigManager:
                     "umbral_similitud": 0.7,
                     "max_tokens_respuesta": 1500,
                     "incluir_referencias": True,
-                    "temperatura_consulta": 0.3
+                    "temperatura_consulta": 0.3,
+                    "cache_respuestas": True,
+                    "umbral_cache_respuestas": 0.95,
+                    "modo_cache_respuestas": "ofrecer"
+                },
+                "contexto": {
+                    "presupuesto_tokens": 6000,
+                    "presupuestos_por_modelo": {
+                        "gpt-3.5-turbo": 8000,
+                        "gpt-4": 5000,
+                        "gpt-4-turbo-preview": 24000
+                    },
+                    "max_tokens_fragmento": 600
+                },
+                "conversacion": {
+                    "activo": True,
+                    "tokens_resumen": 600,
+                    "margen_candidatos": 0.1
+                },
+                "studio": {
+                    "max_concurrencia": 4,
+                    "tokens_ventana": 3000,
+                    "max_concurrencia_tts": 4,
+                    "precomputo": {
+                        "activo": False,
+                        "tipos": ["guia", "mapa"],
+                        "espera_inactividad_s": 30
+                    }
                 },
                 "ui": {
                     "mostrar_progreso_detallado": True,
@@ -172,6 +240,26 @@ class ConfigManager:
             sqlite_config = self.get_sqlite_config()
             return f"sqlite:///{sqlite_config['ruta_db']}"
     
+    # MÉTODOS PARA TRANSCRIPCIÓN
+    def get_max_concurrencia_transcripcion(self) -> int:
+        return self.get("transcripcion", "max_concurrencia", 4)
+    
+    def get_archivos_simultaneos_transcripcion(self) -> int:
+        return self.get("transcripcion", "archivos_simultaneos", 2)
+    
+    def get_max_concurrencia_formato(self) -> int:
+        return self.get("transcripcion", "max_concurrencia_formato", 4)
+    
+    def get_config_segmentacion(self) -> Dict[str, Any]:
+        return {
+            'cortar_en_silencios': self.get("transcripcion", "cortar_en_silencios", True),
+            'ventana_silencio_s': self.get("transcripcion", "ventana_silencio_s", 30),
+            'umbral_silencio_db': self.get("transcripcion", "umbral_silencio_db", -35),
+            'duracion_min_silencio_s': self.get("transcripcion", "duracion_min_silencio_s", 0.4),
+            'solapamiento_s': self.get("transcripcion", "solapamiento_s", 0),
+            'limite_subida_mb': self.get("transcripcion", "limite_subida_mb", 25)
+        }
+    
     # MÉTODOS ESPECÍFICOS PARA BIBLIOTECA IA
     def get_tamano_fragmento(self) -> int:
         return self.get("biblioteca_ia", "procesamiento.tamano_fragmento", 1000)
@@ -193,6 +281,82 @@ class ConfigManager:
     
     def get_max_tokens_respuesta(self) -> int:
         return self.get("biblioteca_ia", "consulta.max_tokens_respuesta", 1500)
+    
+    def get_cache_respuestas_activo(self) -> bool:
+        return self.get("biblioteca_ia", "consulta.cache_respuestas", True)
+    
+    def get_umbral_cache_respuestas(self) -> float:
+        return self.get("biblioteca_ia", "consulta.umbral_cache_respuestas", 0.95)
+    
+    def get_modo_cache_respuestas(self) -> str:
+        """'ofrecer' (preguntar antes de reutilizar) o 'devolver' (reutilizar directamente)"""
+        return self.get("biblioteca_ia", "consulta.modo_cache_respuestas", "ofrecer")
+    
+    def get_presupuesto_contexto(self, modelo: str) -> int:
+        """Tokens de fragmentos que caben en el prompt para un modelo"""
+        por_modelo = self.get("biblioteca_ia", "contexto.presupuestos_por_modelo",
+                              self.default_config["biblioteca_ia"]["contexto"]["presupuestos_por_modelo"])
+        if modelo in por_modelo:
+            return por_modelo[modelo]
+        return self.get("biblioteca_ia", "contexto.presupuesto_tokens", 6000)
+    
+    def get_max_tokens_fragmento_contexto(self) -> int:
+        return self.get("biblioteca_ia", "contexto.max_tokens_fragmento", 600)
+    
+    def get_conversacion_activa(self) -> bool:
+        return self.get("biblioteca_ia", "conversacion.activo", True)
+    
+    def get_tokens_resumen_conversacion(self) -> int:
+        return self.get("biblioteca_ia", "conversacion.tokens_resumen", 600)
+    
+    def get_margen_candidatos_conversacion(self) -> float:
+        return self.get("biblioteca_ia", "conversacion.margen_candidatos", 0.1)
+    
+    def get_max_concurrencia_studio(self) -> int:
+        return self.get("biblioteca_ia", "studio.max_concurrencia", 4)
+    
+    def get_tokens_ventana_studio(self) -> int:
+        return self.get("biblioteca_ia", "studio.tokens_ventana", 3000)
+    
+    def get_max_concurrencia_tts(self) -> int:
+        return self.get("biblioteca_ia", "studio.max_concurrencia_tts", 4)
+    
+    def get_precomputo_studio_activo(self) -> bool:
+        return self.get("biblioteca_ia", "studio.precomputo.activo", False)
+    
+    def get_tipos_precomputo_studio(self) -> list:
+        return self.get("biblioteca_ia", "studio.precomputo.tipos", ["guia", "mapa"])
+    
+    def get_espera_inactividad_precomputo(self) -> float:
+        return self.get("biblioteca_ia", "studio.precomputo.espera_inactividad_s", 30)
+    
+    def get_proveedor_ia(self) -> str:
+        return self.get("ia", "proveedor", "openai")
+    
+    def get_perfil_proveedor_local(self) -> Dict[str, Any]:
+        """Latencia (ms) y tasas de error/429 simuladas por el proveedor local"""
+        perfil = dict(self.default_config["ia"]["proveedor_local"])
+        perfil.update(self.get("ia", "proveedor_local", {}))
+        return perfil
+    
+    def get_max_concurrencia_global_ia(self) -> int:
+        return self.get("ia", "planificador.max_concurrencia_global", 8)
+    
+    def get_max_conexiones_ia(self) -> int:
+        return self.get("ia", "planificador.max_conexiones", 20)
+    
+    def get_limites_modelo(self, modelo: str) -> Dict[str, int]:
+        """Límites de un modelo: rpm, tpm (0 = sin límite de tokens) y max_concurrencia"""
+        defecto = self.default_config["ia"]["planificador"]
+        limites = dict(self.get("ia", "planificador.limite_por_defecto", defecto["limite_por_defecto"]))
+        por_modelo = self.get("ia", "planificador.limites_modelos", defecto["limites_modelos"])
+        limites.update(por_modelo.get(modelo, {}))
+        return limites
+    
+    def get_precios_modelo(self, modelo: str) -> Dict[str, float]:
+        """Precios de referencia de un modelo para estimar costos (vacío si no se conocen)"""
+        precios = self.get("ia", "precios_modelos", self.default_config["ia"]["precios_modelos"])
+        return precios.get(modelo, {})
 
 # Instancia global
 config_manager = ConfigManager()
\ No newline at end of file
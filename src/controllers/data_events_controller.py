@@ -0,0 +1,25 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from utils.event_bus import event_bus, TODOS_LOS_EVENTOS
+
+class DataEventsController(QObject):
+    """Reenvía los eventos del bus de datos como señal Qt (entrega en el hilo de la UI)"""
+
+    evento_datos = pyqtSignal(str, dict)
+
+    def __init__(self):
+        super().__init__()
+        event_bus.suscribir(TODOS_LOS_EVENTOS, self._reenviar)
+
+    def _reenviar(self, evento: str, datos: dict):
+        """Emitir desde cualquier hilo; Qt encola la entrega a los receptores de la UI"""
+        self.evento_datos.emit(evento, datos)
+
+_controller = None
+
+def get_data_events() -> DataEventsController:
+    """Obtener el controlador compartido (crearlo desde el hilo principal)"""
+    global _controller
+    if _controller is None:
+        _controller = DataEventsController()
+    return _controller
@@ -1,19 +1,27 @@
 import sqlalchemy as sa
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, LargeBinary
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, LargeBinary, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 # Importar JSON para SQLite y JSONB para PostgreSQL
 from sqlalchemy.dialects.postgresql import JSONB
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 import json
 import os
+import threading
+from concurrent.futures import Future
 from config.config_manager import config_manager
-from typing import List, Dict, Any, Optional
+from database.write_queue import obtener_escritor, detener_escritor
+from utils.event_bus import (event_bus, LIBRO_AGREGADO, LIBRO_ELIMINADO, FRAGMENTOS_AGREGADOS,
+                             CONSULTA_GUARDADA, CONSULTA_ELIMINADA, STUDIO_ACTUALIZADO)
 
 Base = declarative_base()
 
+# Fracción de páginas libres a partir de la cual compensa el VACUUM completo
+# que activa auto_vacuum incremental en una base SQLite existente
+FRACCION_LIBRE_CONVERSION = 0.25
+
 # Función para determinar el tipo de columna JSON según el motor de BD
 def get_json_column():
     """Retorna JSONB para PostgreSQL, JSON para otros motores"""
@@ -47,7 +55,7 @@ class Fragmento(Base):
     __tablename__ = 'fragmentos'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    libro_id = Column(Integer, sa.ForeignKey('libros.id'), nullable=False)
+    libro_id = Column(Integer, sa.ForeignKey('libros.id', ondelete='CASCADE'), nullable=False)
     contenido = Column(Text, nullable=False)
     numero_pagina = Column(Integer)
     
@@ -61,7 +69,7 @@ class Fragmento(Base):
     token_count = Column(Integer, default=0)
     fecha_creacion = Column(DateTime, default=datetime.utcnow)
     
-    libro = sa.orm.relationship("Libro", backref="fragmentos")
+    libro = sa.orm.relationship("Libro", backref=sa.orm.backref("fragmentos", passive_deletes=True))
     
 class Consulta(Base):
     __tablename__ = 'consultas'
@@ -76,15 +84,185 @@ class Consulta(Base):
     fecha_consulta = Column(DateTime, default=datetime.utcnow)
     modelo_utilizado = Column(String(100))
     tokens_utilizados = Column(Integer, default=0)
+    # Cache semántico: embedding de la pregunta y ámbito de libros ("*" = todos).
+    # embedding_pregunta se anula cuando cambian los libros del ámbito.
+    if config_manager.get_tipo_bd() == "postgresql":
+        from sqlalchemy.dialects.postgresql import ARRAY
+        embedding_pregunta = Column(ARRAY(Float), nullable=True)
+    else:
+        embedding_pregunta = Column(LargeBinary, nullable=True)
+    clave_ambito = Column(String(500), nullable=True)
+    conversacion_id = Column(Integer, nullable=True)
+
+class Conversacion(Base):
+    """Sesión de chat: resumen acotado de los turnos previos y fragmentos del último turno"""
+    __tablename__ = 'conversaciones'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    resumen = Column(Text, default="")
+    fragmentos_previos = Column(get_json_column(), default=list)
+    turnos = Column(Integer, default=0)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow)
+
+class ResumenFragmento(Base):
+    """Resumen intermedio de Notebook Studio, identificado por el hash de su texto de origen"""
+    __tablename__ = 'resumenes_fragmentos'
+
+    hash_contenido = Column(String(64), primary_key=True)
+    modelo = Column(String(100))
+    resumen = Column(Text, nullable=False)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+
+class ArtefactoStudio(Base):
+    """Salida generada de Notebook Studio para un conjunto de libros (uno o varios)"""
+    __tablename__ = 'artefactos_studio'
+    __table_args__ = (
+        sa.UniqueConstraint('tipo', 'modelo', 'version_prompt', 'hash_fragmentos', name='uq_artefacto_studio'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tipo = Column(String(50), nullable=False)
+    modelo = Column(String(100), nullable=False)
+    version_prompt = Column(Integer, nullable=False)
+    hash_fragmentos = Column(String(64), nullable=False)
+    # ",3,7," permite invalidar con LIKE '%,3,%' en SQLite y PostgreSQL
+    clave_libros = Column(String(500), nullable=False)
+    contenido = Column(Text, nullable=False)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+
+class UsoModelo(Base):
+    """Una llamada a un modelo: tokens, unidades facturables y latencia"""
+    __tablename__ = 'uso_modelos'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    fecha = Column(DateTime, default=datetime.utcnow, index=True)
+    operacion = Column(String(30), nullable=False)  # chat, embeddings, tts, transcripcion
+    modelo = Column(String(100), nullable=False)
+    categoria = Column(String(30))  # Clase de prioridad del planificador
+    origen = Column(String(50))     # Componente que hizo la llamada (respuesta, indice, guia...)
+    tokens_entrada = Column(Integer, default=0)
+    tokens_salida = Column(Integer, default=0)
+    caracteres = Column(Integer, default=0)    # TTS
+    segundos_audio = Column(Float, default=0)  # Whisper
+    latencia_ms = Column(Integer, default=0)
+    espera_ms = Column(Integer, default=0)     # Tiempo en la cola del planificador
+    exito = Column(Boolean, default=True)
+    error = Column(String(300), nullable=True)
+
+class TrabajoTranscripcion(Base):
+    """Transcripción de un archivo de audio con unos parámetros de segmentación concretos"""
+    __tablename__ = 'trabajos_transcripcion'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Hash del contenido del archivo + modelo + parámetros de segmentación
+    clave = Column(String(64), unique=True, nullable=False)
+    hash_archivo = Column(String(64), nullable=False, index=True)
+    ruta_origen = Column(String(1000))
+    modelo = Column(String(100))
+    parametros = Column(get_json_column(), default=dict)
+    estado = Column(String(20), default='en_curso')  # en_curso, completado, error
+    total_segmentos = Column(Integer, nullable=True)  # Se conoce al terminar de cortar
+    error = Column(String(300), nullable=True)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow)
+
+class SegmentoTranscripcion(Base):
+    """Texto de un segmento ya transcrito (permite reanudar un trabajo interrumpido)"""
+    __tablename__ = 'segmentos_transcripcion'
+    __table_args__ = (
+        sa.UniqueConstraint('trabajo_id', 'indice', name='uq_segmento_transcripcion'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    trabajo_id = Column(Integer, nullable=False, index=True)
+    indice = Column(Integer, nullable=False)
+    inicio_s = Column(Float)
+    duracion_s = Column(Float)
+    texto = Column(Text, nullable=False)
+
+class ElementoColaTranscripcion(Base):
+    """Archivo en la cola de transcripción por lotes"""
+    __tablename__ = 'cola_transcripcion'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ruta = Column(String(1000), nullable=False)
+    estado = Column(String(20), default='pendiente', index=True)  # pendiente, en_curso, completado, error, cancelado
+    ruta_salida = Column(String(1000), nullable=True)
+    error = Column(String(300), nullable=True)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow)
 
 class DatabaseManager:
+    # Caches compartidos por todas las instancias. Se mantienen coherentes
+    # escuchando el event_bus, de modo que una escritura hecha desde un hilo
+    # de procesamiento se refleja en la instancia de la UI.
+    _cache_lock = threading.RLock()
+    _libros_cache = None
+    _libros_generacion = 0
+    _last_cache_update = None
+    _fragmentos_cache: Dict[int, List[Dict]] = {}
+    _suscrito_eventos = False
+    _esquemas_verificados = set()
+
     def __init__(self):
         self.tipo_bd = config_manager.get_tipo_bd()
         self.engine = self._crear_engine()
         self.Session = scoped_session(sessionmaker(bind=self.engine))
-        self._libros_cache = None
-        self._last_cache_update = None
+        # SQLite: todas las escrituras pasan por un único hilo escritor
+        self.escritor = self._obtener_escritor()
+        self._suscribir_eventos()
         self.init_database()
+
+    @classmethod
+    def _suscribir_eventos(cls):
+        """Registrar (una sola vez) la invalidación de caches en el event_bus"""
+        with cls._cache_lock:
+            if cls._suscrito_eventos:
+                return
+            for evento in (LIBRO_AGREGADO, LIBRO_ELIMINADO, FRAGMENTOS_AGREGADOS, STUDIO_ACTUALIZADO):
+                event_bus.suscribir(evento, cls._on_evento_datos)
+            cls._suscrito_eventos = True
+
+    @classmethod
+    def _on_evento_datos(cls, evento: str, datos: Dict):
+        """Actualizar los caches de forma incremental según el evento recibido"""
+        with cls._cache_lock:
+            cls._libros_generacion += 1
+            if evento == LIBRO_AGREGADO:
+                # Necesitamos la fila completa: se recarga en la próxima lectura
+                cls._libros_cache = None
+
+            elif evento == LIBRO_ELIMINADO:
+                ids = set(datos.get('libro_ids', []))
+                if cls._libros_cache is not None:
+                    cls._libros_cache = [l for l in cls._libros_cache if l['id'] not in ids]
+                for libro_id in ids:
+                    cls._fragmentos_cache.pop(libro_id, None)
+
+            elif evento == FRAGMENTOS_AGREGADOS:
+                libro_id = datos.get('libro_id')
+                cls._fragmentos_cache.pop(libro_id, None)
+                if 'total' in datos:
+                    cls._reemplazar_libro_cache(libro_id, total_fragmentos=datos['total'])
+
+            elif evento == STUDIO_ACTUALIZADO:
+                campo = datos.get('campo')
+                if campo:
+                    cls._reemplazar_libro_cache(datos.get('libro_id'), **{campo: datos.get('contenido')})
+
+    @classmethod
+    def _reemplazar_libro_cache(cls, libro_id: int, **cambios):
+        """
+        Sustituir la entrada de un libro por una copia con `cambios` (con _cache_lock
+        tomado). Las listas y dicts ya entregados nunca se modifican en sitio.
+        """
+        if cls._libros_cache is None:
+            return
+        cls._libros_cache = [
+            {**libro, **{k: v for k, v in cambios.items() if k in libro}} if libro['id'] == libro_id else libro
+            for libro in cls._libros_cache
+        ]
     
     def _crear_engine(self):
         """Crear engine de SQLAlchemy según la configuración"""
@@ -120,6 +298,8 @@ class DatabaseManager:
                 cursor.execute("PRAGMA synchronous=NORMAL") # Faster writes
                 cursor.execute("PRAGMA cache_size=-64000") # 64MB Cache
                 cursor.execute("PRAGMA temp_store=MEMORY") # RAM for temp tables
+                cursor.execute("PRAGMA foreign_keys=ON") # ON DELETE CASCADE
+                cursor.execute("PRAGMA busy_timeout=10000") # Esperar al escritor en checkpoints
                 cursor.close()
                 
             sa.event.listen(engine, 'connect', set_lite_optimizer)
@@ -127,89 +307,56 @@ class DatabaseManager:
             print("✅ Conectado a SQLite (Optimizado)")
         
         return engine
+
+    def _obtener_escritor(self):
+        """Escritor compartido del archivo SQLite (None en PostgreSQL, que admite escrituras concurrentes)"""
+        if self.tipo_bd == "postgresql":
+            return None
+        return obtener_escritor(config_manager.get_sqlite_config()['ruta_db'])
+
+    def _enviar_escritura(self, trabajo) -> Future:
+        """
+        Enviar un trabajo de escritura trabajo(session) sin esperar su resultado.
+        El trabajo no debe hacer commit: el escritor agrupa varios trabajos en
+        una sola transacción. En PostgreSQL se ejecuta y confirma aquí mismo.
+        """
+        if self.escritor is not None:
+            return self.escritor.enviar(trabajo)
+
+        futuro = Future()
+        session = self.get_session()
+        try:
+            resultado = trabajo(session)
+            session.commit()
+            futuro.set_result(resultado)
+        except Exception as e:
+            session.rollback()
+            futuro.set_exception(e)
+        finally:
+            session.close()
+        return futuro
+
+    def _escribir(self, trabajo):
+        """Ejecutar un trabajo de escritura y esperar su resultado (propaga excepciones)"""
+        return self._enviar_escritura(trabajo).result()
     
     def init_database(self):
+        """
+        Aplicar migraciones pendientes. La verificación se hace una sola vez por
+        base de datos y proceso; las siguientes instancias no tocan el esquema.
+        """
+        cls = DatabaseManager
+        clave = str(self.engine.url)
+        with cls._cache_lock:
+            if clave in cls._esquemas_verificados:
+                return
         try:
-            Base.metadata.create_all(self.engine)
-            
-            # CREAR ÍNDICES PARA BÚSQUEDAS MÁS RÁPIDAS
-            if self.tipo_bd == "postgresql":
-                # Índices para PostgreSQL
-                with self.engine.connect() as conn:
-                    # Índice para búsqueda por similitud de embeddings (PostgreSQL)
-                    conn.execute(sa.text("""
-                        CREATE INDEX IF NOT EXISTS idx_fragmentos_libro_id 
-                        ON fragmentos(libro_id);
-                    """))
-                    conn.execute(sa.text("""
-                        CREATE INDEX IF NOT EXISTS idx_libros_fecha 
-                        ON libros(fecha_procesado DESC);
-                    """))
-                    
-                    # Índice GIN para búsquedas JSONB (solo PostgreSQL)
-                    conn.execute(sa.text("""
-                        CREATE INDEX IF NOT EXISTS idx_libros_metadatos 
-                        ON libros USING GIN (metadatos);
-                    """))
-                
-                self._configurar_postgres_avanzado()
-                    
-            else:
-                # Índices para SQLite
-                with self.engine.connect() as conn:
-                    conn.execute(sa.text("""
-                        CREATE INDEX IF NOT EXISTS idx_fragmentos_libro_id 
-                        ON fragmentos(libro_id);
-                    """))
-                    conn.execute(sa.text("""
-                        CREATE INDEX IF NOT EXISTS idx_libros_titulo 
-                        ON libros(titulo);
-                    """))
-            
-            print("✅ Índices de base de datos optimizados")
-
-            # MIGRACIÓN: Agregar columnas si no existen (SQLite)
-            if self.tipo_bd == "sqlite":
-                with self.engine.connect() as conn:
-                    # Verificar columnas en tabla libros
-                    cursor = conn.execute(sa.text("PRAGMA table_info(libros)"))
-                    columnas = [row[1] for row in cursor.fetchall()]
-                    
-                    if 'guia_fuente' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE libros ADD COLUMN guia_fuente TEXT"))
-                        print("➕ Columna 'guia_fuente' agregada a SQLite")
-                        
-                    if 'guion_podcast' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE libros ADD COLUMN guion_podcast TEXT"))
-                        print("➕ Columna 'guion_podcast' agregada a SQLite")
-                        
-                    if 'mapa_mental' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE libros ADD COLUMN mapa_mental TEXT"))
-                        print("➕ Columna 'mapa_mental' agregada a SQLite")
-                        
-                    if 'informe_estudio' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE libros ADD COLUMN informe_estudio TEXT"))
-                        print("➕ Columna 'informe_estudio' agregada a SQLite")
-                        
-                    if 'cuestionario' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE libros ADD COLUMN cuestionario TEXT"))
-                        print("➕ Columna 'cuestionario' agregada a SQLite")
-                        
-                    if 'ruta_audio_podcast' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE libros ADD COLUMN ruta_audio_podcast TEXT"))
-                        print("➕ Columna 'ruta_audio_podcast' agregada a SQLite")
-                
-                # Verificar columnas en tabla consultas (SQLite)
-                with self.engine.connect() as conn:
-                    cursor = conn.execute(sa.text("PRAGMA table_info(consultas)"))
-                    columnas = [row[1] for row in cursor.fetchall()]
-                    
-                    if 'titulo' not in columnas:
-                        conn.execute(sa.text("ALTER TABLE consultas ADD COLUMN titulo VARCHAR(200)"))
-                        print("➕ Columna 'titulo' agregada a tabla 'consultas' en SQLite")
-            
+            from database.migraciones import aplicar_migraciones
+            aplicar_migraciones(self.engine, self.tipo_bd)
+            with cls._cache_lock:
+                cls._esquemas_verificados.add(clave)
         except Exception as e:
-            print(f"❌ Error optimizando índices: {e}")
+            print(f"❌ Error aplicando migraciones de base de datos: {e}")
 
     def _recrear_base_datos_sqlite(self):
         """Recrear la base de datos SQLite si hay problemas"""
@@ -218,6 +365,7 @@ class DatabaseManager:
             ruta_db = sqlite_config['ruta_db']
             
             # Cerrar conexiones existentes
+            detener_escritor(ruta_db)
             self.Session.remove()
             self.engine.dispose()
             
@@ -229,7 +377,10 @@ class DatabaseManager:
             # Reconectar y recrear
             self.engine = self._crear_engine()
             self.Session = scoped_session(sessionmaker(bind=self.engine))
-            Base.metadata.create_all(self.engine)
+            self.escritor = self._obtener_escritor()
+            with DatabaseManager._cache_lock:
+                DatabaseManager._esquemas_verificados.discard(str(self.engine.url))
+            self.init_database()
             print("✅ Base de datos SQLite recreada exitosamente")
             
         except Exception as e:
@@ -242,8 +393,7 @@ class DatabaseManager:
     def agregar_libro(self, titulo: str, autor: str = None, isbn: str = None, 
                      genero: str = None, total_paginas: int = 0, metadata: Dict = None) -> int:
         """Agregar un nuevo libro a la base de datos"""
-        session = self.get_session()
-        try:
+        def trabajo(session):
             libro = Libro(
                 titulo=titulo,
                 autor=autor,
@@ -253,139 +403,203 @@ class DatabaseManager:
                 metadatos=metadata or {}
             )
             session.add(libro)
-            session.commit()
-            
-            # Invalidate cache
-            self._libros_cache = None
-            
+            session.flush()
             return libro.id
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+
+        libro_id = self._escribir(trabajo)
+        event_bus.publicar(LIBRO_AGREGADO, libro_id=libro_id)
+        return libro_id
+
+    def _actualizar_campo_libro(self, libro_id: int, campo: str, valor) -> bool:
+        """Actualizar una columna de Notebook Studio de un libro y notificarlo"""
+        def trabajo(session):
+            libro = session.get(Libro, libro_id)
+            if not libro:
+                return False
+            setattr(libro, campo, valor)
+            return True
+
+        if not self._escribir(trabajo):
+            return False
+        event_bus.publicar(STUDIO_ACTUALIZADO, libro_id=libro_id, campo=campo, contenido=valor)
+        return True
 
     def actualizar_guia_fuente(self, libro_id: int, guia_texto: str) -> bool:
         """Guardar o actualizar la Guía de Fuente permanente de un libro"""
-        session = self.get_session()
         try:
-            libro = session.query(Libro).get(libro_id)
-            if libro:
-                libro.guia_fuente = guia_texto
-                session.commit()
-                self._libros_cache = None # Invalida cache
-                return True
-            return False
+            return self._actualizar_campo_libro(libro_id, 'guia_fuente', guia_texto)
         except Exception as e:
-            session.rollback()
             print(f"❌ Error actualizando guía de fuente: {e}")
             return False
-        finally:
-            session.close()
 
     def actualizar_guion_podcast(self, libro_id: int, guion_texto: str) -> bool:
         """Guardar o actualizar el guion de podcast permanente de un libro"""
-        session = self.get_session()
         try:
-            libro = session.query(Libro).get(libro_id)
-            if libro:
-                libro.guion_podcast = guion_texto
-                session.commit()
-                self._libros_cache = None
-                return True
-            return False
+            return self._actualizar_campo_libro(libro_id, 'guion_podcast', guion_texto)
         except Exception as e:
-            session.rollback()
             print(f"❌ Error actualizando guion: {e}")
             return False
-        finally:
-            session.close()
 
     def actualizar_ruta_audio_podcast(self, libro_id: int, ruta: str) -> bool:
         """Guardar o actualizar la ruta del audio de podcast de un libro"""
-        session = self.get_session()
         try:
-            libro = session.query(Libro).get(libro_id)
-            if libro:
-                libro.ruta_audio_podcast = ruta
-                session.commit()
-                self._libros_cache = None
-                return True
-            return False
+            return self._actualizar_campo_libro(libro_id, 'ruta_audio_podcast', ruta)
         except Exception as e:
-            session.rollback()
             print(f"❌ Error actualizando ruta de podcast: {e}")
             return False
-        finally:
-            session.close()
     
+    def _serializar_embedding(self, embedding):
+        """PostgreSQL: array nativo; SQLite: bytes float32"""
+        if not embedding:
+            return None
+        if self.tipo_bd == "postgresql":
+            return list(embedding)
+        return np.array(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _deserializar_embedding(valor) -> Optional[np.ndarray]:
+        if valor is None or not len(valor):
+            return None
+        if isinstance(valor, (bytes, bytearray, memoryview)):
+            return np.frombuffer(valor, dtype=np.float32)
+        return np.array(valor, dtype=np.float32)
+
     def agregar_fragmentos(self, libro_id: int, fragmentos: List[Dict]):
         """Agregar fragmentos de texto de un libro con embeddings"""
-        session = self.get_session()
-        try:
-            for fragmento in fragmentos:
-                # Serializar embedding a bytes si existe
-                embedding_data = None
-                if 'embedding' in fragmento and fragmento['embedding']:
-                    if self.tipo_bd == "postgresql":
-                        embedding_data = fragmento['embedding']  # PostgreSQL: array directo
-                    else:
-                        embedding_data = np.array(fragmento['embedding'], dtype=np.float32).tobytes()
-                
-                frag = Fragmento(
-                    libro_id=libro_id,
-                    contenido=fragmento['contenido'],
-                    numero_pagina=fragmento.get('pagina'),
-                    embedding=embedding_data,
-                    token_count=fragmento.get('token_count', 0)
-                )
-                session.add(frag)
-            
+        filas = []
+        for fragmento in fragmentos:
+            # Serializar embedding fuera del hilo escritor
+            filas.append({
+                'libro_id': libro_id,
+                'contenido': fragmento['contenido'],
+                'numero_pagina': fragmento.get('pagina'),
+                'embedding': self._serializar_embedding(fragmento.get('embedding')),
+                'token_count': fragmento.get('token_count', 0)
+            })
+
+        def trabajo(session):
+            session.add_all([Fragmento(**fila) for fila in filas])
+
             # Actualizar contador de fragmentos del libro
-            libro = session.query(Libro).get(libro_id)
+            libro = session.get(Libro, libro_id)
             if libro:
                 libro.total_fragmentos = len(fragmentos)
-            
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+            self._invalidar_artefactos_studio(session, [libro_id])
+            self._invalidar_cache_respuestas(session, [libro_id])
+
+        self._escribir(trabajo)
+        event_bus.publicar(FRAGMENTOS_AGREGADOS, libro_id=libro_id, total=len(fragmentos))
     
     def guardar_consulta(self, pregunta: str, respuesta: str, 
                         libros_referenciados: List[int] = None, 
                         fragmentos_utilizados: List[int] = None,
-                        modelo: str = None, tokens_utilizados: int = 0):
-        """Guardar una consulta y su respuesta"""
-        session = self.get_session()
-        try:
+                        modelo: str = None, tokens_utilizados: int = 0,
+                        embedding_pregunta: List[float] = None, ambito_libros: List[int] = None,
+                        conversacion_id: int = None):
+        """
+        Guardar una consulta y su respuesta. Con `embedding_pregunta` la respuesta
+        queda disponible para el cache semántico del ámbito `ambito_libros` (None = todos).
+        `conversacion_id` la asocia al turno de una conversación.
+        """
+        embedding_data = self._serializar_embedding(embedding_pregunta)
+
+        def trabajo(session):
             consulta = Consulta(
                 pregunta=pregunta,
                 respuesta=respuesta,
                 libros_referenciados=libros_referenciados or [],
                 fragmentos_utilizados=fragmentos_utilizados or [],
                 modelo_utilizado=modelo,
-                tokens_utilizados=tokens_utilizados
+                tokens_utilizados=tokens_utilizados,
+                embedding_pregunta=embedding_data,
+                clave_ambito=self._clave_ambito(ambito_libros),
+                conversacion_id=conversacion_id
             )
             session.add(consulta)
-            session.commit()
+            session.flush()
+            return consulta.id
+
+        consulta_id = self._escribir(trabajo)
+        event_bus.publicar(CONSULTA_GUARDADA, consulta_id=consulta_id,
+                           libros_referenciados=libros_referenciados or [])
+
+    # ============ CONVERSACIONES ============
+
+    def guardar_conversacion(self, conversacion_id: Optional[int], resumen: str,
+                             fragmentos_previos: List[int]) -> int:
+        """
+        Registrar un turno: guarda el resumen acumulado y los fragmentos usados en
+        el turno. Sin `conversacion_id` (o si ya no existe) crea una conversación nueva.
+        Retorna el id de la conversación.
+        """
+        def trabajo(session):
+            conversacion = session.get(Conversacion, conversacion_id) if conversacion_id else None
+            if conversacion is None:
+                conversacion = Conversacion(turnos=0)
+                session.add(conversacion)
+            conversacion.resumen = resumen
+            conversacion.fragmentos_previos = fragmentos_previos or []
+            conversacion.turnos = (conversacion.turnos or 0) + 1
+            conversacion.fecha_actualizacion = datetime.utcnow()
+            session.flush()
+            return conversacion.id
+
+        return self._escribir(trabajo)
+
+    def obtener_conversacion(self, conversacion_id: int) -> Optional[Dict]:
+        """Estado de una conversación (resumen, fragmentos del último turno y turnos), o None"""
+        session = self.get_session()
+        try:
+            conversacion = session.get(Conversacion, conversacion_id)
+            if conversacion is None:
+                return None
+            return {
+                'id': conversacion.id,
+                'resumen': conversacion.resumen or "",
+                'fragmentos_previos': conversacion.fragmentos_previos or [],
+                'turnos': conversacion.turnos or 0
+            }
         except Exception as e:
-            session.rollback()
-            raise e
+            print(f"⚠️ Error leyendo conversación: {e}")
+            return None
         finally:
             session.close()
-    
+
+    def obtener_consultas_conversacion(self, conversacion_id: int) -> List[Dict]:
+        """Turnos de una conversación en orden cronológico"""
+        session = self.get_session()
+        try:
+            consultas = session.query(Consulta.pregunta, Consulta.respuesta)\
+                .filter(Consulta.conversacion_id == conversacion_id)\
+                .order_by(Consulta.fecha_consulta, Consulta.id).all()
+            return [{'pregunta': c.pregunta, 'respuesta': c.respuesta} for c in consultas]
+        except Exception as e:
+            print(f"❌ Error obteniendo conversación: {e}")
+            return []
+        finally:
+            session.close()
+
+    def _eliminar_conversaciones_huerfanas(self, session):
+        """Quitar las conversaciones que se quedaron sin consultas"""
+        con_consultas = session.query(Consulta.conversacion_id).filter(Consulta.conversacion_id.isnot(None))
+        session.query(Conversacion).filter(~Conversacion.id.in_(con_consultas))\
+            .delete(synchronize_session=False)
+
     def obtener_libros(self, force_refresh: bool = False) -> List[Dict]:
-        """Obtener todos los libros (con cache simple)"""
-        if not force_refresh and self._libros_cache is not None:
-            # Verificar si el cache es reciente (opcional, aquí lo usamos siempre hasta que se invalide)
-            return self._libros_cache
+        """
+        Obtener todos los libros (cache compartido, invalidado por eventos). Retorna
+        copias: el llamador puede modificarlas sin afectar al cache ni a otros hilos
+        """
+        cls = DatabaseManager
+        with cls._cache_lock:
+            if not force_refresh and cls._libros_cache is not None:
+                return [dict(libro) for libro in cls._libros_cache]
+            generacion = cls._libros_generacion
 
         session = self.get_session()
         try:
             libros = session.query(Libro).order_by(Libro.fecha_procesado.desc()).all()
-            self._libros_cache = [
+            resultado = [
                 {
                     'id': libro.id,
                     'titulo': libro.titulo,
@@ -406,8 +620,12 @@ class DatabaseManager:
                 }
                 for libro in libros
             ]
-            self._last_cache_update = datetime.utcnow()
-            return self._libros_cache
+            with cls._cache_lock:
+                # No guardar si llegó un evento mientras leíamos (evita cache obsoleto)
+                if cls._libros_generacion == generacion:
+                    cls._libros_cache = resultado
+                    cls._last_cache_update = datetime.utcnow()
+            return [dict(libro) for libro in resultado]
         except Exception as e:
             print(f"❌ Error obteniendo libros: {e}")
             return []
@@ -449,115 +667,496 @@ class DatabaseManager:
     
     def obtener_todos_fragmentos(self) -> List[Dict]:
         """Obtener todos los fragmentos de todos los libros (para búsqueda)"""
-        session = self.get_session()
-        try:
-            fragmentos = session.query(Fragmento, Libro).join(Libro).all()
-            resultado = []
-            
-            for frag, libro in fragmentos:
-                fragmento_dict = {
-                    'id': frag.id,
-                    'libro_id': frag.libro_id,
-                    'contenido': frag.contenido,
-                    'pagina': frag.numero_pagina,
-                    'token_count': frag.token_count,
-                    'libro_titulo': libro.titulo,
-                    'libro_autor': libro.autor
-                }
-                
-                if frag.embedding:
-                    try:
-                        fragmento_dict['embedding'] = np.frombuffer(frag.embedding, dtype=np.float32).tolist()
-                    except Exception as e:
-                        print(f"⚠️ Error convirtiendo embedding: {e}")
-                        fragmento_dict['embedding'] = None
-                
-                resultado.append(fragmento_dict)
-            
-            return resultado
-        except Exception as e:
-            print(f"❌ Error obteniendo todos los fragmentos: {e}")
+        libros_ids = [libro['id'] for libro in self.obtener_libros()]
+        if not libros_ids:
             return []
-        finally:
-            session.close()
-    
+        return self.obtener_fragmentos_por_libros(libros_ids)
+
     def obtener_fragmentos_por_libros(self, libros_ids: List[int]) -> List[Dict]:
-        """Obtener fragmentos solo de los libros especificados"""
+        """
+        Obtener fragmentos solo de los libros especificados.
+        Los fragmentos (con embeddings decodificados) quedan residentes por libro
+        y se invalidan con FRAGMENTOS_AGREGADOS / LIBRO_ELIMINADO.
+        """
+        if not libros_ids:
+            return self.obtener_todos_fragmentos()
+
+        cls = DatabaseManager
+        ids_ordenados = sorted(set(libros_ids))
+        with cls._cache_lock:
+            faltantes = [lid for lid in ids_ordenados if lid not in cls._fragmentos_cache]
+            generacion = cls._libros_generacion
+
+        if faltantes:
+            cargados = self._cargar_fragmentos_libros(faltantes)
+            if cargados is None:
+                return []
+            with cls._cache_lock:
+                if cls._libros_generacion == generacion:
+                    cls._fragmentos_cache.update(cargados)
+        else:
+            cargados = {}
+
+        resultado = []
+        with cls._cache_lock:
+            for lid in ids_ordenados:
+                resultado.extend(cargados.get(lid) or cls._fragmentos_cache.get(lid, []))
+
+        # DEBUG INFO
+        con_emb = len([f for f in resultado if f.get('embedding')])
+        print(f"✅ DB: Obtenidos {len(resultado)} fragmentos para libros {libros_ids} "
+              f"({len(faltantes)} leídos de BD). {con_emb} tienen embeddings.")
+
+        return resultado
+
+    def _cargar_fragmentos_libros(self, libros_ids: List[int]) -> Optional[Dict[int, List[Dict]]]:
+        """Leer de la BD los fragmentos de los libros indicados, agrupados por libro"""
         session = self.get_session()
         try:
-            if not libros_ids:
-                return self.obtener_todos_fragmentos()
-                
             # Usar SQLAlchemy ORM que es más seguro y limpio
             fragmentos = session.query(Fragmento, Libro)\
                 .join(Libro)\
                 .filter(Fragmento.libro_id.in_(libros_ids))\
                 .order_by(Fragmento.libro_id, Fragmento.numero_pagina)\
                 .all()
-            
-            resultado = []
+
+            por_libro = {lid: [] for lid in libros_ids}
             for frag, libro in fragmentos:
                 fragmento_dict = {
                     'id': frag.id,
                     'libro_id': frag.libro_id,
                     'contenido': frag.contenido,
+                    'pagina': frag.numero_pagina,
                     'numero_pagina': frag.numero_pagina,
                     'token_count': frag.token_count,
                     'libro_titulo': libro.titulo,
-                    'libro_autor': libro.autor
+                    'libro_autor': libro.autor,
+                    'embedding': None
                 }
-                
-                if frag.embedding:
+
+                if frag.embedding is not None and len(frag.embedding):
                     try:
-                        fragmento_dict['embedding'] = np.frombuffer(frag.embedding, dtype=np.float32).tolist()
+                        if isinstance(frag.embedding, (bytes, bytearray, memoryview)):
+                            fragmento_dict['embedding'] = np.frombuffer(frag.embedding, dtype=np.float32).tolist()
+                        else:
+                            fragmento_dict['embedding'] = list(frag.embedding)  # PostgreSQL: array nativo
                     except Exception as e:
                         print(f"⚠️ Error convirtiendo embedding ID {frag.id}: {e}")
-                        fragmento_dict['embedding'] = None
-                else:
-                    # DEBUG: Imprimir si falta embedding
-                    # print(f"⚠️ Fragmento ID {frag.id} del libro {frag.libro_id} NO TIENE embedding en BD")
-                    fragmento_dict['embedding'] = None
-                
-                resultado.append(fragmento_dict)
-            
-            # DEBUG INFO
-            con_emb = len([f for f in resultado if f.get('embedding')])
-            print(f"✅ DB: Obtenidos {len(resultado)} fragmentos para libros {libros_ids}. {con_emb} tienen embeddings.")
-            
-            return resultado
-            
+
+                por_libro[frag.libro_id].append(fragmento_dict)
+
+            return por_libro
+
         except Exception as e:
             print(f"❌ Error obteniendo fragmentos por libros: {e}")
+            return None
+        finally:
+            session.close()
+
+    def obtener_resumenes_fragmentos(self, hashes: List[str]) -> Dict[str, str]:
+        """Resúmenes ya calculados para los hashes de contenido indicados"""
+        session = self.get_session()
+        try:
+            resultado = {}
+            hashes = list(set(hashes))
+            for inicio in range(0, len(hashes), 500):
+                filas = session.query(ResumenFragmento.hash_contenido, ResumenFragmento.resumen)\
+                    .filter(ResumenFragmento.hash_contenido.in_(hashes[inicio:inicio + 500])).all()
+                resultado.update({h: r for h, r in filas})
+            return resultado
+        except Exception as e:
+            print(f"⚠️ Error leyendo resúmenes en cache: {e}")
+            return {}
+        finally:
+            session.close()
+
+    def guardar_resumenes_fragmentos(self, resumenes: Dict[str, str], modelo: str):
+        """Guardar (o reemplazar) resúmenes intermedios por hash de contenido"""
+        if not resumenes:
+            return
+
+        def trabajo(session):
+            for hash_contenido, resumen in resumenes.items():
+                session.merge(ResumenFragmento(hash_contenido=hash_contenido, modelo=modelo, resumen=resumen))
+
+        try:
+            self._escribir(trabajo)
+        except Exception as e:
+            print(f"⚠️ Error guardando resúmenes en cache: {e}")
+
+    def obtener_lotes_resumenes_fragmentos(self) -> List[Dict]:
+        """
+        Resúmenes en cache agrupados por día de creación: 'desde' y 'hasta'
+        (fechas extremas del lote), 'filas' y 'bytes' (tamaño del texto)
+        """
+        session = self.get_session()
+        try:
+            filas = session.query(
+                sa.func.min(ResumenFragmento.fecha_creacion),
+                sa.func.max(ResumenFragmento.fecha_creacion),
+                sa.func.count(ResumenFragmento.hash_contenido),
+                sa.func.sum(sa.func.length(ResumenFragmento.resumen))
+            ).group_by(sa.func.date(ResumenFragmento.fecha_creacion)).all()
+            return [
+                {'desde': desde, 'hasta': hasta, 'filas': cantidad, 'bytes': int(tamano or 0)}
+                for desde, hasta, cantidad, tamano in filas if desde is not None
+            ]
+        finally:
+            session.close()
+
+    def eliminar_resumenes_fragmentos(self, desde: datetime, hasta: datetime) -> int:
+        """Eliminar los resúmenes en cache creados entre `desde` y `hasta` (incluidos). Retorna filas"""
+        def trabajo(session):
+            return session.query(ResumenFragmento)\
+                .filter(ResumenFragmento.fecha_creacion >= desde, ResumenFragmento.fecha_creacion <= hasta)\
+                .delete(synchronize_session=False)
+
+        return self._escribir(trabajo)
+
+    @staticmethod
+    def _clave_libros(libros_ids: List[int]) -> str:
+        return "," + ",".join(str(i) for i in sorted(set(libros_ids))) + ","
+
+    def _clave_ambito(self, libros_ids: Optional[List[int]]) -> str:
+        return self._clave_libros(libros_ids) if libros_ids else "*"
+
+    def _invalidar_cache_respuestas(self, session, libros_ids: List[int]):
+        """Retirar del cache semántico las respuestas cuyo ámbito incluye alguno de los libros"""
+        if not libros_ids:
+            return
+        condiciones = [Consulta.clave_ambito == "*"]
+        condiciones += [Consulta.clave_ambito.like(f"%,{int(lid)},%") for lid in libros_ids]
+        session.query(Consulta)\
+            .filter(Consulta.embedding_pregunta.isnot(None), sa.or_(*condiciones))\
+            .update({Consulta.embedding_pregunta: None}, synchronize_session=False)
+
+    def buscar_consulta_similar(self, embedding_pregunta: List[float], ambito_libros: Optional[List[int]],
+                                modelo: str, umbral: float, limite: int = 1000) -> Optional[Dict]:
+        """
+        Consulta previa más parecida (similitud coseno) con el mismo ámbito y modelo.
+        Retorna None si ninguna alcanza el umbral.
+        """
+        session = self.get_session()
+        try:
+            candidatas = session.query(Consulta.id, Consulta.embedding_pregunta)\
+                .filter(Consulta.clave_ambito == self._clave_ambito(ambito_libros),
+                        Consulta.modelo_utilizado == modelo,
+                        Consulta.embedding_pregunta.isnot(None))\
+                .order_by(Consulta.fecha_consulta.desc()).limit(limite).all()
+
+            ids, vectores = [], []
+            for consulta_id, valor in candidatas:
+                vector = self._deserializar_embedding(valor)
+                if vector is not None and len(vector) == len(embedding_pregunta):
+                    ids.append(consulta_id)
+                    vectores.append(vector)
+            if not vectores:
+                return None
+
+            matriz = np.vstack(vectores)
+            consulta_vec = np.array(embedding_pregunta, dtype=np.float32)
+            similitudes = matriz @ consulta_vec / (
+                np.linalg.norm(matriz, axis=1) * np.linalg.norm(consulta_vec) + 1e-10)
+            mejor = int(np.argmax(similitudes))
+            if similitudes[mejor] < umbral:
+                return None
+
+            consulta = session.get(Consulta, ids[mejor])
+            return {
+                'id': consulta.id,
+                'pregunta': consulta.pregunta,
+                'respuesta': consulta.respuesta,
+                'fecha': consulta.fecha_consulta,
+                'libros_referenciados': consulta.libros_referenciados or [],
+                'fragmentos_utilizados': consulta.fragmentos_utilizados or [],
+                'similitud': float(similitudes[mejor])
+            }
+        except Exception as e:
+            print(f"⚠️ Error buscando en el cache de respuestas: {e}")
+            return None
+        finally:
+            session.close()
+
+    def _invalidar_artefactos_studio(self, session, libros_ids: List[int]):
+        """Eliminar artefactos de Studio que incluyan alguno de los libros (dentro de un trabajo de escritura)"""
+        if not libros_ids:
+            return
+        condiciones = [ArtefactoStudio.clave_libros.like(f"%,{int(lid)},%") for lid in libros_ids]
+        session.query(ArtefactoStudio).filter(sa.or_(*condiciones)).delete(synchronize_session=False)
+
+    def obtener_artefacto_studio(self, tipo: str, modelo: str, version_prompt: int,
+                                 hash_fragmentos: str) -> Optional[str]:
+        """Contenido generado previamente para la misma clave, o None"""
+        session = self.get_session()
+        try:
+            artefacto = session.query(ArtefactoStudio.contenido).filter(
+                ArtefactoStudio.tipo == tipo,
+                ArtefactoStudio.modelo == modelo,
+                ArtefactoStudio.version_prompt == version_prompt,
+                ArtefactoStudio.hash_fragmentos == hash_fragmentos
+            ).first()
+            return artefacto[0] if artefacto else None
+        except Exception as e:
+            print(f"⚠️ Error leyendo artefacto de Studio: {e}")
+            return None
+        finally:
+            session.close()
+
+    def guardar_artefacto_studio(self, tipo: str, modelo: str, version_prompt: int,
+                                 hash_fragmentos: str, libros_ids: List[int], contenido: str) -> bool:
+        """Guardar (o reemplazar) un artefacto de Studio para su clave"""
+        def trabajo(session):
+            artefacto = session.query(ArtefactoStudio).filter_by(
+                tipo=tipo, modelo=modelo, version_prompt=version_prompt, hash_fragmentos=hash_fragmentos
+            ).first()
+            if artefacto is None:
+                artefacto = ArtefactoStudio(tipo=tipo, modelo=modelo, version_prompt=version_prompt,
+                                            hash_fragmentos=hash_fragmentos)
+                session.add(artefacto)
+            artefacto.clave_libros = self._clave_libros(libros_ids)
+            artefacto.contenido = contenido
+            artefacto.fecha_creacion = datetime.utcnow()
+
+        try:
+            self._escribir(trabajo)
+            return True
+        except Exception as e:
+            print(f"⚠️ Error guardando artefacto de Studio: {e}")
+            return False
+
+    # ============ TRANSCRIPCIONES ============
+
+    def obtener_trabajo_transcripcion(self, clave: str) -> Optional[Dict]:
+        """Trabajo de transcripción con su clave y los textos de sus segmentos terminados, o None"""
+        session = self.get_session()
+        try:
+            trabajo = session.query(TrabajoTranscripcion).filter_by(clave=clave).first()
+            if trabajo is None:
+                return None
+            segmentos = session.query(SegmentoTranscripcion.indice, SegmentoTranscripcion.texto)\
+                .filter(SegmentoTranscripcion.trabajo_id == trabajo.id).all()
+            return {
+                'id': trabajo.id,
+                'clave': trabajo.clave,
+                'ruta_origen': trabajo.ruta_origen,
+                'estado': trabajo.estado,
+                'total_segmentos': trabajo.total_segmentos,
+                'error': trabajo.error,
+                'segmentos': {indice: texto for indice, texto in segmentos}
+            }
+        except Exception as e:
+            print(f"⚠️ Error leyendo trabajo de transcripción: {e}")
+            return None
+        finally:
+            session.close()
+
+    def iniciar_trabajo_transcripcion(self, clave: str, hash_archivo: str, ruta_origen: str,
+                                      modelo: str, parametros: Dict) -> int:
+        """Crear el trabajo de esa clave (o reabrir uno interrumpido). Retorna su id"""
+        def trabajo(session):
+            registro = session.query(TrabajoTranscripcion).filter_by(clave=clave).first()
+            if registro is None:
+                registro = TrabajoTranscripcion(clave=clave, hash_archivo=hash_archivo, modelo=modelo,
+                                                parametros=parametros)
+                session.add(registro)
+            registro.ruta_origen = ruta_origen
+            registro.estado = 'en_curso'
+            registro.error = None
+            registro.fecha_actualizacion = datetime.utcnow()
+            session.flush()
+            return registro.id
+
+        return self._escribir(trabajo)
+
+    def guardar_segmento_transcripcion(self, trabajo_id: int, indice: int, inicio_s: float,
+                                       duracion_s: float, texto: str):
+        """Guardar el texto de un segmento en cuanto se transcribe"""
+        def trabajo(session):
+            existente = session.query(SegmentoTranscripcion)\
+                .filter_by(trabajo_id=trabajo_id, indice=indice).first()
+            if existente is None:
+                session.add(SegmentoTranscripcion(trabajo_id=trabajo_id, indice=indice, inicio_s=inicio_s,
+                                                  duracion_s=duracion_s, texto=texto))
+            else:
+                existente.texto = texto
+
+        self._escribir(trabajo)
+
+    def finalizar_trabajo_transcripcion(self, trabajo_id: int, total_segmentos: int = None,
+                                        error: str = None):
+        """Marcar el trabajo como completado (con su total de segmentos) o con error"""
+        def trabajo(session):
+            registro = session.get(TrabajoTranscripcion, trabajo_id)
+            if registro is None:
+                return
+            registro.estado = 'error' if error else 'completado'
+            registro.error = error[:300] if error else None
+            if total_segmentos is not None:
+                registro.total_segmentos = total_segmentos
+            registro.fecha_actualizacion = datetime.utcnow()
+
+        try:
+            self._escribir(trabajo)
+        except Exception as e:
+            print(f"⚠️ Error actualizando trabajo de transcripción: {e}")
+
+    # ============ COLA DE TRANSCRIPCIÓN ============
+
+    def _elemento_cola_a_dict(self, elemento: ElementoColaTranscripcion) -> Dict:
+        return {
+            'id': elemento.id,
+            'ruta': elemento.ruta,
+            'estado': elemento.estado,
+            'ruta_salida': elemento.ruta_salida,
+            'error': elemento.error,
+            'fecha_creacion': elemento.fecha_creacion,
+            'fecha_actualizacion': elemento.fecha_actualizacion
+        }
+
+    def agregar_a_cola_transcripcion(self, rutas: List[str]) -> int:
+        """Encolar archivos (se omiten los que ya están pendientes o en curso). Retorna cuántos se agregaron"""
+        def trabajo(session):
+            activas = {r for (r,) in session.query(ElementoColaTranscripcion.ruta)
+                       .filter(ElementoColaTranscripcion.estado.in_(['pendiente', 'en_curso']))}
+            agregadas = 0
+            for ruta in dict.fromkeys(rutas):
+                if ruta in activas:
+                    continue
+                session.add(ElementoColaTranscripcion(ruta=ruta, estado='pendiente'))
+                agregadas += 1
+            return agregadas
+
+        return self._escribir(trabajo)
+
+    def obtener_cola_transcripcion(self) -> List[Dict]:
+        """Elementos de la cola en orden de llegada"""
+        session = self.get_session()
+        try:
+            elementos = session.query(ElementoColaTranscripcion)\
+                .order_by(ElementoColaTranscripcion.id).all()
+            return [self._elemento_cola_a_dict(e) for e in elementos]
+        except Exception as e:
+            print(f"❌ Error obteniendo cola de transcripción: {e}")
             return []
         finally:
             session.close()
 
-    def _configurar_postgres_avanzado(self):
-        """Configuraciones avanzadas para PostgreSQL - pgvector"""
-        try:
-            with self.engine.connect() as conn:
-                # Intentar crear extensión pgvector para búsquedas vectoriales rápidas
-                try:
-                    conn.execute(sa.text("CREATE EXTENSION IF NOT EXISTS vector;"))
-                    print("✅ Extensión pgvector habilitada - Búsquedas vectoriales optimizadas")
-                    
-                    # Opcional: Crear índice para búsquedas por similitud vectorial
-                    # Esto acelera las búsquedas cuando tengas muchos vectores
-                    try:
-                        conn.execute(sa.text("""
-                            CREATE INDEX IF NOT EXISTS idx_fragmentos_embedding 
-                            ON fragmentos USING ivfflat (embedding vector_cosine_ops)
-                            WITH (lists = 100);
-                        """))
-                        print("✅ Índice vectorial creado para búsquedas rápidas")
-                    except Exception as e:
-                        print(f"ℹ️  No se pudo crear índice vectorial: {e}")
-                        
-                except Exception as e:
-                    print(f"ℹ️  pgvector no disponible: {e}. Usando arrays nativos de PostgreSQL")
-                    
+    def tomar_siguiente_cola_transcripcion(self) -> Optional[Dict]:
+        """Marcar como en curso el pendiente más antiguo y retornarlo (None si no hay)"""
+        def trabajo(session):
+            elemento = session.query(ElementoColaTranscripcion)\
+                .filter(ElementoColaTranscripcion.estado == 'pendiente')\
+                .order_by(ElementoColaTranscripcion.id).first()
+            if elemento is None:
+                return None
+            elemento.estado = 'en_curso'
+            elemento.error = None
+            elemento.fecha_actualizacion = datetime.utcnow()
+            return self._elemento_cola_a_dict(elemento)
+
+        return self._escribir(trabajo)
+
+    def actualizar_cola_transcripcion(self, ids: List[int], estado: str, estados_previos: List[str] = None,
+                                      ruta_salida: str = None, error: str = None) -> int:
+        """
+        Cambiar el estado de elementos de la cola (solo los que están en
+        `estados_previos`, si se indica). Retorna cuántos cambiaron.
+        """
+        def trabajo(session):
+            consulta = session.query(ElementoColaTranscripcion)
+            if ids is not None:
+                consulta = consulta.filter(ElementoColaTranscripcion.id.in_(ids))
+            if estados_previos:
+                consulta = consulta.filter(ElementoColaTranscripcion.estado.in_(estados_previos))
+            return consulta.update({
+                ElementoColaTranscripcion.estado: estado,
+                ElementoColaTranscripcion.ruta_salida: ruta_salida,
+                ElementoColaTranscripcion.error: error[:300] if error else None,
+                ElementoColaTranscripcion.fecha_actualizacion: datetime.utcnow()
+            }, synchronize_session=False)
+
+        return self._escribir(trabajo)
+
+    def eliminar_de_cola_transcripcion(self, estados: List[str], ids: List[int] = None) -> int:
+        """Quitar de la cola los elementos en esos estados (de `ids`, o todos). Retorna cuántos"""
+        def trabajo(session):
+            consulta = session.query(ElementoColaTranscripcion)\
+                .filter(ElementoColaTranscripcion.estado.in_(estados))
+            if ids is not None:
+                consulta = consulta.filter(ElementoColaTranscripcion.id.in_(ids))
+            return consulta.delete(synchronize_session=False)
+
+        return self._escribir(trabajo)
+
+    def registrar_uso_modelo(self, registro: Dict):
+        """Registrar una llamada a un modelo sin esperar a la escritura"""
+        def trabajo(session):
+            session.add(UsoModelo(**registro))
+
+        def al_terminar(futuro):
+            if futuro.exception() is not None:
+                print(f"⚠️ Error registrando uso de modelo: {futuro.exception()}")
+
+        try:
+            self._enviar_escritura(trabajo).add_done_callback(al_terminar)
+        except Exception as e:
+            print(f"⚠️ Error registrando uso de modelo: {e}")
+
+    def obtener_resumen_uso_modelos(self, dias: int = 7) -> List[Dict]:
+        """
+        Uso agregado por modelo y origen en los últimos `dias`: llamadas, errores,
+        tokens, caracteres, segundos de audio, latencia y costo estimado
+        """
+        session = self.get_session()
+        try:
+            desde = datetime.utcnow() - timedelta(days=dias)
+            filas = session.query(
+                UsoModelo.modelo, UsoModelo.origen, UsoModelo.operacion,
+                sa.func.count(UsoModelo.id),
+                sa.func.sum(sa.case((UsoModelo.exito == sa.false(), 1), else_=0)),
+                sa.func.sum(UsoModelo.tokens_entrada),
+                sa.func.sum(UsoModelo.tokens_salida),
+                sa.func.sum(UsoModelo.caracteres),
+                sa.func.sum(UsoModelo.segundos_audio),
+                sa.func.sum(UsoModelo.latencia_ms),
+                sa.func.max(UsoModelo.latencia_ms),
+                sa.func.sum(UsoModelo.espera_ms)
+            ).filter(UsoModelo.fecha >= desde)\
+             .group_by(UsoModelo.modelo, UsoModelo.origen, UsoModelo.operacion).all()
+
+            resumen = []
+            for (modelo, origen, operacion, llamadas, errores, entrada, salida,
+                 caracteres, segundos, latencia, latencia_max, espera) in filas:
+                entrada, salida, caracteres = int(entrada or 0), int(salida or 0), int(caracteres or 0)
+                segundos = float(segundos or 0)
+                precios = config_manager.get_precios_modelo(modelo)
+                costo = (entrada / 1000 * precios.get('entrada_1k', 0)
+                         + salida / 1000 * precios.get('salida_1k', 0)
+                         + caracteres / 1000 * precios.get('caracteres_1k', 0)
+                         + segundos / 60 * precios.get('minuto_audio', 0))
+                resumen.append({
+                    'modelo': modelo,
+                    'origen': origen or operacion,
+                    'operacion': operacion,
+                    'llamadas': llamadas,
+                    'errores': int(errores or 0),
+                    'tokens_entrada': entrada,
+                    'tokens_salida': salida,
+                    'caracteres': caracteres,
+                    'segundos_audio': segundos,
+                    'latencia_total_s': (latencia or 0) / 1000,
+                    'latencia_media_ms': int((latencia or 0) / llamadas) if llamadas else 0,
+                    'latencia_max_ms': int(latencia_max or 0),
+                    'espera_media_ms': int((espera or 0) / llamadas) if llamadas else 0,
+                    'costo_estimado': round(costo, 4)
+                })
+            resumen.sort(key=lambda r: r['latencia_total_s'], reverse=True)
+            return resumen
         except Exception as e:
-            print(f"⚠️ Error en configuración PostgreSQL avanzada: {e}")
+            print(f"⚠️ Error obteniendo uso de modelos: {e}")
+            return []
+        finally:
+            session.close()
 
     def obtener_estadisticas(self) -> Dict[str, Any]:
         """Obtener estadísticas del sistema"""
@@ -651,16 +1250,88 @@ class DatabaseManager:
             session.close()
 
     def _calcular_espacio_estimado(self) -> float:
-        """Calcular espacio aproximado usado en MB"""
+        """Calcular espacio usado en MB (BD + directorio de datos)"""
         try:
-            if self.tipo_bd == "sqlite":
-                db_path = config_manager.get_sqlite_config()['ruta_db']
-                if os.path.exists(db_path):
-                    return round(os.path.getsize(db_path) / (1024 * 1024), 2)
-            return 0.0
-        except:
+            from utils.storage_manager import storage_manager
+            return round(storage_manager.obtener_total_bytes() / (1024 * 1024), 2)
+        except Exception:
             return 0.0
         
+    def obtener_uso_almacenamiento_libros(self) -> Dict[int, Dict[str, int]]:
+        """
+        Bytes aproximados que ocupa cada libro en la BD, por categoría:
+        texto de fragmentos, embeddings y contenido de Notebook Studio.
+        """
+        session = self.get_session()
+        try:
+            if self.tipo_bd == "postgresql":
+                bytes_embedding = sa.func.coalesce(sa.func.array_length(Fragmento.embedding, 1), 0) * 8
+            else:
+                bytes_embedding = sa.func.coalesce(sa.func.length(Fragmento.embedding), 0)
+
+            uso = {}
+            filas = session.query(
+                Fragmento.libro_id,
+                sa.func.sum(sa.func.length(Fragmento.contenido)),
+                sa.func.sum(bytes_embedding)
+            ).group_by(Fragmento.libro_id).all()
+            for libro_id, texto, embeddings in filas:
+                uso[libro_id] = {'fragmentos': int(texto or 0), 'embeddings': int(embeddings or 0), 'studio': 0}
+
+            columnas_studio = (Libro.guia_fuente, Libro.guion_podcast, Libro.mapa_mental,
+                               Libro.informe_estudio, Libro.cuestionario)
+            bytes_studio = sum(sa.func.coalesce(sa.func.length(col), 0) for col in columnas_studio)
+            for libro_id, studio in session.query(Libro.id, bytes_studio).all():
+                uso.setdefault(libro_id, {'fragmentos': 0, 'embeddings': 0, 'studio': 0})
+                uso[libro_id]['studio'] = int(studio or 0)
+
+            return uso
+        except Exception as e:
+            print(f"❌ Error contabilizando almacenamiento por libro: {e}")
+            return {}
+        finally:
+            session.close()
+
+    def compactar_base_datos(self, max_paginas: int = 0, checkpoint: bool = False,
+                             convertir: bool = False) -> int:
+        """
+        Devolver al disco las páginas libres de SQLite con PRAGMA incremental_vacuum
+        (0 = todas). Sin páginas libres no hace nada salvo el checkpoint del WAL si
+        se pide. Activar auto_vacuum=INCREMENTAL exige un VACUUM completo (bloquea
+        las escrituras y necesita el doble de disco): solo se hace con `convertir`
+        o si las páginas libres superan FRACCION_LIBRE_CONVERSION de la base.
+        Retorna las páginas liberadas.
+        """
+        if self.escritor is None:
+            return 0  # PostgreSQL: lo resuelve autovacuum
+
+        def trabajo(conexion):
+            cursor = conexion.cursor()
+            try:
+                libres = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                paginas = 0
+                if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    total = cursor.execute("PRAGMA page_count").fetchone()[0]
+                    if convertir or (libres and libres >= total * FRACCION_LIBRE_CONVERSION):
+                        print("🔧 Activando auto_vacuum incremental (VACUUM único)...")
+                        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                        cursor.execute("VACUUM")
+                        paginas = libres
+                elif libres:
+                    paginas = min(libres, max_paginas) if max_paginas else libres
+                    cursor.execute(f"PRAGMA incremental_vacuum({paginas})").fetchall()
+                if paginas or checkpoint:
+                    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+                return paginas
+            finally:
+                cursor.close()
+
+        try:
+            return self.escritor.enviar_mantenimiento(trabajo).result()
+        except Exception as e:
+            print(f"⚠️ No se pudo compactar la base de datos: {e}")
+            return 0
+
     def buscar_libros_por_metadata(self, criterios: Dict) -> List[Dict]:
         """Buscar libros por criterios en metadatos"""
         session = self.get_session()
@@ -781,77 +1452,100 @@ class DatabaseManager:
             print(f"❌ Error actualizando actividad reciente: {e}")
     def actualizar_studio_libro(self, libro_id: int, tipo: str, contenido: str) -> bool:
         """Actualizar el contenido de Notebook Studio para un libro"""
-        session = self.get_session()
+        campos = {"guia": "guia_fuente", "podcast": "guion_podcast", "mapa": "mapa_mental",
+                  "informe": "informe_estudio", "cuestionario": "cuestionario"}
+        campo = campos.get(tipo)
+        if not campo:
+            return False
         try:
-            libro = session.query(Libro).filter(Libro.id == libro_id).first()
-            if not libro:
-                return False
-                
-            if tipo == "mapa":
-                libro.mapa_mental = contenido
-            elif tipo == "informe":
-                libro.informe_estudio = contenido
-            elif tipo == "cuestionario":
-                libro.cuestionario = contenido
-            else:
+            if not self._actualizar_campo_libro(libro_id, campo, contenido):
                 return False
-                
-            session.commit()
-            self._libros_cache = None # Invalida cache
             print(f"✅ Notebook Studio: {tipo} actualizado para libro {libro_id}")
             return True
         except Exception as e:
-            session.rollback()
             print(f"❌ Error actualizando studio de libro: {e}")
             return False
-        finally:
-            session.close()
 
     def eliminar_libro(self, libro_id: int) -> bool:
         """Eliminar un libro y todos sus fragmentos"""
-        session = self.get_session()
+        return self.eliminar_libros([libro_id]) > 0
+
+    def eliminar_libros(self, libros_ids: List[int]) -> int:
+        """
+        Eliminar varios libros con sus fragmentos (texto y embeddings) en una sola
+        transacción, con una sentencia DELETE por tabla. Retorna los libros eliminados.
+        """
+        if not libros_ids:
+            return 0
+
+        def trabajo(session):
+            rutas = [
+                r[0] for r in session.query(Libro.ruta_audio_podcast)
+                .filter(Libro.id.in_(libros_ids), Libro.ruta_audio_podcast.isnot(None)).all()
+            ]
+
+            # Las tablas creadas antes de ON DELETE CASCADE no lo tienen,
+            # así que los fragmentos se borran de forma explícita
+            session.query(Fragmento).filter(Fragmento.libro_id.in_(libros_ids))\
+                .delete(synchronize_session=False)
+            total = session.query(Libro).filter(Libro.id.in_(libros_ids))\
+                .delete(synchronize_session=False)
+            self._invalidar_artefactos_studio(session, libros_ids)
+            self._invalidar_cache_respuestas(session, libros_ids)
+            return total, rutas
+
         try:
-            # Eliminar fragmentos primero (por la foreign key)
-            session.query(Fragmento).filter(Fragmento.libro_id == libro_id).delete()
-            
-            # Eliminar el libro
-            libro = session.query(Libro).get(libro_id)
-            if libro:
-                session.delete(libro)
-            
-            session.commit()
-            return True
+            eliminados, rutas_audio = self._escribir(trabajo)
         except Exception as e:
-            session.rollback()
-            print(f"❌ Error eliminando libro: {e}")
-            return False
-        finally:
-            self._libros_cache = None  # Invalida cache
-            session.close()
-    
+            print(f"❌ Error eliminando libros: {e}")
+            return 0
+
+        # Los audios de podcast son artefactos en disco ligados al libro
+        for ruta in rutas_audio:
+            try:
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            except OSError as e:
+                print(f"⚠️ No se pudo eliminar audio {ruta}: {e}")
+
+        event_bus.publicar(LIBRO_ELIMINADO, libro_ids=list(libros_ids))
+        print(f"🗑️ {eliminados} libro(s) eliminados")
+        return eliminados
+
+    def _filtrar_consultas(self, session, query, busqueda: str = None):
+        """Aplicar el filtro de búsqueda por texto y títulos de libros a una query de consultas"""
+        if not busqueda:
+            return query
+
+        # % y _ del texto buscado se comparan literalmente
+        patron = "%" + busqueda.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+        # Buscar IDs de libros que coincidan con el título
+        libros_match = session.query(Libro.id).filter(Libro.titulo.ilike(patron, escape="\\")).all()
+        libros_ids = {l[0] for l in libros_match}
+
+        filters = [
+            Consulta.pregunta.ilike(patron, escape="\\"),
+            Consulta.respuesta.ilike(patron, escape="\\")
+        ]
+
+        # libros_referenciados es una lista JSON: se compara por ID exacto en Python
+        # (un LIKE sobre el texto haría coincidir el libro 3 con el 13 o el 30)
+        if libros_ids:
+            referencias = session.query(Consulta.id, Consulta.libros_referenciados)\
+                .filter(Consulta.libros_referenciados.isnot(None)).all()
+            consultas_ids = [cid for cid, refs in referencias if libros_ids.intersection(refs or [])]
+            if consultas_ids:
+                filters.append(Consulta.id.in_(consultas_ids))
+
+        return query.filter(sa.or_(*filters))
+
     def obtener_historial_consultas(self, limite: int = 50, busqueda: str = None) -> List[Dict]:
         """Obtener historial con soporte para búsqueda por texto y títulos de libros"""
         session = self.get_session()
         try:
-            query = session.query(Consulta)
-            
             # Si hay búsqueda, filtrar por pregunta, respuesta o intentar buscar por libro
-            if busqueda:
-                # Buscar IDs de libros que coincidan con el título
-                libros_match = session.query(Libro.id).filter(Libro.titulo.ilike(f"%{busqueda}%")).all()
-                libros_ids = [l[0] for l in libros_match]
-                
-                filters = [
-                    Consulta.pregunta.ilike(f"%{busqueda}%"),
-                    Consulta.respuesta.ilike(f"%{busqueda}%")
-                ]
-                
-                # Para SQLite/JSON, la búsqueda en libros_referenciados es más compleja, 
-                # así que complementamos con una búsqueda de IDs si encontramos libros que coincidan
-                for lid in libros_ids:
-                    filters.append(sa.text(f"libros_referenciados LIKE '%{lid}%'"))
-                
-                query = query.filter(sa.or_(*filters))
+            query = self._filtrar_consultas(session, session.query(Consulta), busqueda)
             
             consultas = query.order_by(Consulta.fecha_consulta.desc()).limit(limite).all()
             
@@ -875,7 +1569,8 @@ class DatabaseManager:
                     'fecha': c.fecha_consulta,
                     'libros_referenciados': c.libros_referenciados,
                     'libros_titulos': [nombres_libros.get(lid, f"Libro {lid}") for lid in (c.libros_referenciados or [])],
-                    'modelo': c.modelo_utilizado
+                    'modelo': c.modelo_utilizado,
+                    'conversacion_id': c.conversacion_id
                 }
                 for c in consultas
             ]
@@ -887,35 +1582,64 @@ class DatabaseManager:
 
     def eliminar_consulta(self, consulta_id: int) -> bool:
         """Eliminar una consulta específica del historial"""
-        session = self.get_session()
+        def trabajo(session):
+            eliminadas = session.query(Consulta).filter(Consulta.id == consulta_id)\
+                .delete(synchronize_session=False)
+            self._eliminar_conversaciones_huerfanas(session)
+            return eliminadas
+
         try:
-            consulta = session.query(Consulta).filter(Consulta.id == consulta_id).first()
-            if consulta:
-                session.delete(consulta)
-                session.commit()
-                return True
-            return False
+            if not self._escribir(trabajo):
+                return False
         except Exception as e:
-            session.rollback()
             print(f"❌ Error eliminando consulta: {e}")
             return False
+
+        event_bus.publicar(CONSULTA_ELIMINADA, consulta_ids=[consulta_id])
+        return True
+
+    def eliminar_consultas(self, consulta_ids: List[int] = None, busqueda: str = None,
+                           antes_de: datetime = None) -> int:
+        """
+        Eliminar en bloque consultas del historial con una sola sentencia DELETE.
+        Sin filtros elimina todo el historial. Retorna el número de filas eliminadas.
+        """
+        def trabajo(session):
+            query = self._filtrar_consultas(session, session.query(Consulta), busqueda)
+            if consulta_ids is not None:
+                query = query.filter(Consulta.id.in_(consulta_ids))
+            if antes_de is not None:
+                query = query.filter(Consulta.fecha_consulta < antes_de)
+            eliminadas = query.delete(synchronize_session=False)
+            self._eliminar_conversaciones_huerfanas(session)
+            return eliminadas
+
+        try:
+            eliminadas = self._escribir(trabajo)
+        except Exception as e:
+            print(f"❌ Error eliminando consultas: {e}")
+            return 0
+
+        event_bus.publicar(CONSULTA_ELIMINADA, consulta_ids=consulta_ids, total=eliminadas)
+        return eliminadas
+
     def actualizar_titulo_consulta(self, consulta_id: int, nuevo_titulo: str) -> bool:
         """Actualizar el título personalizado de una consulta del historial"""
-        session = self.get_session()
+        def trabajo(session):
+            consulta = session.get(Consulta, consulta_id)
+            if not consulta:
+                return False
+            consulta.titulo = nuevo_titulo
+            return True
+
         try:
-            consulta = session.query(Consulta).filter(Consulta.id == consulta_id).first()
-            if consulta:
-                consulta.titulo = nuevo_titulo
-                session.commit()
-                print(f"✅ Historial {consulta_id} renombrado a: {nuevo_titulo}")
-                return True
-            return False
+            if not self._escribir(trabajo):
+                return False
+            print(f"✅ Historial {consulta_id} renombrado a: {nuevo_titulo}")
+            return True
         except Exception as e:
-            session.rollback()
             print(f"❌ Error al renombrar historial: {e}")
             return False
-        finally:
-            session.close()
 
     def probar_conexion(self) -> bool:
         """Probar la conexión a la base de datos"""
@@ -0,0 +1,164 @@
+"""
+Migraciones versionadas del esquema de base de datos (SQLite y PostgreSQL)
+
+Cada migración es una función (conn, tipo_bd) que se ejecuta dentro de una
+transacción. Para agregar un cambio de esquema se añade una función nueva al
+final de MIGRACIONES; nunca se modifica una migración ya publicada.
+"""
+import sqlalchemy as sa
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from database.db_manager import (Base, Libro, Fragmento, Consulta, ResumenFragmento, ArtefactoStudio,
+                                 UsoModelo, Conversacion, TrabajoTranscripcion, SegmentoTranscripcion,
+                                 ElementoColaTranscripcion)
+
+_metadata_version = sa.MetaData()
+
+schema_version = sa.Table(
+    'schema_version', _metadata_version,
+    sa.Column('version', sa.Integer, primary_key=True),
+    sa.Column('descripcion', sa.String(200)),
+    sa.Column('fecha_aplicada', sa.DateTime, default=datetime.utcnow)
+)
+
+# ============ UTILIDADES ============
+
+def _columnas(conn, tabla: str) -> List[str]:
+    """Nombres de las columnas existentes de una tabla"""
+    return [col['name'] for col in sa.inspect(conn).get_columns(tabla)]
+
+def _agregar_columna(conn, tabla: str, columna: str, tipo_sql: str):
+    """ALTER TABLE ADD COLUMN solo si la columna no existe (idempotente)"""
+    if columna not in _columnas(conn, tabla):
+        conn.execute(sa.text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo_sql}"))
+        print(f"➕ Columna '{columna}' agregada a '{tabla}'")
+
+def _crear_indice(conn, nombre: str, definicion: str):
+    """CREATE INDEX IF NOT EXISTS (soportado por SQLite y PostgreSQL)"""
+    conn.execute(sa.text(f"CREATE INDEX IF NOT EXISTS {nombre} ON {definicion}"))
+
+def _crear_tablas(conn, *modelos):
+    """Crear las tablas de los modelos indicados si no existen"""
+    Base.metadata.create_all(conn, tables=[m.__table__ for m in modelos])
+
+# ============ MIGRACIONES ============
+
+def _v1_esquema_base(conn, tipo_bd: str):
+    """Tablas principales, columnas de Notebook Studio e índices originales"""
+    _crear_tablas(conn, Libro, Fragmento, Consulta)
+
+    # Bases de datos anteriores a Notebook Studio / historial renombrable
+    for columna in ('guia_fuente', 'guion_podcast', 'mapa_mental',
+                    'informe_estudio', 'cuestionario', 'ruta_audio_podcast'):
+        _agregar_columna(conn, 'libros', columna, 'TEXT')
+    _agregar_columna(conn, 'consultas', 'titulo', 'VARCHAR(200)')
+
+    _crear_indice(conn, 'idx_fragmentos_libro_id', 'fragmentos(libro_id)')
+    if tipo_bd == "postgresql":
+        _crear_indice(conn, 'idx_libros_fecha', 'libros(fecha_procesado DESC)')
+        _crear_indice(conn, 'idx_libros_metadatos', 'libros USING GIN (metadatos)')
+
+        # pgvector es opcional: un fallo no debe abortar la transacción
+        try:
+            with conn.begin_nested():
+                conn.execute(sa.text("CREATE EXTENSION IF NOT EXISTS vector"))
+            print("✅ Extensión pgvector habilitada")
+        except Exception as e:
+            print(f"ℹ️  pgvector no disponible: {e}. Usando arrays nativos de PostgreSQL")
+    else:
+        _crear_indice(conn, 'idx_libros_titulo', 'libros(titulo)')
+
+def _v2_indices_bibliotecas_grandes(conn, tipo_bd: str):
+    """Índices para historial y lectura ordenada de fragmentos en bibliotecas grandes"""
+    _crear_indice(conn, 'idx_fragmentos_libro_pagina', 'fragmentos(libro_id, numero_pagina)')
+    _crear_indice(conn, 'idx_consultas_fecha', 'consultas(fecha_consulta DESC)')
+    if tipo_bd != "postgresql":
+        _crear_indice(conn, 'idx_libros_fecha', 'libros(fecha_procesado DESC)')
+
+def _v3_resumenes_fragmentos(conn, tipo_bd: str):
+    """Cache de resúmenes intermedios (map-reduce) de Notebook Studio"""
+    _crear_tablas(conn, ResumenFragmento)
+
+def _v4_artefactos_studio(conn, tipo_bd: str):
+    """Artefactos de Studio por conjunto de fragmentos (incluye selecciones de varios libros)"""
+    _crear_tablas(conn, ArtefactoStudio)
+
+def _v5_cache_respuestas(conn, tipo_bd: str):
+    """Embedding de la pregunta y ámbito de libros en consultas (cache semántico)"""
+    tipo_embedding = 'FLOAT[]' if tipo_bd == "postgresql" else 'BLOB'
+    _agregar_columna(conn, 'consultas', 'embedding_pregunta', tipo_embedding)
+    _agregar_columna(conn, 'consultas', 'clave_ambito', 'VARCHAR(500)')
+    _crear_indice(conn, 'idx_consultas_ambito', 'consultas(clave_ambito, modelo_utilizado)')
+
+def _v6_uso_modelos(conn, tipo_bd: str):
+    """Registro de llamadas a modelos (tokens, unidades facturables y latencia)"""
+    _crear_tablas(conn, UsoModelo)
+    _crear_indice(conn, 'idx_uso_modelos_modelo_origen', 'uso_modelos(modelo, origen)')
+
+def _v7_conversaciones(conn, tipo_bd: str):
+    """Conversaciones de chat con resumen acotado; las consultas indican su conversación"""
+    _crear_tablas(conn, Conversacion)
+    _agregar_columna(conn, 'consultas', 'conversacion_id', 'INTEGER')
+    _crear_indice(conn, 'idx_consultas_conversacion', 'consultas(conversacion_id)')
+
+def _v8_trabajos_transcripcion(conn, tipo_bd: str):
+    """Trabajos de transcripción reanudables con el texto de cada segmento"""
+    _crear_tablas(conn, TrabajoTranscripcion, SegmentoTranscripcion)
+
+def _v9_cola_transcripcion(conn, tipo_bd: str):
+    """Cola persistente de transcripción por lotes"""
+    _crear_tablas(conn, ElementoColaTranscripcion)
+
+MIGRACIONES: List[Tuple[int, str, Callable]] = [
+    (1, "Esquema base", _v1_esquema_base),
+    (2, "Índices para bibliotecas grandes", _v2_indices_bibliotecas_grandes),
+    (3, "Cache de resúmenes de Notebook Studio", _v3_resumenes_fragmentos),
+    (4, "Cache de artefactos de Notebook Studio", _v4_artefactos_studio),
+    (5, "Cache semántico de respuestas", _v5_cache_respuestas),
+    (6, "Contabilidad de uso de modelos", _v6_uso_modelos),
+    (7, "Conversaciones de chat", _v7_conversaciones),
+    (8, "Trabajos de transcripción reanudables", _v8_trabajos_transcripcion),
+    (9, "Cola de transcripción por lotes", _v9_cola_transcripcion),
+]
+
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+# ============ EJECUCIÓN ============
+
+def obtener_version(engine) -> int:
+    """Versión aplicada del esquema (0 si la tabla de versiones no existe)"""
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(sa.select(sa.func.max(schema_version.c.version))).scalar()
+            return version or 0
+    except sa.exc.DBAPIError:
+        return 0
+
+def aplicar_migraciones(engine, tipo_bd: str) -> int:
+    """
+    Llevar el esquema a VERSION_ACTUAL. En el camino rápido (esquema al día)
+    solo se ejecuta una consulta de versión. Retorna la versión final.
+    """
+    version = obtener_version(engine)
+    if version >= VERSION_ACTUAL:
+        return version
+
+    _metadata_version.create_all(engine)
+
+    for numero, descripcion, migracion in MIGRACIONES:
+        if numero <= version:
+            continue
+
+        print(f"🔧 Aplicando migración {numero}: {descripcion}...")
+        with engine.begin() as conn:
+            migracion(conn, tipo_bd)
+            conn.execute(schema_version.insert().values(
+                version=numero,
+                descripcion=descripcion,
+                fecha_aplicada=datetime.utcnow()
+            ))
+        version = numero
+
+    print(f"✅ Esquema de base de datos en versión {version}")
+    return version
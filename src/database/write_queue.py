@@ -0,0 +1,175 @@
+"""
+Cola de escritura única para SQLite
+
+SQLite admite un solo escritor a la vez. En lugar de que cada hilo (UI,
+consultas, Studio, podcast, ingesta) compita por el bloqueo, todas las
+escrituras se envían a un hilo dedicado que posee la conexión de escritura,
+agrupa los trabajos pendientes en una transacción y resuelve un Future por
+trabajo. Los lectores siguen usando su propio engine con snapshots WAL.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+import sqlalchemy as sa
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+class EscritorSQLite(threading.Thread):
+    """Hilo que serializa y agrupa en lotes las escrituras a un archivo SQLite"""
+
+    def __init__(self, ruta_db: str, max_lote: int = 64):
+        super().__init__(name=f"EscritorSQLite({ruta_db})", daemon=True)
+        self.ruta_db = ruta_db
+        self.max_lote = max_lote
+        self._cola: "queue.Queue" = queue.Queue()
+        self.engine = self._crear_engine_escritura()
+        self.Session = sessionmaker(bind=self.engine)
+
+    def _crear_engine_escritura(self):
+        """Engine de una sola conexión, con BEGIN IMMEDIATE y SAVEPOINTs funcionales"""
+        engine = create_engine(
+            f"sqlite:///{self.ruta_db}",
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool
+        )
+
+        def on_connect(dbapi_connection, connection_record):
+            # Desactivar la gestión implícita de transacciones de pysqlite
+            # para que SQLAlchemy controle BEGIN/SAVEPOINT
+            dbapi_connection.isolation_level = None
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=10000")
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+        def on_begin(conn):
+            # Tomar el bloqueo de escritura al inicio: nunca hay "database is locked" a mitad de lote
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+        sa.event.listen(engine, 'connect', on_connect)
+        sa.event.listen(engine, 'begin', on_begin)
+        return engine
+
+    def enviar(self, trabajo: Callable[[Any], Any]) -> Future:
+        """Encolar un trabajo trabajo(session) y retornar un Future con su resultado"""
+        futuro = Future()
+        self._cola.put((trabajo, futuro, False))
+        return futuro
+
+    def enviar_mantenimiento(self, trabajo: Callable[[Any], Any]) -> Future:
+        """
+        Encolar un trabajo trabajo(conexion_dbapi) que debe correr fuera de una
+        transacción (VACUUM, cambios de auto_vacuum). Se ejecuta entre lotes.
+        """
+        futuro = Future()
+        self._cola.put((trabajo, futuro, True))
+        return futuro
+
+    def detener(self):
+        """Procesar lo pendiente y terminar el hilo"""
+        self._cola.put(None)
+
+    def run(self):
+        while True:
+            item = self._cola.get()
+            if item is None:
+                break
+
+            lote = [item]
+            detener = False
+            while len(lote) < self.max_lote:
+                try:
+                    siguiente = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is None:
+                    detener = True
+                    break
+                lote.append(siguiente)
+
+            # Los trabajos de mantenimiento cortan el lote: van solos y en orden
+            transaccionales = []
+            for trabajo, futuro, mantenimiento in lote:
+                if not mantenimiento:
+                    transaccionales.append((trabajo, futuro))
+                    continue
+                if transaccionales:
+                    self._procesar_lote(transaccionales)
+                    transaccionales = []
+                self._procesar_mantenimiento(trabajo, futuro)
+            if transaccionales:
+                self._procesar_lote(transaccionales)
+
+            if detener:
+                break
+
+        self.engine.dispose()
+
+    def _procesar_lote(self, lote):
+        """Ejecutar un lote en una transacción; cada trabajo aislado en un SAVEPOINT"""
+        session = self.Session()
+        resultados = []
+        try:
+            for trabajo, futuro in lote:
+                if not futuro.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        resultado = trabajo(session)
+                        session.flush()
+                    resultados.append((futuro, resultado, None))
+                except Exception as e:
+                    # Solo se revierte el SAVEPOINT de este trabajo
+                    resultados.append((futuro, None, e))
+
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"❌ Error confirmando lote de escritura ({len(lote)} trabajos): {e}")
+            resultados = [(futuro, None, error or e) for futuro, _, error in resultados]
+        finally:
+            session.close()
+
+        for futuro, resultado, error in resultados:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
+
+    def _procesar_mantenimiento(self, trabajo, futuro):
+        """Ejecutar un trabajo sobre la conexión DBAPI en modo autocommit"""
+        if not futuro.set_running_or_notify_cancel():
+            return
+        conexion = self.engine.raw_connection()
+        try:
+            futuro.set_result(trabajo(conexion.driver_connection))
+        except Exception as e:
+            futuro.set_exception(e)
+        finally:
+            conexion.close()
+
+_escritores: Dict[str, EscritorSQLite] = {}
+_escritores_lock = threading.Lock()
+
+def obtener_escritor(ruta_db: str) -> EscritorSQLite:
+    """Escritor único (por archivo de BD) compartido por todo el proceso"""
+    with _escritores_lock:
+        escritor = _escritores.get(ruta_db)
+        if escritor is None or not escritor.is_alive():
+            escritor = EscritorSQLite(ruta_db)
+            escritor.start()
+            _escritores[ruta_db] = escritor
+        return escritor
+
+def detener_escritor(ruta_db: str):
+    """Detener el escritor de un archivo (p.ej. antes de eliminar la BD)"""
+    with _escritores_lock:
+        escritor = _escritores.pop(ruta_db, None)
+    if escritor and escritor.is_alive():
+        escritor.detener()
+        escritor.join(timeout=10)
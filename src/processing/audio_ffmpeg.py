@@ -0,0 +1,328 @@
+"""
+Utilidades de audio sobre ffmpeg en streaming: el audio pasa por tuberías en
+bloques, sin cargar la grabación ni el resultado completos en memoria.
+"""
+import csv
+import os
+import re
+import subprocess
+import time
+from typing import Collection, Dict, Iterable, Iterator, Tuple
+
+from pydub import AudioSegment
+from pydub.utils import mediainfo
+
+# Cada cuánto se revisa si el segmentador terminó un segmento nuevo
+INTERVALO_SEGMENTOS_S = 0.5
+# Bitrate de los segmentos para transcripción (mono, 16 kHz): fija su tamaño por segundo
+BITRATE_SEGMENTOS_KBPS = 64
+
+_RE_SILENCIO_INICIO = re.compile(r"silence_start: (-?[\d.]+)")
+_RE_SILENCIO_FIN = re.compile(r"silence_end: (-?[\d.]+)")
+
+def ruta_ffmpeg() -> str:
+    """Binario de ffmpeg (el mismo que usa pydub; configurable con AudioSegment.converter)"""
+    return AudioSegment.converter
+
+def duracion_audio(ruta: str) -> float:
+    """Duración en segundos leída de la cabecera con ffprobe (sin decodificar el audio)"""
+    return float(mediainfo(ruta).get('duration') or 0)
+
+def duracion_maxima_por_tamano(limite_bytes: int, bitrate_kbps: int = BITRATE_SEGMENTOS_KBPS) -> float:
+    """Segundos de audio que caben en `limite_bytes` al bitrate de los segmentos (con 5% de margen)"""
+    return limite_bytes * 0.95 * 8 / (bitrate_kbps * 1000)
+
+def _comando_mp3_transcripcion() -> list:
+    return ["-vn", "-ac", "1", "-ar", "16000", "-b:a", f"{BITRATE_SEGMENTOS_KBPS}k"]
+
+def segmentar_audio(ruta: str, duracion_segmento_s: float, directorio: str) -> Iterator[Dict]:
+    """
+    Cortar la grabación en segmentos MP3 (mono, 16 kHz: lo que usa Whisper) en
+    una sola pasada de ffmpeg con el muxer de segmentos. Cada segmento se entrega
+    en cuanto ffmpeg lo termina, como dict con 'indice', 'ruta', 'inicio_s' y
+    'duracion_s', mientras el resto se sigue cortando. El audio decodificado
+    nunca se acumula en memoria. Cerrar el generador detiene ffmpeg.
+    """
+    lista = os.path.join(directorio, "segmentos.csv")
+    registro = os.path.join(directorio, "ffmpeg.log")
+    comando = [
+        ruta_ffmpeg(), "-y", "-nostdin", "-loglevel", "error",
+        "-i", ruta, *_comando_mp3_transcripcion(),
+        "-f", "segment", "-segment_time", str(duracion_segmento_s), "-reset_timestamps", "1",
+        "-segment_list", lista, "-segment_list_type", "csv",
+        os.path.join(directorio, "segmento_%05d.mp3")
+    ]
+
+    # Los errores van a un archivo: una tubería sin leer podría bloquear a ffmpeg
+    with open(registro, "wb") as salida_errores:
+        proceso = subprocess.Popen(comando, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=salida_errores)
+    try:
+        entregados = 0
+        while True:
+            terminado = proceso.poll() is not None
+            # ffmpeg agrega una línea a la lista al cerrar cada segmento
+            filas = []
+            if os.path.exists(lista):
+                with open(lista, newline="", encoding="utf-8") as f:
+                    contenido = f.read()
+                completas = contenido[:contenido.rfind("\n") + 1]
+                filas = [fila for fila in csv.reader(completas.splitlines()) if fila]
+            for nombre, inicio, fin in filas[entregados:]:
+                yield {
+                    'indice': entregados,
+                    'ruta': os.path.join(directorio, nombre),
+                    'inicio_s': float(inicio),
+                    'duracion_s': float(fin) - float(inicio),
+                    'solapamiento_s': 0.0
+                }
+                entregados += 1
+            if terminado:
+                break
+            time.sleep(INTERVALO_SEGMENTOS_S)
+
+        if proceso.returncode != 0:
+            with open(registro, encoding="utf-8", errors="replace") as f:
+                error = f.read().strip()
+            raise RuntimeError(f"ffmpeg no pudo segmentar el audio: {error[-500:]}")
+    finally:
+        if proceso.poll() is None:
+            proceso.kill()
+            proceso.wait()
+
+class EnsambladorAudio:
+    """
+    Une segmentos en un único archivo escribiéndolos uno tras otro en un solo
+    codificador ffmpeg que recibe PCM por stdin. Cada segmento se decodifica,
+    se envía y se libera: el costo es lineal y la memoria no depende de la
+    duración total. Todos los segmentos se convierten al formato PCM del primero.
+    El archivo final aparece al cerrar (se escribe aparte y luego se renombra).
+    """
+
+    def __init__(self, ruta_salida: str, formato: str = "mp3", bitrate: str = "128k"):
+        self.ruta_salida = ruta_salida
+        self.formato = formato
+        self.bitrate = bitrate
+        self._ruta_parcial = f"{ruta_salida}.parcial"
+        self._proceso = None
+        self._frame_rate = None
+        self._canales = None
+        self._ancho_muestra = None
+        self._silencio_pendiente_ms = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.cerrar()
+        else:
+            self.descartar()
+        return False
+
+    def _iniciar(self, segmento: AudioSegment):
+        self._frame_rate = segmento.frame_rate
+        self._canales = segmento.channels
+        self._ancho_muestra = segmento.sample_width
+        formato_pcm = "u8" if self._ancho_muestra == 1 else f"s{8 * self._ancho_muestra}le"
+        comando = [
+            ruta_ffmpeg(), "-y", "-loglevel", "error",
+            "-f", formato_pcm, "-ar", str(self._frame_rate), "-ac", str(self._canales),
+            "-i", "pipe:0",
+            "-b:a", self.bitrate, "-f", self.formato, self._ruta_parcial
+        ]
+        self._proceso = subprocess.Popen(comando, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _escribir(self, datos: bytes):
+        try:
+            self._proceso.stdin.write(datos)
+        except BrokenPipeError:
+            error = self._proceso.stderr.read().decode("utf-8", "replace").strip()
+            raise RuntimeError(f"ffmpeg terminó al ensamblar el audio: {error}")
+
+    def agregar(self, segmento: AudioSegment):
+        """Escribir un segmento ya decodificado a continuación de lo anterior"""
+        if self._proceso is None:
+            self._iniciar(segmento)
+            if self._silencio_pendiente_ms:
+                self.agregar_silencio(self._silencio_pendiente_ms)
+        segmento = (segmento.set_frame_rate(self._frame_rate)
+                    .set_channels(self._canales)
+                    .set_sample_width(self._ancho_muestra))
+        self._escribir(segmento.raw_data)
+
+    def agregar_archivo(self, ruta: str):
+        """Decodificar un archivo de audio y escribirlo a continuación"""
+        self.agregar(AudioSegment.from_file(ruta))
+
+    def agregar_silencio(self, duracion_ms: int):
+        """Escribir silencio (bytes en cero, sin construir un AudioSegment)"""
+        if self._proceso is None:
+            # Aún no se conoce el formato PCM: se escribe con el primer segmento
+            self._silencio_pendiente_ms += duracion_ms
+            return
+        muestras = int(self._frame_rate * duracion_ms / 1000)
+        # El PCM de 8 bits es sin signo: su cero está en 0x80
+        cero = b"\x80" if self._ancho_muestra == 1 else b"\x00"
+        self._escribir(cero * (muestras * self._canales * self._ancho_muestra))
+
+    def cerrar(self) -> str:
+        """Terminar la codificación y publicar el archivo. Retorna su ruta"""
+        if self._proceso is None:
+            raise ValueError("No hay audio para ensamblar.")
+        self._proceso.stdin.close()
+        error = self._proceso.stderr.read().decode("utf-8", "replace").strip()
+        if self._proceso.wait() != 0:
+            self._eliminar_parcial()
+            raise RuntimeError(f"ffmpeg no pudo codificar el audio: {error}")
+        os.replace(self._ruta_parcial, self.ruta_salida)
+        return self.ruta_salida
+
+    def descartar(self):
+        """Abortar la codificación y borrar el archivo a medio escribir"""
+        if self._proceso is not None and self._proceso.poll() is None:
+            self._proceso.kill()
+            self._proceso.wait()
+        self._eliminar_parcial()
+
+    def _eliminar_parcial(self):
+        try:
+            os.remove(self._ruta_parcial)
+        except OSError:
+            pass
+
+def detectar_silencios(ruta: str, umbral_db: float = -35, duracion_min_s: float = 0.4) -> Iterator[Tuple[float, float]]:
+    """
+    (inicio, fin) en segundos de cada silencio, entregados a medida que ffmpeg
+    (filtro silencedetect) avanza por la grabación. Cerrar el generador detiene ffmpeg.
+    """
+    comando = [
+        ruta_ffmpeg(), "-nostdin", "-hide_banner", "-nostats", "-i", ruta, "-vn",
+        "-af", f"silencedetect=noise={umbral_db}dB:d={duracion_min_s}", "-f", "null", "-"
+    ]
+    proceso = subprocess.Popen(comando, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    try:
+        inicio = None
+        ultimas = []
+        for linea in proceso.stderr:
+            linea = linea.decode("utf-8", "replace")
+            ultimas = (ultimas + [linea.strip()])[-5:]
+            coincidencia = _RE_SILENCIO_INICIO.search(linea)
+            if coincidencia:
+                inicio = max(0.0, float(coincidencia.group(1)))
+                continue
+            coincidencia = _RE_SILENCIO_FIN.search(linea)
+            if coincidencia and inicio is not None:
+                yield inicio, float(coincidencia.group(1))
+                inicio = None
+        if proceso.wait() != 0:
+            raise RuntimeError(f"ffmpeg no pudo analizar el audio: {' '.join(ultimas)[-500:]}")
+    finally:
+        if proceso.poll() is None:
+            proceso.kill()
+            proceso.wait()
+
+def planificar_cortes(silencios: Iterable[Tuple[float, float]], duracion_total_s: float,
+                      duracion_objetivo_s: float, ventana_s: float) -> Iterator[Tuple[float, float]]:
+    """
+    Tramos (inicio, fin) de como máximo `duracion_objetivo_s`, cortando en el
+    centro del último silencio que cae en los `ventana_s` previos a cada objetivo
+    (o en el objetivo si no hay ninguno). Trabaja en línea: cada tramo se entrega
+    en cuanto se conoce su corte. Con duración total desconocida (0) sigue
+    entregando tramos fijos sin fin: extraer_segmentos para al llegar al final
+    del archivo.
+    """
+    inicio = 0.0
+    candidato = None
+
+    def cortar():
+        nonlocal inicio, candidato
+        corte = candidato if candidato is not None else inicio + duracion_objetivo_s
+        tramo = (inicio, corte)
+        inicio, candidato = corte, None
+        return tramo
+
+    iterador = iter(silencios)
+    try:
+        for silencio_inicio, silencio_fin in iterador:
+            medio = (silencio_inicio + silencio_fin) / 2
+            while medio > inicio + duracion_objetivo_s:
+                yield cortar()
+            if medio > inicio and medio >= inicio + duracion_objetivo_s - ventana_s:
+                candidato = medio
+    finally:
+        # Detener el análisis de silencios si el consumidor abandona
+        if hasattr(iterador, 'close'):
+            iterador.close()
+
+    if duracion_total_s:
+        while duracion_total_s - inicio > duracion_objetivo_s:
+            yield cortar()
+        if duracion_total_s - inicio > 0.1:
+            yield inicio, duracion_total_s
+    else:
+        while True:
+            yield cortar()
+
+def extraer_segmentos(ruta: str, tramos: Iterable[Tuple[float, float]], directorio: str,
+                      solapamiento_s: float = 0, omitir: Collection[int] = ()) -> Iterator[Dict]:
+    """
+    Extraer cada tramo a un MP3 para transcripción con una lectura acotada de
+    ffmpeg (-ss/-t), a medida que llegan los tramos. Con `solapamiento_s` cada
+    segmento empieza ese tiempo antes de su corte, para no perder palabras en la
+    unión. Los índices en `omitir` (p.ej. ya transcritos) se entregan sin
+    extraer, con ruta None. Un segmento vacío o más corto que su tramo marca el
+    final del archivo: se entrega el corto con su duración real y se para (así
+    funciona la lista de tramos sin fin de una duración desconocida). Entrega
+    dicts como segmentar_audio.
+    """
+    iterador = iter(tramos)
+    try:
+        for indice, (inicio, fin) in enumerate(iterador):
+            solapamiento = min(solapamiento_s, inicio)
+            desde = inicio - solapamiento
+            if indice in omitir:
+                yield {
+                    'indice': indice,
+                    'ruta': None,
+                    'inicio_s': desde,
+                    'duracion_s': fin - desde,
+                    'solapamiento_s': solapamiento
+                }
+                continue
+            destino = os.path.join(directorio, f"segmento_{indice:05d}.mp3")
+            duracion = fin - desde
+            comando = [
+                ruta_ffmpeg(), "-y", "-nostdin", "-loglevel", "error", "-ss", f"{desde:.3f}",
+                "-t", f"{duracion:.3f}", "-i", ruta, *_comando_mp3_transcripcion(), destino
+            ]
+            resultado = subprocess.run(comando, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE)
+            if resultado.returncode != 0:
+                error = resultado.stderr.decode("utf-8", "replace").strip()
+                raise RuntimeError(f"ffmpeg no pudo extraer el segmento {indice + 1}: {error[-500:]}")
+
+            # Bitrate constante: un archivo claramente menor que lo esperado se quedó sin audio
+            final = False
+            tamano = os.path.getsize(destino) if os.path.exists(destino) else 0
+            if tamano < duracion * BITRATE_SEGMENTOS_KBPS * 1000 / 8 * 0.9:
+                duracion = duracion_audio(destino) if tamano else 0.0
+                final = True
+            if duracion <= 0.1:
+                if os.path.exists(destino):
+                    os.remove(destino)
+                break
+
+            yield {
+                'indice': indice,
+                'ruta': destino,
+                'inicio_s': desde,
+                'duracion_s': duracion,
+                'solapamiento_s': solapamiento
+            }
+            if final:
+                break
+    finally:
+        if hasattr(iterador, 'close'):
+            iterador.close()
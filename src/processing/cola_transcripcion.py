@@ -0,0 +1,214 @@
+"""
+Cola persistente de transcripción por lotes: carpetas de grabaciones que se
+transcriben en segundo plano y sobreviven a los reinicios de la aplicación.
+"""
+import os
+import threading
+from typing import Callable, Dict, List
+
+from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler
+from utils.event_bus import event_bus, COLA_TRANSCRIPCION_ACTUALIZADA
+
+# Extensiones que se importan al agregar una carpeta
+EXTENSIONES_MEDIOS = (".mp3", ".wav", ".m4a", ".mp4", ".mov", ".mkv", ".avi",
+                      ".ogg", ".flac", ".webm", ".aac", ".wma")
+# Cada cuánto se vuelve a mirar la cola sin aviso (p.ej. mientras no hay API key)
+INTERVALO_REVISION_S = 10
+
+class ColaTranscripcion:
+    """
+    Los archivos se guardan en la base de datos (tabla cola_transcripcion) y
+    transcripcion.archivos_simultaneos hilos los toman en orden de llegada.
+    Todos los archivos en curso comparten el cupo global de segmentos enviados
+    a Whisper, así que mientras uno está en ffmpeg (CPU) otro ocupa la red.
+    Al iniciar, lo que quedó en curso vuelve a pendiente y se reanuda desde los
+    segmentos ya guardados. Cada cambio de estado publica
+    COLA_TRANSCRIPCION_ACTUALIZADA; el progreso de cada archivo, mucho más
+    frecuente, solo llega a quien se registre con suscribir_progreso (no pasa
+    por el bus de datos, que refresca otras vistas).
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ColaTranscripcion, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._cond = threading.Condition()
+        self._hilos: List[threading.Thread] = []
+        self._detener = False
+        # Progreso de los elementos en curso: id -> (porcentaje, mensaje). Solo en memoria
+        self._progreso: Dict[int, tuple] = {}
+        self._oyentes_progreso: List[Callable[[int, int, str], None]] = []
+        self._db_manager = None
+
+        self._initialized = True
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            from database.db_manager import DatabaseManager
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    # ============ CONFIGURACIÓN ============
+
+    def iniciar(self):
+        """Recuperar lo que quedó en curso y arrancar los hilos de trabajo"""
+        with self._cond:
+            if self._hilos:
+                return
+            self._detener = False
+
+        try:
+            recuperados = self.db_manager.actualizar_cola_transcripcion(None, 'pendiente', ['en_curso'])
+        except Exception as e:
+            print(f"⚠️ No se pudo abrir la cola de transcripción: {e}")
+            return
+        if recuperados:
+            print(f"⏯️ {recuperados} transcripción(es) interrumpida(s) vuelven a la cola")
+
+        with self._cond:
+            for i in range(max(1, config_manager.get_archivos_simultaneos_transcripcion())):
+                hilo = threading.Thread(target=self._run, name=f"ColaTranscripcion-{i + 1}", daemon=True)
+                self._hilos.append(hilo)
+                hilo.start()
+
+    def detener(self):
+        """Terminar los hilos al acabar su archivo actual (lo pendiente queda en la cola)"""
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+
+    # ============ COLA ============
+
+    def agregar_archivos(self, rutas: List[str]) -> int:
+        """Encolar archivos. Retorna cuántos se agregaron (se omiten los que ya están en cola)"""
+        rutas = [os.path.abspath(r) for r in rutas if os.path.isfile(r)]
+        agregados = self.db_manager.agregar_a_cola_transcripcion(rutas) if rutas else 0
+        if agregados:
+            print(f"🗂️ {agregados} archivo(s) agregado(s) a la cola de transcripción")
+            self._notificar()
+            with self._cond:
+                self._cond.notify_all()
+        return agregados
+
+    def importar_carpeta(self, carpeta: str, recursivo: bool = True) -> int:
+        """Encolar los archivos de audio/video de una carpeta. Retorna cuántos se agregaron"""
+        rutas = []
+        for raiz, directorios, archivos in os.walk(carpeta):
+            directorios.sort()
+            rutas += [os.path.join(raiz, a) for a in sorted(archivos)
+                      if a.lower().endswith(EXTENSIONES_MEDIOS)]
+            if not recursivo:
+                break
+        return self.agregar_archivos(rutas)
+
+    def obtener_elementos(self) -> List[Dict]:
+        """Elementos de la cola con el progreso de los que están en curso"""
+        elementos = self.db_manager.obtener_cola_transcripcion()
+        with self._cond:
+            for elemento in elementos:
+                porcentaje, mensaje = self._progreso.get(elemento['id'], (0, ""))
+                elemento['progreso'] = 100 if elemento['estado'] == 'completado' else porcentaje
+                elemento['mensaje'] = mensaje
+        return elementos
+
+    def cancelar(self, ids: List[int]) -> int:
+        """Cancelar elementos pendientes (los que están en curso terminan su archivo)"""
+        cambiados = self.db_manager.actualizar_cola_transcripcion(ids, 'cancelado', ['pendiente'])
+        if cambiados:
+            self._notificar()
+        return cambiados
+
+    def reintentar(self, ids: List[int]) -> int:
+        """Volver a encolar elementos con error o cancelados (reanudan desde sus segmentos guardados)"""
+        cambiados = self.db_manager.actualizar_cola_transcripcion(ids, 'pendiente', ['error', 'cancelado'])
+        if cambiados:
+            self._notificar()
+            with self._cond:
+                self._cond.notify_all()
+        return cambiados
+
+    def limpiar_terminados(self) -> int:
+        """Quitar de la lista los elementos completados y cancelados"""
+        eliminados = self.db_manager.eliminar_de_cola_transcripcion(['completado', 'cancelado'])
+        if eliminados:
+            self._notificar()
+        return eliminados
+
+    def suscribir_progreso(self, callback: Callable[[int, int, str], None]):
+        """Registrar un callback(elemento_id, porcentaje, mensaje), llamado desde los hilos de la cola"""
+        with self._cond:
+            if callback not in self._oyentes_progreso:
+                self._oyentes_progreso.append(callback)
+
+    def _notificar(self, **datos):
+        event_bus.publicar(COLA_TRANSCRIPCION_ACTUALIZADA, **datos)
+
+    # ============ TRABAJO ============
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._detener:
+                    return
+
+            if not llm_scheduler.disponible():
+                with self._cond:
+                    self._cond.wait(timeout=INTERVALO_REVISION_S)
+                continue
+
+            try:
+                elemento = self.db_manager.tomar_siguiente_cola_transcripcion()
+            except Exception as e:
+                print(f"⚠️ Error leyendo la cola de transcripción: {e}")
+                elemento = None
+            if elemento is None:
+                with self._cond:
+                    if not self._detener:
+                        self._cond.wait(timeout=INTERVALO_REVISION_S)
+                continue
+
+            self._procesar(elemento)
+
+    def _procesar(self, elemento: Dict):
+        from processing.transcripcion import transcribir_a_archivo
+
+        elemento_id = elemento['id']
+        nombre = os.path.basename(elemento['ruta'])
+        self._notificar(elemento_id=elemento_id)
+
+        def progreso(porcentaje: int, mensaje: str):
+            with self._cond:
+                self._progreso[elemento_id] = (porcentaje, mensaje)
+                oyentes = list(self._oyentes_progreso)
+            for oyente in oyentes:
+                try:
+                    oyente(elemento_id, porcentaje, mensaje)
+                except Exception as e:
+                    print(f"⚠️ Error notificando el progreso de la cola: {e}")
+
+        print(f"🎙️ Transcribiendo (lote): {nombre}")
+        try:
+            ruta_salida = transcribir_a_archivo(elemento['ruta'], progreso=progreso)
+        except Exception as e:
+            print(f"⚠️ Error transcribiendo {nombre}: {e}")
+            self.db_manager.actualizar_cola_transcripcion([elemento_id], 'error', error=str(e))
+        else:
+            print(f"✅ Transcripción por lotes guardada en: {ruta_salida}")
+            self.db_manager.actualizar_cola_transcripcion([elemento_id], 'completado', ruta_salida=ruta_salida)
+        finally:
+            with self._cond:
+                self._progreso.pop(elemento_id, None)
+            self._notificar(elemento_id=elemento_id)
+
+# Instancia global
+cola_transcripcion = ColaTranscripcion()
@@ -4,6 +4,7 @@ import tiktoken
 from typing import List, Dict, Tuple
 import numpy as np
 from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler, PRIORIDAD_INGESTA
 from datetime import datetime
 import hashlib
 
@@ -22,16 +23,6 @@ class PDFProcessor:
     def __init__(self):
         self.api_key = config_manager.get_api_key()
         
-        # Inicializar cliente OpenAI de forma compatible
-        if OPENAI_NEW and self.api_key:
-            try:
-                self.openai_client = openai.OpenAI(api_key=self.api_key)
-                self.openai_available = True
-            except Exception as e:
-                print(f"⚠️ Error inicializando cliente OpenAI: {e}")
-                self.openai_available = False
-        else:
-            self.openai_available = False
             
         # MANEJO SEGURO DE TIKTOKEN
         try:
@@ -54,6 +45,15 @@ class PDFProcessor:
         self.modelo_embeddings = config_manager.get_modelo_embeddings()
         self.batch_size = config_manager.get_batch_size_embeddings()
         
+    @property
+    def usar_planificador(self) -> bool:
+        """Con OpenAI >= 1.0 o un proveedor local las llamadas pasan por el planificador compartido"""
+        return OPENAI_NEW or config_manager.get_proveedor_ia() != "openai"
+
+    @property
+    def openai_available(self) -> bool:
+        return self.usar_planificador and llm_scheduler.disponible()
+
     def contar_tokens(self, texto: str) -> int:
         """Contar tokens en un texto de forma segura"""
         if self.encoding and texto:
@@ -147,13 +147,13 @@ class PDFProcessor:
             {texto_analisis[:8000]}
             """
             
-            if OPENAI_NEW:
-                response = self.openai_client.chat.completions.create(
-                    model=config_manager.get_modelo(),
-                    messages=[
+            if self.usar_planificador:
+                response = llm_scheduler.chat(
+                    [
                         {"role": "system", "content": "Eres un experto en análisis de documentos jurídicos. Tu tarea es extraer índices de libros de forma estructurada."},
                         {"role": "user", "content": prompt}
                     ],
+                    config_manager.get_modelo(), PRIORIDAD_INGESTA, origen="indice",
                     response_format={ "type": "json_object" } if "gpt-4" in config_manager.get_modelo() else None
                 )
                 contenido = response.choices[0].message.content
@@ -255,11 +255,9 @@ class PDFProcessor:
                 
             print(f"🧮 Generando embeddings para {len(textos)} textos...")
             
-            if OPENAI_NEW:
-                response = self.openai_client.embeddings.create(
-                    model=self.modelo_embeddings,
-                    input=textos
-                )
+            if self.usar_planificador:
+                response = llm_scheduler.embeddings(textos, self.modelo_embeddings, PRIORIDAD_INGESTA,
+                                                    origen="embeddings")
                 embeddings = [item.embedding for item in response.data]
             else:
                 # Fallback para versiones antiguas (no recomendado)
@@ -284,11 +282,9 @@ class PDFProcessor:
             if not self.openai_available:
                 return []
                 
-            if OPENAI_NEW:
-                response = self.openai_client.embeddings.create(
-                    model=self.modelo_embeddings,
-                    input=texto
-                )
+            if self.usar_planificador:
+                response = llm_scheduler.embeddings(texto, self.modelo_embeddings, PRIORIDAD_INGESTA,
+                                                    origen="embeddings")
                 return response.data[0].embedding
             else:
                 # Fallback para versiones antiguas
@@ -0,0 +1,96 @@
+"""
+Sondeo de archivos multimedia: duración y flujos leídos de la cabecera con
+ffprobe (sin decodificar el audio), con cache por ruta y fecha de modificación.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from pydub.utils import mediainfo_json
+
+# Archivos cuyo sondeo se conserva en memoria
+MAX_ENTRADAS_CACHE = 256
+
+class SondaMedios:
+    """
+    Lee con ffprobe la duración, el formato y los flujos de audio/video de un
+    archivo. El resultado se guarda por (ruta, fecha de modificación, tamaño):
+    la interfaz sondea al elegir un archivo y la transcripción reutiliza ese
+    mismo resultado sin volver a lanzar ffprobe.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SondaMedios, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._initialized = True
+
+    def sondear(self, ruta: str) -> Dict:
+        """Información del archivo (ver _interpretar). Lanza RuntimeError si ffprobe no puede leerlo"""
+        ruta = os.path.abspath(ruta)
+        estado = os.stat(ruta)
+        version = (estado.st_mtime_ns, estado.st_size)
+        with self._lock:
+            entrada = self._cache.get(ruta)
+            if entrada and entrada[0] == version:
+                self._cache.move_to_end(ruta)
+                return dict(entrada[1])
+
+        try:
+            info = mediainfo_json(ruta)
+        except Exception as e:
+            raise RuntimeError(f"No se pudo analizar {os.path.basename(ruta)}: {e}") from e
+        if not info or 'format' not in info:
+            raise RuntimeError(f"No se pudo analizar {os.path.basename(ruta)}: formato no reconocido")
+        resultado = self._interpretar(info, estado.st_size)
+
+        with self._lock:
+            self._cache[ruta] = (version, resultado)
+            self._cache.move_to_end(ruta)
+            while len(self._cache) > MAX_ENTRADAS_CACHE:
+                self._cache.popitem(last=False)
+        return dict(resultado)
+
+    def _interpretar(self, info: Dict, tamano_bytes: int) -> Dict:
+        formato = info.get('format', {})
+        flujos = info.get('streams', [])
+        audio = next((f for f in flujos if f.get('codec_type') == 'audio'), None)
+        video = next((f for f in flujos if f.get('codec_type') == 'video'), None)
+
+        duracion = _flotante(formato.get('duration'))
+        if not duracion:
+            # Algunos contenedores solo indican la duración por flujo
+            duracion = max((_flotante(f.get('duration')) for f in flujos), default=0.0)
+
+        return {
+            'duracion_s': duracion,
+            'tamano_bytes': tamano_bytes,
+            'formato': formato.get('format_name', ''),
+            'bitrate': int(_flotante(formato.get('bit_rate'))),
+            'tiene_audio': audio is not None,
+            'tiene_video': video is not None,
+            'codec_audio': audio.get('codec_name', '') if audio else '',
+            'canales': int(audio.get('channels') or 0) if audio else 0,
+            'frecuencia_hz': int(_flotante(audio.get('sample_rate'))) if audio else 0
+        }
+
+def _flotante(valor) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+# Instancia global
+sonda_medios = SondaMedios()
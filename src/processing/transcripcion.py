@@ -0,0 +1,448 @@
+"""
+Transcripción de grabaciones largas: segmentación con ffmpeg en streaming
+(cortando en silencios y sin superar el límite de subida), envío concurrente
+de los segmentos a Whisper, trabajos reanudables guardados en la base de datos
+y formateo con GPT de los fragmentos a medida que se transcriben.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Callable, Dict, List
+
+from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler, con_reintentos, PRIORIDAD_TRANSCRIPCION
+from processing.sonda_medios import sonda_medios
+from processing.audio_ffmpeg import (
+    segmentar_audio, detectar_silencios, planificar_cortes,
+    extraer_segmentos, duracion_maxima_por_tamano
+)
+
+# Intentos por segmento antes de darlo por fallido
+MAX_INTENTOS_SEGMENTO = 4
+# Espera antes del primer reintento (se duplica en cada intento)
+ESPERA_REINTENTO_S = 2.0
+# Modelo y tamaño de fragmento del formateo de transcripciones
+MODELO_FORMATO = "gpt-3.5-turbo"
+MAX_CARACTERES_FORMATO = 3000
+PROMPT_FORMATO = """
+Formatea este texto como una transcripción profesional:
+- Corrige ortografía y puntuación
+- Añade saltos de línea y párrafos donde corresponda
+- Mantén nombres, fechas y horas sin alterarlos
+- Mantén todo en español
+
+Fragmento {numero}:
+{fragmento}
+"""
+# Segmentos enviados a Whisper a la vez entre todas las transcripciones en curso
+# (una sola o varias de la cola por lotes): comparten el mismo cupo
+_cupos_segmentos = threading.BoundedSemaphore(max(1, config_manager.get_max_concurrencia_transcripcion()))
+# Bloque de lectura al calcular el hash de un archivo
+BLOQUE_HASH = 1024 * 1024
+# Palabras que se comparan al quitar el texto repetido por el solapamiento
+MAX_PALABRAS_SOLAPAMIENTO = 40
+
+def hash_archivo(ruta: str) -> str:
+    """SHA-256 del contenido del archivo (leído por bloques)"""
+    huella = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(BLOQUE_HASH), b""):
+            huella.update(bloque)
+    return huella.hexdigest()
+
+def _normalizar_palabra(palabra: str) -> str:
+    return re.sub(r"[^\w]", "", palabra.lower())
+
+def quitar_solapamiento(anterior: str, siguiente: str) -> str:
+    """
+    Quitar del inicio de `siguiente` las palabras que repiten el final de
+    `anterior` (el audio solapado entre segmentos se transcribe dos veces).
+    Compara sin mayúsculas ni puntuación y elige la coincidencia más larga.
+    """
+    previas = [_normalizar_palabra(p) for p in anterior.split()[-MAX_PALABRAS_SOLAPAMIENTO:]]
+    palabras = siguiente.split()
+    nuevas = [_normalizar_palabra(p) for p in palabras[:MAX_PALABRAS_SOLAPAMIENTO]]
+    for n in range(min(len(previas), len(nuevas)), 1, -1):
+        if previas[-n:] == nuevas[:n]:
+            return " ".join(palabras[n:])
+    return siguiente
+
+class _EmisorEnOrden:
+    """
+    Recibe los textos de los segmentos en cualquier orden y los entrega en el de
+    la grabación en cuanto se completa cada prefijo, sin el texto repetido por el
+    solapamiento entre segmentos.
+    """
+
+    def __init__(self, al_texto: Callable[[str], None] = None, solapado: bool = False):
+        self.al_texto = al_texto
+        self.solapado = solapado
+        self.textos: List[str] = []
+        self._pendientes: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def agregar(self, indice: int, texto: str):
+        with self._lock:
+            self._pendientes[indice] = texto
+            while len(self.textos) in self._pendientes:
+                texto = self._pendientes.pop(len(self.textos))
+                if self.solapado and self.textos:
+                    texto = quitar_solapamiento(self.textos[-1], texto)
+                self.textos.append(texto)
+                # Dentro del lock: el consumidor recibe los textos en orden
+                if self.al_texto:
+                    self.al_texto(texto)
+
+class TranscriptorAudio:
+    """
+    Cada segmento se envía a Whisper en cuanto ffmpeg lo termina, con un pool
+    acotado (transcripcion.max_concurrencia; el planificador aplica además los
+    límites del modelo), así que la duración total se acerca a la de unos pocos
+    segmentos y no a la suma de todos. Cada segmento se reintenta por separado
+    y los textos se devuelven en el orden de la grabación.
+
+    Los cortes se hacen en la pausa más cercana antes de cada límite nominal
+    (transcripcion.cortar_en_silencios), y ningún segmento supera el límite de
+    subida de la API aunque la duración configurada lo permita.
+
+    Cada trabajo se identifica por el hash del archivo, el modelo y los
+    parámetros de segmentación, y el texto de cada segmento se guarda al
+    terminar: un reintento (o un reinicio de la aplicación) continúa desde los
+    segmentos que faltan, y un archivo ya transcrito se sirve de la base de datos.
+    """
+
+    def __init__(self, modelo: str = None, duracion_segmento_s: float = None, max_concurrencia: int = None,
+                 reanudar: bool = True):
+        self.modelo = modelo or config_manager.get("ia", "modelo_whisper", "whisper-1")
+        self.segmentacion = config_manager.get_config_segmentacion()
+        duracion_max_s = duracion_maxima_por_tamano(self.segmentacion['limite_subida_mb'] * 1024 * 1024)
+        self.duracion_segmento_s = min(
+            duracion_segmento_s or config_manager.get("transcripcion", "segment_length_min", 10) * 60,
+            duracion_max_s - self.segmentacion['solapamiento_s']
+        )
+        self.max_concurrencia = max(1, max_concurrencia or config_manager.get_max_concurrencia_transcripcion())
+        self.reanudar = reanudar
+        self._db_manager = None
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            from database.db_manager import DatabaseManager
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    def parametros(self) -> Dict:
+        """Parámetros que determinan los cortes (forman parte de la clave del trabajo)"""
+        parametros = {k: v for k, v in self.segmentacion.items() if k != 'limite_subida_mb'}
+        parametros['duracion_segmento_s'] = self.duracion_segmento_s
+        return parametros
+
+    def clave_trabajo(self, huella_archivo: str) -> str:
+        clave = json.dumps({'archivo': huella_archivo, 'modelo': self.modelo, 'parametros': self.parametros()},
+                           sort_keys=True)
+        return hashlib.sha256(clave.encode("utf-8")).hexdigest()
+
+    def transcribir(self, ruta: str, progreso: Callable[[int, int], None] = None,
+                    al_texto: Callable[[str], None] = None) -> List[str]:
+        """
+        Transcribir la grabación y retornar el texto de cada segmento en orden.
+        `progreso(completados, total)` se llama (desde los hilos del pool) al
+        terminar cada segmento; el total es una estimación hasta acabar de cortar.
+        `al_texto(texto)` recibe los textos en orden a medida que están listos,
+        para procesarlos mientras se transcribe el resto.
+        """
+        emisor = _EmisorEnOrden(al_texto, self.segmentacion['solapamiento_s'] > 0)
+        huella = hash_archivo(ruta)
+        clave = self.clave_trabajo(huella)
+        previo = self.db_manager.obtener_trabajo_transcripcion(clave) if self.reanudar else None
+        hechos = previo['segmentos'] if previo else {}
+
+        if previo and previo['estado'] == 'completado' and len(hechos) == previo['total_segmentos']:
+            print(f"♻️ Transcripción reutilizada: {os.path.basename(ruta)} ({len(hechos)} segmentos)")
+            if progreso:
+                progreso(len(hechos), len(hechos))
+            for indice in sorted(hechos):
+                emisor.agregar(indice, hechos[indice])
+            return emisor.textos
+        if hechos:
+            print(f"⏯️ Reanudando transcripción: {len(hechos)} segmentos ya transcritos")
+
+        trabajo_id = self._iniciar_trabajo(clave, huella, ruta)
+        try:
+            total = self._transcribir_pendientes(ruta, trabajo_id, hechos, emisor, progreso)
+        except Exception as e:
+            if trabajo_id is not None:
+                self.db_manager.finalizar_trabajo_transcripcion(trabajo_id, error=str(e))
+            raise
+        if trabajo_id is not None:
+            self.db_manager.finalizar_trabajo_transcripcion(trabajo_id, total_segmentos=total)
+        return emisor.textos
+
+    def _iniciar_trabajo(self, clave: str, huella: str, ruta: str):
+        """Registrar el trabajo; sin base de datos la transcripción sigue, pero no es reanudable"""
+        try:
+            return self.db_manager.iniciar_trabajo_transcripcion(
+                clave, huella, os.path.abspath(ruta), self.modelo, self.parametros())
+        except Exception as e:
+            print(f"⚠️ No se pudo registrar el trabajo de transcripción: {e}")
+            return None
+
+    def _transcribir_pendientes(self, ruta: str, trabajo_id, hechos: Dict[int, str], emisor: _EmisorEnOrden,
+                                progreso: Callable[[int, int], None]) -> int:
+        """Transcribir los segmentos que no están en `hechos`. Retorna el total de segmentos"""
+        # Normalmente ya sondeado por la interfaz al elegir el archivo (cache)
+        medio = sonda_medios.sondear(ruta)
+        if not medio['tiene_audio']:
+            raise ValueError("El archivo no contiene una pista de audio")
+        duracion_s = medio['duracion_s']
+        estimado = math.ceil(duracion_s / self.duracion_segmento_s) if duracion_s else 0
+
+        textos: Dict[int, str] = dict(hechos)
+        errores: Dict[int, Exception] = {}
+        lock = threading.Lock()
+        enviados = [0]
+
+        def al_terminar(indice, futuro):
+            with lock:
+                try:
+                    textos[indice] = futuro.result()
+                except Exception as e:
+                    errores[indice] = e
+                completados = len(textos) + len(errores)
+                total = max(estimado, enviados[0])
+            if indice in textos:
+                emisor.agregar(indice, textos[indice])
+            if progreso:
+                progreso(completados, total)
+
+        for indice in sorted(hechos):
+            emisor.agregar(indice, hechos[indice])
+        if hechos and progreso:
+            progreso(len(hechos), max(estimado, len(hechos)))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with ThreadPoolExecutor(max_workers=self.max_concurrencia) as pool:
+                # Cerrar el generador detiene ffmpeg antes de borrar el directorio
+                segmentos = self._segmentar(ruta, duracion_s, temp_dir, omitir=hechos)
+                with closing(segmentos):
+                    for segmento in segmentos:
+                        with lock:
+                            enviados[0] += 1
+                        if segmento['indice'] in hechos:
+                            if segmento['ruta']:
+                                os.remove(segmento['ruta'])
+                            continue
+                        futuro = pool.submit(self._transcribir_segmento, segmento, trabajo_id)
+                        futuro.add_done_callback(lambda f, i=segmento['indice']: al_terminar(i, f))
+
+        if errores:
+            indices = ", ".join(str(i + 1) for i in sorted(errores))
+            primero = errores[min(errores)]
+            raise RuntimeError(f"No se pudieron transcribir los segmentos {indices} de {enviados[0]}: {primero}")
+        return enviados[0]
+
+    def _segmentar(self, ruta: str, duracion_s: float, directorio: str, omitir=()):
+        """Segmentos de la grabación: en silencios si está activo, si no en cortes fijos"""
+        config = self.segmentacion
+        if not config['cortar_en_silencios'] and not config['solapamiento_s']:
+            return segmentar_audio(ruta, self.duracion_segmento_s, directorio)
+        if config['cortar_en_silencios']:
+            silencios = detectar_silencios(ruta, config['umbral_silencio_db'], config['duracion_min_silencio_s'])
+        else:
+            silencios = iter(())
+        ventana_s = min(config['ventana_silencio_s'], self.duracion_segmento_s / 2)
+        tramos = planificar_cortes(silencios, duracion_s, self.duracion_segmento_s, ventana_s)
+        return extraer_segmentos(ruta, tramos, directorio, config['solapamiento_s'], omitir)
+
+    def _transcribir_segmento(self, segmento: Dict, trabajo_id=None) -> str:
+        """Enviar un segmento a Whisper con reintentos, guardar su texto y borrar su archivo"""
+        def llamada():
+            with _cupos_segmentos, open(segmento['ruta'], "rb") as f:
+                return llm_scheduler.transcribir(
+                    f, self.modelo, PRIORIDAD_TRANSCRIPCION,
+                    origen="transcripcion", segundos_audio=segmento['duracion_s']
+                ).text
+
+        texto = con_reintentos(llamada, MAX_INTENTOS_SEGMENTO, ESPERA_REINTENTO_S,
+                               descripcion=f"Whisper (segmento {segmento['indice'] + 1})")
+        os.remove(segmento['ruta'])
+        if trabajo_id is not None:
+            try:
+                self.db_manager.guardar_segmento_transcripcion(
+                    trabajo_id, segmento['indice'], segmento['inicio_s'], segmento['duracion_s'], texto)
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar el segmento {segmento['indice'] + 1}: {e}")
+        return texto
+
+def ruta_salida_transcripcion(ruta: str) -> str:
+    """
+    Archivo de texto de la transcripción de `ruta` (en <ruta_datos>/transcripciones).
+    El nombre lleva un hash corto de la ruta absoluta: grabaciones homónimas de
+    carpetas distintas (p.ej. una importación recursiva) no se pisan.
+    """
+    ruta_base_datos = config_manager.get("almacenamiento", "ruta_datos", "./data")
+    nombre_sin_ext = os.path.splitext(os.path.basename(ruta))[0]
+    huella = hashlib.sha256(os.path.abspath(ruta).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(ruta_base_datos, "transcripciones", f"{nombre_sin_ext}_{huella}_transcripcion.txt")
+
+def transcribir_a_archivo(ruta: str, progreso: Callable[[int, str], None] = None) -> str:
+    """
+    Transcribir un archivo completo (formateando con GPT si
+    transcripcion.formatear_automaticamente) y guardar el texto en
+    transcripciones. `progreso(porcentaje, mensaje)` informa de cada etapa.
+    Retorna la ruta del archivo generado.
+    """
+    def informar(porcentaje: int, mensaje: str):
+        if progreso:
+            progreso(porcentaje, mensaje)
+
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"El archivo no existe: {ruta}")
+
+    modelo_whisper = config_manager.get("ia", "modelo_whisper", "whisper-1")
+    segment_length_min = config_manager.get("transcripcion", "segment_length_min", 10)
+    formatear_automaticamente = config_manager.get("transcripcion", "formatear_automaticamente", True)
+
+    # ffmpeg corta en segmentos mientras los ya terminados se transcriben
+    # en paralelo; la grabación nunca se decodifica completa en memoria.
+    # Cada fragmento de texto se formatea en cuanto sus segmentos están listos
+    formateador = FormateadorTranscripcion() if formatear_automaticamente else None
+    informar(10, "Dividiendo y transcribiendo segmentos...")
+    transcriptor = TranscriptorAudio(modelo_whisper, segment_length_min * 60)
+    try:
+        textos = transcriptor.transcribir(
+            ruta,
+            progreso=lambda completados, total: informar(
+                10 + int(completados / max(total, 1) * 70),
+                f"Segmentos transcritos: {completados}/{total}"),
+            al_texto=formateador.agregar if formateador else None
+        )
+        if not textos:
+            raise ValueError("El archivo no contiene audio para transcribir")
+    except Exception:
+        if formateador:
+            formateador.cancelar()
+        raise
+
+    # Terminar de formatear con GPT si está activado
+    if formateador:
+        informar(80, "Formateando texto con GPT...")
+        texto_final = formateador.terminar(
+            progreso=lambda listos, total: informar(
+                80 + int(listos / max(total, 1) * 15),
+                f"Fragmentos formateados: {listos}/{total}")
+        )
+        if formateador.fallidos:
+            informar(95, f"{formateador.fallidos} fragmento(s) sin formatear")
+    else:
+        informar(90, "Saltando formateo automático...")
+        texto_final = "\n".join(textos)
+
+    informar(95, "Guardando archivo...")
+    archivo_salida = ruta_salida_transcripcion(ruta)
+    os.makedirs(os.path.dirname(archivo_salida), exist_ok=True)
+    # Temporal propio de este escritor: dos transcripciones a la vez no comparten .parcial
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(archivo_salida),
+                                     prefix=f"{os.path.basename(archivo_salida)}.", suffix=".parcial",
+                                     delete=False) as f:
+        parcial = f.name
+        try:
+            f.write(texto_final)
+        except Exception:
+            f.close()
+            os.remove(parcial)
+            raise
+    os.replace(parcial, archivo_salida)
+    return archivo_salida
+
+class FormateadorTranscripcion:
+    """
+    Formatea la transcripción con GPT por fragmentos de hasta MAX_CARACTERES_FORMATO:
+    cada fragmento se envía en cuanto se completa (mientras Whisper sigue con el
+    resto) y varios se formatean a la vez. El resultado une los fragmentos en
+    orden; si uno falla tras los reintentos se conserva su texto original.
+    """
+
+    def __init__(self, modelo: str = MODELO_FORMATO, max_caracteres: int = MAX_CARACTERES_FORMATO,
+                 max_concurrencia: int = None):
+        self.modelo = modelo
+        self.max_caracteres = max_caracteres
+        self.fallidos = 0
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, max_concurrencia or config_manager.get_max_concurrencia_formato()))
+        self._futuros = []
+        self._lineas: List[str] = []
+        self._caracteres = 0
+        self._lock = threading.Lock()
+
+    def agregar(self, texto: str):
+        """Agregar el siguiente texto de la transcripción (en orden)"""
+        with self._lock:
+            for parte in self._partir(texto):
+                if self._lineas and self._caracteres + len(parte) + 1 > self.max_caracteres:
+                    self._enviar()
+                self._lineas.append(parte)
+                self._caracteres += len(parte) + 1
+
+    def terminar(self, progreso: Callable[[int, int], None] = None) -> str:
+        """Enviar el último fragmento, esperar a todos y retornar el texto formateado"""
+        with self._lock:
+            self._enviar()
+            futuros = list(self._futuros)
+        resultados = []
+        for i, futuro in enumerate(futuros, 1):
+            resultados.append(futuro.result())
+            if progreso:
+                progreso(i, len(futuros))
+        self._pool.shutdown()
+        return "\n\n".join(resultados)
+
+    def cancelar(self):
+        """Descartar los fragmentos que aún no empezaron"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _partir(self, texto: str) -> List[str]:
+        """Líneas del texto; las que superan el tamaño de fragmento se parten por oraciones"""
+        partes = []
+        for linea in texto.split("\n"):
+            if len(linea) <= self.max_caracteres:
+                partes.append(linea)
+                continue
+            actual = ""
+            for oracion in re.split(r"(?<=[.!?…])\s+", linea):
+                if actual and len(actual) + 1 + len(oracion) > self.max_caracteres:
+                    partes.append(actual)
+                    actual = oracion
+                else:
+                    actual = f"{actual} {oracion}" if actual else oracion
+            if actual:
+                partes.append(actual)
+        return partes
+
+    def _enviar(self):
+        fragmento = "\n".join(self._lineas).strip()
+        self._lineas, self._caracteres = [], 0
+        if fragmento:
+            self._futuros.append(self._pool.submit(self._formatear, len(self._futuros) + 1, fragmento))
+
+    def _formatear(self, numero: int, fragmento: str) -> str:
+        def llamada():
+            respuesta = llm_scheduler.chat(
+                [{"role": "user", "content": PROMPT_FORMATO.format(numero=numero, fragmento=fragmento)}],
+                self.modelo, PRIORIDAD_TRANSCRIPCION, origen="formato_transcripcion", temperature=0
+            )
+            return respuesta.choices[0].message.content.strip()
+
+        try:
+            return con_reintentos(llamada, descripcion=f"Formateo (fragmento {numero})")
+        except Exception as e:
+            print(f"⚠️ No se pudo formatear el fragmento {numero}, se conserva el texto original: {e}")
+            with self._lock:
+                self.fallidos += 1
+            return fragmento
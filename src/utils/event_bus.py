@@ -0,0 +1,71 @@
+"""
+Bus de eventos en proceso para notificar cambios de datos
+"""
+import threading
+from typing import Callable, Dict, List
+
+# Tipos de evento publicados por la capa de datos
+LIBRO_AGREGADO = "libro_agregado"
+LIBRO_ELIMINADO = "libro_eliminado"
+FRAGMENTOS_AGREGADOS = "fragmentos_agregados"
+CONSULTA_GUARDADA = "consulta_guardada"
+CONSULTA_ELIMINADA = "consulta_eliminada"
+STUDIO_ACTUALIZADO = "studio_actualizado"
+COLA_TRANSCRIPCION_ACTUALIZADA = "cola_transcripcion_actualizada"
+
+TODOS_LOS_EVENTOS = "*"
+
+
+class EventBus:
+    """Bus publicador/suscriptor compartido por toda la aplicación"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(EventBus, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._suscriptores: Dict[str, List[Callable]] = {}
+        self._lock = threading.Lock()
+        self._initialized = True
+
+    def suscribir(self, evento: str, callback: Callable):
+        """Registrar un callback(evento, datos) para un tipo de evento ('*' recibe todos)"""
+        with self._lock:
+            callbacks = self._suscriptores.setdefault(evento, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+    def desuscribir(self, evento: str, callback: Callable):
+        """Eliminar un callback registrado"""
+        with self._lock:
+            callbacks = self._suscriptores.get(evento, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def publicar(self, evento: str, **datos):
+        """
+        Notificar un evento a sus suscriptores.
+        Los callbacks se ejecutan en el hilo que publica; las vistas Qt deben
+        suscribirse a través de get_data_events() (DataEventsController) para
+        recibirlos en el hilo de la UI.
+        """
+        with self._lock:
+            callbacks = list(self._suscriptores.get(evento, []))
+            callbacks += self._suscriptores.get(TODOS_LOS_EVENTOS, [])
+
+        for callback in callbacks:
+            try:
+                callback(evento, datos)
+            except Exception as e:
+                print(f"⚠️ Error en suscriptor de '{evento}': {e}")
+
+
+# Instancia global
+event_bus = EventBus()
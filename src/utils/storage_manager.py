@@ -0,0 +1,318 @@
+"""
+Contabilidad de almacenamiento y limpieza automática del directorio de datos
+"""
+import os
+import threading
+import time
+from datetime import timezone
+from typing import Callable, Dict, List
+
+from config.config_manager import config_manager
+from database.db_manager import DatabaseManager
+from utils.event_bus import (event_bus, LIBRO_AGREGADO, LIBRO_ELIMINADO, FRAGMENTOS_AGREGADOS,
+                             STUDIO_ACTUALIZADO, CONSULTA_ELIMINADA)
+
+# Al superar el límite se libera espacio hasta quedar en este porcentaje
+FRACCION_OBJETIVO = 0.9
+# Espera tras un cambio de datos antes de revisar el uso (agrupa ráfagas de eventos)
+RETRASO_REVISION_S = 10
+# Subdirectorios de datos con contenido regenerable (se vacían por LRU)
+DIRECTORIOS_CACHE = ("vectors", "cache_tts")
+# Un audio sin libro asociado más reciente que esto puede estar generándose todavía
+GRACIA_HUERFANOS_S = 3600
+
+def _tamano(ruta: str) -> int:
+    try:
+        return os.path.getsize(ruta)
+    except OSError:
+        return 0
+
+def _ultimo_uso(ruta: str) -> float:
+    try:
+        st = os.stat(ruta)
+        return max(st.st_atime, st.st_mtime)
+    except OSError:
+        return 0.0
+
+class StorageManager:
+    """
+    Contabiliza el espacio ocupado (por categoría y por libro) y hace cumplir
+    almacenamiento.limite_almacenamiento_mb liberando artefactos regenerables.
+
+    Un recuperable es una función que retorna candidatos a liberar, cada uno un
+    dict con 'descripcion', 'bytes', 'ultimo_uso' (timestamp) y 'liberar' (callable).
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(StorageManager, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._recuperables: Dict[str, Callable[[], List[Dict]]] = {}
+        self._lock = threading.Lock()
+        self._lock_revision = threading.Lock()
+        self._temporizador = None
+        self._db_manager = None
+        self._iniciado = False
+
+        self.registrar_recuperable("podcasts", self._candidatos_podcasts)
+        self.registrar_recuperable("resumenes_studio", self._candidatos_resumenes_studio)
+        for nombre in DIRECTORIOS_CACHE:
+            self.registrar_directorio_cache(nombre)
+
+        self._initialized = True
+
+    # ============ CONFIGURACIÓN ============
+
+    def iniciar(self):
+        """Escuchar cambios de datos y programar la primera revisión"""
+        with self._lock:
+            if self._iniciado:
+                return
+            self._iniciado = True
+
+        for evento in (LIBRO_AGREGADO, LIBRO_ELIMINADO, FRAGMENTOS_AGREGADOS,
+                       STUDIO_ACTUALIZADO, CONSULTA_ELIMINADA):
+            event_bus.suscribir(evento, self._on_evento_datos)
+        self.programar_revision()
+
+    def registrar_recuperable(self, nombre: str, listar_candidatos: Callable[[], List[Dict]]):
+        """Registrar una fuente de artefactos regenerables que pueden eliminarse"""
+        with self._lock:
+            self._recuperables[nombre] = listar_candidatos
+
+    def registrar_directorio_cache(self, subdirectorio: str):
+        """Registrar un subdirectorio de datos cuyos archivos son cache regenerable"""
+        def listar():
+            return [
+                {
+                    'descripcion': f"cache {subdirectorio}: {os.path.basename(ruta)}",
+                    'bytes': _tamano(ruta),
+                    'ultimo_uso': _ultimo_uso(ruta),
+                    'liberar': lambda ruta=ruta: os.remove(ruta)
+                }
+                for ruta in self._archivos(os.path.join(self._ruta_datos(), subdirectorio))
+            ]
+        self.registrar_recuperable(subdirectorio, listar)
+
+    def registrar_uso(self, ruta: str):
+        """Marcar un artefacto como usado ahora (lo aleja de la evicción LRU)"""
+        try:
+            os.utime(ruta, None)
+        except OSError:
+            pass
+
+    @property
+    def db_manager(self) -> DatabaseManager:
+        if self._db_manager is None:
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    def _ruta_datos(self) -> str:
+        return config_manager.get("almacenamiento", "ruta_datos", "./data")
+
+    def _limite_bytes(self) -> int:
+        return int(config_manager.get("almacenamiento", "limite_almacenamiento_mb", 1000)) * 1024 * 1024
+
+    def _archivos_base_datos(self) -> List[str]:
+        """Archivo SQLite junto con su WAL y memoria compartida"""
+        if config_manager.get_tipo_bd() == "postgresql":
+            return []
+        ruta_db = config_manager.get_sqlite_config()['ruta_db']
+        return [ruta_db, f"{ruta_db}-wal", f"{ruta_db}-shm"]
+
+    def _archivos(self, directorio: str) -> List[str]:
+        rutas = []
+        for raiz, _, archivos in os.walk(directorio):
+            rutas.extend(os.path.join(raiz, nombre) for nombre in archivos)
+        return rutas
+
+    # ============ CONTABILIDAD ============
+
+    def obtener_uso_por_categoria(self) -> Dict[str, int]:
+        """Bytes por categoría: base de datos y cada subdirectorio de datos"""
+        archivos_bd = self._archivos_base_datos()
+        excluir = {os.path.abspath(r) for r in archivos_bd}
+        categorias = {'base_datos': sum(_tamano(r) for r in archivos_bd)}
+
+        ruta_datos = self._ruta_datos()
+        if os.path.isdir(ruta_datos):
+            for entrada in os.scandir(ruta_datos):
+                if entrada.is_dir():
+                    rutas = self._archivos(entrada.path)
+                    categoria = entrada.name
+                else:
+                    rutas = [entrada.path]
+                    categoria = 'otros'
+                categorias[categoria] = categorias.get(categoria, 0) + sum(
+                    _tamano(r) for r in rutas if os.path.abspath(r) not in excluir
+                )
+        return categorias
+
+    def obtener_total_bytes(self) -> int:
+        return sum(self.obtener_uso_por_categoria().values())
+
+    def obtener_uso_por_libro(self) -> Dict[int, Dict[str, int]]:
+        """Bytes por libro: fragmentos, embeddings, texto de Studio y audio de podcast"""
+        uso = self.db_manager.obtener_uso_almacenamiento_libros()
+        for libro in self.db_manager.obtener_libros():
+            entrada = uso.setdefault(libro['id'], {'fragmentos': 0, 'embeddings': 0, 'studio': 0})
+            ruta = libro.get('ruta_audio_podcast')
+            entrada['podcast'] = _tamano(ruta) if ruta else 0
+            entrada['total'] = sum(v for k, v in entrada.items() if k != 'total')
+        return uso
+
+    def obtener_resumen(self) -> Dict:
+        """Resumen para paneles: total, límite y desglose por categoría"""
+        categorias = self.obtener_uso_por_categoria()
+        return {
+            'total_bytes': sum(categorias.values()),
+            'limite_bytes': self._limite_bytes(),
+            'por_categoria': categorias
+        }
+
+    # ============ LIMPIEZA ============
+
+    def _candidatos_podcasts(self) -> List[Dict]:
+        """Audios de podcast: regenerables desde el guion guardado; huérfanos primero"""
+        candidatos = []
+        referenciados = set()
+        for libro in self.db_manager.obtener_libros():
+            ruta = libro.get('ruta_audio_podcast')
+            if not ruta:
+                continue
+            referenciados.add(os.path.abspath(ruta))
+            if not libro.get('guion_podcast') or not os.path.exists(ruta):
+                continue
+
+            def liberar(ruta=ruta, libro_id=libro['id']):
+                os.remove(ruta)
+                self.db_manager.actualizar_ruta_audio_podcast(libro_id, None)
+
+            candidatos.append({
+                'descripcion': f"podcast de '{libro['titulo']}'",
+                'bytes': _tamano(ruta),
+                'ultimo_uso': _ultimo_uso(ruta),
+                'liberar': liberar
+            })
+
+        # Los .parcial son ensamblados en curso, y un audio huérfano reciente puede
+        # ser un podcast recién generado que aún no se asoció a su libro
+        limite_gracia = time.time() - GRACIA_HUERFANOS_S
+        for ruta in self._archivos(os.path.join(self._ruta_datos(), "podcasts")):
+            if os.path.abspath(ruta) in referenciados or ruta.endswith(".parcial"):
+                continue
+            ultimo_uso = _ultimo_uso(ruta)
+            if ultimo_uso > limite_gracia:
+                continue
+            candidatos.append({
+                'descripcion': f"audio huérfano {os.path.basename(ruta)}",
+                'bytes': _tamano(ruta),
+                'ultimo_uso': ultimo_uso,
+                'liberar': lambda ruta=ruta: os.remove(ruta)
+            })
+        return candidatos
+
+    def _candidatos_resumenes_studio(self) -> List[Dict]:
+        """Resúmenes intermedios de Studio en la BD, por día de creación (se recalculan al pedirlos)"""
+        candidatos = []
+        for lote in self.db_manager.obtener_lotes_resumenes_fragmentos():
+            def liberar(desde=lote['desde'], hasta=lote['hasta']):
+                self.db_manager.eliminar_resumenes_fragmentos(desde, hasta)
+
+            candidatos.append({
+                'descripcion': f"{lote['filas']} resúmenes de Studio del {lote['desde']:%Y-%m-%d}",
+                'bytes': lote['bytes'],
+                'ultimo_uso': lote['hasta'].replace(tzinfo=timezone.utc).timestamp(),
+                'liberar': liberar
+            })
+        return candidatos
+
+    def liberar_espacio(self, objetivo_bytes: int) -> int:
+        """Eliminar artefactos regenerables, del menos usado al más reciente. Retorna bytes liberados"""
+        with self._lock:
+            fuentes = list(self._recuperables.items())
+
+        candidatos = []
+        for nombre, listar in fuentes:
+            try:
+                candidatos.extend(listar())
+            except Exception as e:
+                print(f"⚠️ Error listando recuperables '{nombre}': {e}")
+        candidatos.sort(key=lambda c: c['ultimo_uso'])
+
+        liberados = 0
+        for candidato in candidatos:
+            if liberados >= objetivo_bytes:
+                break
+            try:
+                candidato['liberar']()
+                liberados += candidato['bytes']
+                print(f"🧹 Liberado {candidato['descripcion']} ({candidato['bytes'] / 1024:.0f} KB)")
+            except Exception as e:
+                print(f"⚠️ No se pudo liberar {candidato['descripcion']}: {e}")
+
+        if liberados < objetivo_bytes:
+            print(f"⚠️ Límite de almacenamiento superado: faltan "
+                  f"{(objetivo_bytes - liberados) / (1024 * 1024):.1f} MB sin artefactos regenerables")
+        return liberados
+
+    def revisar(self) -> int:
+        """
+        Hacer cumplir el límite configurado y devolver al disco las páginas libres
+        de la BD (el checkpoint del WAL solo si se superó el límite). Retorna bytes liberados
+        """
+        if not self._lock_revision.acquire(blocking=False):
+            return 0  # Ya hay una revisión en curso
+        try:
+            liberados = 0
+            excedido = False
+            if config_manager.get("almacenamiento", "auto_limpieza", True):
+                total = self.obtener_total_bytes()
+                limite = self._limite_bytes()
+                excedido = total > limite
+                if excedido:
+                    print(f"📦 Almacenamiento {total / (1024 * 1024):.1f} MB supera el límite "
+                          f"de {limite / (1024 * 1024):.0f} MB. Liberando espacio...")
+                    liberados = self.liberar_espacio(total - int(limite * FRACCION_OBJETIVO))
+
+            paginas = self.db_manager.compactar_base_datos(checkpoint=excedido)
+            if paginas:
+                print(f"🗜️ Base de datos compactada: {paginas} páginas devueltas al disco")
+            return liberados
+        except Exception as e:
+            print(f"❌ Error revisando almacenamiento: {e}")
+            return 0
+        finally:
+            self._lock_revision.release()
+
+    def compactar_base_datos(self) -> int:
+        """
+        Mantenimiento explícito: VACUUM completo (activa auto_vacuum incremental si
+        falta) y checkpoint del WAL. Bloquea las escrituras mientras dura. Retorna páginas liberadas
+        """
+        paginas = self.db_manager.compactar_base_datos(checkpoint=True, convertir=True)
+        print(f"🗜️ Base de datos compactada: {paginas} páginas devueltas al disco")
+        return paginas
+
+    def programar_revision(self, retraso: float = RETRASO_REVISION_S):
+        """Revisar en segundo plano tras `retraso` segundos (reinicia la espera si ya estaba programada)"""
+        with self._lock:
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+            self._temporizador = threading.Timer(retraso, self.revisar)
+            self._temporizador.daemon = True
+            self._temporizador.start()
+
+    def _on_evento_datos(self, evento: str, datos: Dict):
+        self.programar_revision()
+
+# Instancia global
+storage_manager = StorageManager()
@@ -24,19 +24,51 @@ import numpy as np
 # Importar los módulos que creamos
 from database.db_manager import DatabaseManager
 from processing.pdf_processor import PDFProcessor
-from ai.query_processor import QueryProcessor
+from ai.query_processor import (QueryProcessor, VERSIONES_PROMPT_STUDIO, ErrorStudio,
+                                SIN_INFORMACION_RELEVANTE, hash_fragmentos)
 from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler
+from ai.precomputo_studio import precomputo_studio
+from controllers.data_events_controller import get_data_events
+from utils.storage_manager import storage_manager
+from utils.event_bus import (LIBRO_AGREGADO, LIBRO_ELIMINADO, FRAGMENTOS_AGREGADOS,
+                             CONSULTA_GUARDADA, CONSULTA_ELIMINADA, STUDIO_ACTUALIZADO)
 from views.apps.base_app import BaseApp
 
 # ============ CHAT WIDGETS ============
 
 class ChatMessageWidget(QWidget):
     """Widget para mostrar un mensaje estilo chat"""
+    # Emitida tras repintar texto nuevo (el item de la lista debe ajustar su tamaño)
+    contenido_cambiado = pyqtSignal()
+
+    # Intervalo mínimo entre repintados al recibir texto en streaming
+    INTERVALO_REPINTADO_MS = 50
+
     def __init__(self, text, is_user=False, parent=None):
         super().__init__(parent)
         self.text = text
         self.is_user = is_user
+        self.repaint_timer = QTimer(self)
+        self.repaint_timer.setSingleShot(True)
+        self.repaint_timer.timeout.connect(self.refrescar_texto)
         self.setup_ui()
+
+    def append_text(self, delta: str):
+        """Agregar texto al mensaje; los repintados se agrupan para no saturar la UI"""
+        self.text += delta
+        if not self.repaint_timer.isActive():
+            self.repaint_timer.start(self.INTERVALO_REPINTADO_MS)
+
+    def set_text(self, text: str):
+        """Reemplazar el texto completo y repintar de inmediato"""
+        self.text = text
+        self.repaint_timer.stop()
+        self.refrescar_texto()
+
+    def refrescar_texto(self):
+        self.label.setText(self.text)
+        self.contenido_cambiado.emit()
     
     def setup_ui(self):
         layout = QHBoxLayout(self)
@@ -77,16 +109,16 @@ class ChatMessageWidget(QWidget):
         bubble_layout = QVBoxLayout(bubble)
         bubble_layout.setContentsMargins(5, 5, 5, 5)
         
-        label = QLabel(self.text)
-        label.setWordWrap(True)
-        label.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        label.setStyleSheet(f"""
+        self.label = QLabel(self.text)
+        self.label.setWordWrap(True)
+        self.label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.label.setStyleSheet(f"""
             color: {text_color};
             font-size: 14px;
             background: transparent;
             border: none;
         """)
-        bubble_layout.addWidget(label)
+        bubble_layout.addWidget(self.label)
         
         return bubble
 
@@ -483,19 +515,49 @@ class DialogoSeleccionLibros(QDialog):
 class ConsultaThread(QThread):
     """Hilo seguro para procesar consultas IA"""
     respuesta_lista = pyqtSignal(str)
+    fragmento_respuesta = pyqtSignal(str)  # Texto incremental de la respuesta en streaming
+    respuesta_completa = pyqtSignal(str)   # Texto final al terminar el streaming
+    respuesta_similar = pyqtSignal(dict)   # Consulta previa casi idéntica (cache semántico)
+    conversacion_actualizada = pyqtSignal(int)  # Id de la conversación a la que pertenece el turno
     habilitar_boton = pyqtSignal()
     error_ocurrido = pyqtSignal(str)
     
-    def __init__(self, pregunta, db_manager, query_processor, libros_filtrados=None):
+    def __init__(self, pregunta, db_manager, query_processor, libros_filtrados=None, usar_cache=True,
+                 conversacion_id=None):
         super().__init__()
         self.pregunta = pregunta
         self.db_manager = db_manager
         self.query_processor = query_processor
         self.libros_filtrados = libros_filtrados  # Lista de IDs de libros específicos
+        self.usar_cache = usar_cache and config_manager.get_cache_respuestas_activo()
+        self.conversacion_id = conversacion_id  # None = primera pregunta de una conversación
     
     def run(self):
         """Ejecutar consulta en el hilo secundario"""
         try:
+            modelo = config_manager.get_modelo()
+            
+            # Turnos previos: resumen acotado y fragmentos del turno anterior
+            conversacion = None
+            if self.conversacion_id and config_manager.get_conversacion_activa():
+                conversacion = self.db_manager.obtener_conversacion(self.conversacion_id)
+            resumen = conversacion['resumen'] if conversacion else ""
+            candidatos_previos = conversacion['fragmentos_previos'] if conversacion else None
+            seguimiento = bool(resumen)
+            
+            # El embedding de la pregunta sirve para el cache semántico y para la búsqueda.
+            # Una pregunta de seguimiento depende de la conversación: no se busca en cache
+            embedding_pregunta = self.query_processor.generar_embedding_pregunta(self.pregunta)
+            if self.usar_cache and embedding_pregunta and not seguimiento:
+                similar = self.db_manager.buscar_consulta_similar(
+                    embedding_pregunta, self.libros_filtrados, modelo,
+                    config_manager.get_umbral_cache_respuestas()
+                )
+                if similar:
+                    print(f"♻️ Pregunta similar en cache (similitud {similar['similitud']:.3f})")
+                    self.respuesta_similar.emit(similar)
+                    return
+            
             # Obtener fragmentos según el filtro
             if self.libros_filtrados:
                 # Buscar solo en libros específicos
@@ -514,26 +576,52 @@ class ConsultaThread(QThread):
             
             # Encontrar fragmentos relevantes
             fragmentos_relevantes, libros_referenciados = self.query_processor.encontrar_fragmentos_relevantes(
-                self.pregunta, todos_fragmentos
+                self.pregunta, todos_fragmentos, embedding_pregunta=embedding_pregunta,
+                candidatos_previos=candidatos_previos
             )
             
-            # Generar respuesta
-            respuesta = self.query_processor.generar_respuesta(
-                self.pregunta, fragmentos_relevantes, libros_referenciados
-            )
+            # Generar respuesta en streaming: la UI la muestra a medida que llega
+            partes = []
+            uso = {}
+            for delta in self.query_processor.generar_respuesta_stream(
+                self.pregunta, fragmentos_relevantes, libros_referenciados, uso=uso,
+                resumen_conversacion=resumen or None
+            ):
+                partes.append(delta)
+                self.fragmento_respuesta.emit(delta)
+            respuesta = "".join(partes)
+            
+            self.respuesta_completa.emit(respuesta)
+            
+            # Guardar consulta en base de datos una vez completa. Solo las respuestas
+            # reales de preguntas independientes entran al cache semántico
+            # (no errores, ni "sin información", ni seguimientos)
+            valida = not uso.get('error') and respuesta != SIN_INFORMACION_RELEVANTE
+            conversacion_id = self.conversacion_id
+            if valida and config_manager.get_conversacion_activa():
+                # La entrada sigue bloqueada hasta registrar el turno, así la
+                # siguiente pregunta ya ve el resumen actualizado
+                try:
+                    resumen = self.query_processor.actualizar_resumen_conversacion(resumen, self.pregunta, respuesta)
+                    conversacion_id = self.db_manager.guardar_conversacion(
+                        conversacion_id, resumen, uso.get('fragmentos_ids'))
+                    self.conversacion_actualizada.emit(conversacion_id)
+                except Exception as e:
+                    print(f"⚠️ No se pudo registrar el turno de la conversación: {e}")
+            self.habilitar_boton.emit()
             
-            # Guardar consulta en base de datos
             self.db_manager.guardar_consulta(
                 pregunta=self.pregunta,
                 respuesta=respuesta,
                 libros_referenciados=libros_referenciados,
-                modelo=config_manager.get_modelo()
+                fragmentos_utilizados=uso.get('fragmentos_ids'),
+                modelo=modelo,
+                tokens_utilizados=uso.get('total_tokens', 0),
+                embedding_pregunta=embedding_pregunta if valida and not seguimiento else None,
+                ambito_libros=self.libros_filtrados,
+                conversacion_id=conversacion_id
             )
             
-            # Emitir señales para actualizar UI
-            self.respuesta_lista.emit(respuesta)
-            self.habilitar_boton.emit()
-            
         except Exception as e:
             error_msg = f"Error procesando consulta:\n\n{str(e)}"
             self.error_ocurrido.emit(error_msg)
@@ -551,6 +639,22 @@ class LibraryManagerDialog(QDialog):
         self.indice_actual = -1
         self.setup_ui()
         self.actualizar_lista_libros()
+
+        # Refrescar la lista cuando cambien los libros (incluso desde otros hilos)
+        get_data_events().evento_datos.connect(self.on_evento_datos)
+
+    def on_evento_datos(self, evento, datos):
+        """Refrescar la lista ante altas, bajas o reprocesado de libros"""
+        if evento in (LIBRO_AGREGADO, LIBRO_ELIMINADO, FRAGMENTOS_AGREGADOS):
+            self.actualizar_lista_libros()
+
+    def done(self, result):
+        """Dejar de escuchar eventos al cerrar el diálogo"""
+        try:
+            get_data_events().evento_datos.disconnect(self.on_evento_datos)
+        except TypeError:
+            pass
+        super().done(result)
         
     def setup_ui(self):
         layout = QVBoxLayout(self)
@@ -619,6 +723,7 @@ class LibraryManagerDialog(QDialog):
             QListWidget::item { padding: 8px; border-bottom: 1px solid #f0f0f0; }
             QListWidget::item:selected { background-color: #3498db; color: white; }
         """)
+        self.lista_libros.setSelectionMode(QListWidget.ExtendedSelection)
         self.lista_libros.itemSelectionChanged.connect(self.on_libro_seleccionado)
         list_layout.addWidget(self.lista_libros)
         
@@ -709,7 +814,6 @@ class LibraryManagerDialog(QDialog):
         dialog.close()
         if exito:
             QMessageBox.information(self, "✅ Procesamiento Completado", mensaje)
-            self.actualizar_lista_libros() # Actualizamos la lista local
         else:
             QMessageBox.critical(self, "❌ Error en Procesamiento", mensaje)
 
@@ -771,8 +875,6 @@ class LibraryManagerDialog(QDialog):
         errores = [r for r in self.resultados_procesamiento if not r['exito']]
         exitos = [r for r in self.resultados_procesamiento if r['exito']]
         
-        self.actualizar_lista_libros()
-        
         if not errores:
             QMessageBox.information(
                 self, "✅ Lote Completado", 
@@ -787,8 +889,8 @@ class LibraryManagerDialog(QDialog):
 
     def actualizar_lista_libros(self):
         self.lista_libros.clear()
-        # Forzar refresco desde DB para asegurar que vemos lo último
-        libros = self.db_manager.obtener_libros(force_refresh=True)
+        # El cache compartido se mantiene al día mediante eventos de datos
+        libros = self.db_manager.obtener_libros()
         
         # Filtrado
         query = self.barra_busqueda.text().lower()
@@ -820,8 +922,12 @@ class LibraryManagerDialog(QDialog):
             self.btn_delete.setEnabled(False)
             return
             
-        libro = items[0].data(Qt.UserRole)
         self.btn_delete.setEnabled(True)
+        if len(items) > 1:
+            self.lbl_details.setText(f"<h2>{len(items)} libros seleccionados</h2>")
+            return
+
+        libro = items[0].data(Qt.UserRole)
         
         html = f"""
         <h2>{libro['titulo']}</h2>
@@ -838,24 +944,26 @@ class LibraryManagerDialog(QDialog):
         pass # Obsoleto/Eliminado de UI
         
     def eliminar_libro_seleccionado(self):
-        """Eliminar el libro seleccionado"""
+        """Eliminar los libros seleccionados"""
         items = self.lista_libros.selectedItems()
         if not items: return
         
-        libro = items[0].data(Qt.UserRole)
-        titulo = libro['titulo']
+        libros = [item.data(Qt.UserRole) for item in items]
+        if len(libros) == 1:
+            descripcion = f"el libro '{libros[0]['titulo']}'"
+        else:
+            descripcion = f"{len(libros)} libros"
         
         reply = QMessageBox.question(
             self, 
             "Confirmar eliminación", 
-            f"¿Estás seguro de que deseas eliminar el libro '{titulo}'?\n\nEsta acción no se puede deshacer.",
+            f"¿Estás seguro de que deseas eliminar {descripcion}?\n\nEsta acción no se puede deshacer.",
             QMessageBox.Yes | QMessageBox.No
         )
         
         if reply == QMessageBox.Yes:
-            if self.db_manager.eliminar_libro(libro['id']):
-                QMessageBox.information(self, "Eliminado", f"El libro '{titulo}' ha sido eliminado.")
-                self.actualizar_lista_libros()
+            if self.db_manager.eliminar_libros([libro['id'] for libro in libros]):
+                QMessageBox.information(self, "Eliminado", f"Se ha eliminado {descripcion}.")
                 # Limpiar panel de detalles
                 self.lbl_details.setText("Selecciona un libro para ver su información detallada.")
                 self.btn_delete.setEnabled(False)
@@ -868,6 +976,23 @@ class BibliotecaApp(BaseApp):
     respuesta_lista = pyqtSignal(str)
     habilitar_boton = pyqtSignal()
     error_ocurrido = pyqtSignal(str)
+    progreso_podcast = pyqtSignal(int, int)  # Líneas del guion sintetizadas / total
+
+    # Presentación y columna por libro (selección de un solo libro) de cada artefacto de Studio
+    STUDIO_TITULOS = {
+        "guia": "✨ Guía de Fuente",
+        "podcast": "🎧 Deep Dive (Podcast Script)",
+        "mapa": "🗺️ Mapa Mental",
+        "informe": "📄 Informe Profesional",
+        "cuestionario": "📝 Cuestionario de Autoevaluación",
+    }
+    STUDIO_CAMPOS_LIBRO = {
+        "guia": "guia_fuente",
+        "podcast": "guion_podcast",
+        "mapa": "mapa_mental",
+        "informe": "informe_estudio",
+        "cuestionario": "cuestionario",
+    }
     
     def __init__(self):
         super().__init__()
@@ -875,6 +1000,7 @@ class BibliotecaApp(BaseApp):
         self.respuesta_lista.connect(self.actualizar_respuesta_chat)
         self.habilitar_boton.connect(self.rehabilitar_chat_input)
         self.error_ocurrido.connect(self.mostrar_error_chat)
+        self.progreso_podcast.connect(self.on_progreso_podcast)
         
         # Inicializar managers
         self.db_manager = DatabaseManager()
@@ -885,6 +1011,8 @@ class BibliotecaApp(BaseApp):
         self.libros_consulta = None  # None = todos, lista = libros específicos
         self.libros_filtrados = []
         self.indice_actual = -1
+        self.mensaje_en_curso = None  # Burbuja de la respuesta en streaming
+        self.conversacion_id = None  # Conversación en curso del chat (None = nueva)
         
         # Variables para procesamiento por lotes
         self.cola_procesamiento = []
@@ -899,6 +1027,9 @@ class BibliotecaApp(BaseApp):
         
         self.setup_ui()
         self.actualizar_estadisticas()
+
+        # Refresco incremental de la UI ante cambios de datos
+        get_data_events().evento_datos.connect(self.on_evento_datos)
         
     def get_title(self):
         return "Biblioteca IA"
@@ -1298,13 +1429,20 @@ class BibliotecaApp(BaseApp):
         self.chat_history.scrollToBottom()
     
     def add_ai_message(self, text):
-        """Agregar mensaje de la IA al chat"""
+        """Agregar mensaje de la IA al chat (retorna el widget para poder ampliarlo)"""
         item = QListWidgetItem()
         widget = ChatMessageWidget(text, is_user=False)
         item.setSizeHint(widget.sizeHint())
         self.chat_history.addItem(item)
         self.chat_history.setItemWidget(item, widget)
         self.chat_history.scrollToBottom()
+        widget.contenido_cambiado.connect(lambda: self.ajustar_mensaje_chat(item, widget))
+        return widget
+
+    def ajustar_mensaje_chat(self, item, widget):
+        """Recalcular el alto de un mensaje que creció y mantener visible el final"""
+        item.setSizeHint(widget.sizeHint())
+        self.chat_history.scrollToBottom()
     
     def add_system_message(self, text):
         """Agregar mensaje del sistema (como mensaje de IA)"""
@@ -1324,8 +1462,8 @@ class BibliotecaApp(BaseApp):
             self.libros_consulta = None
             self.combo_ambito.setCurrentText("Todos los libros")
         
-        # Verificar API key
-        if not config_manager.get_api_key():
+        # Verificar API key (el proveedor local no la necesita)
+        if not llm_scheduler.disponible():
             self.add_system_message("API Key Requerida. Ve a Configuración → IA y agrega tu API Key.")
             return
         
@@ -1334,23 +1472,92 @@ class BibliotecaApp(BaseApp):
         
         # Deshabilitar entrada durante procesamiento
         self.chat_input.set_enabled(False)
-        
-        # Crear y ejecutar thread de consulta
+        self.iniciar_consulta(pregunta)
+
+    def iniciar_consulta(self, pregunta, usar_cache=True):
+        """Crear y ejecutar el thread de consulta"""
         self.consulta_thread = ConsultaThread(
             pregunta, 
             self.db_manager, 
             self.query_processor, 
-            self.libros_consulta
+            self.libros_consulta,
+            usar_cache=usar_cache,
+            conversacion_id=self.conversacion_id
         )
+        self.mensaje_en_curso = None
         self.consulta_thread.respuesta_lista.connect(self.actualizar_respuesta_chat)
+        self.consulta_thread.fragmento_respuesta.connect(self.on_fragmento_respuesta)
+        self.consulta_thread.respuesta_completa.connect(self.on_respuesta_completa)
+        self.consulta_thread.respuesta_similar.connect(
+            lambda similar, pregunta=pregunta: self.on_respuesta_similar(pregunta, similar))
+        self.consulta_thread.conversacion_actualizada.connect(
+            lambda conversacion_id, anterior=self.conversacion_id:
+                self.on_conversacion_actualizada(anterior, conversacion_id))
         self.consulta_thread.habilitar_boton.connect(self.rehabilitar_chat_input)
-        self.consulta_thread.habilitar_boton.connect(self.actualizar_lista_historial) # Actualizar historial
         self.consulta_thread.error_ocurrido.connect(self.mostrar_error_chat)
         self.consulta_thread.start()
+
+    def on_conversacion_actualizada(self, anterior, conversacion_id):
+        """Seguir la conversación del turno, salvo que el usuario ya haya iniciado otra"""
+        if self.conversacion_id == anterior:
+            self.conversacion_id = conversacion_id
+
+    def on_respuesta_similar(self, pregunta, similar):
+        """Reutilizar (u ofrecer) la respuesta de una pregunta casi idéntica del mismo ámbito"""
+        if config_manager.get_modo_cache_respuestas() == "ofrecer":
+            fecha = similar['fecha'].strftime('%d/%m/%Y') if similar.get('fecha') else ""
+            reply = QMessageBox.question(
+                self, "Respuesta similar encontrada",
+                f"Ya se respondió una pregunta muy parecida ({similar['similitud']:.0%}) el {fecha}:\n\n"
+                f"«{similar['pregunta']}»\n\n¿Quieres reutilizar esa respuesta?\n"
+                f"(No genera una nueva consulta al modelo)",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+            )
+            if reply != QMessageBox.Yes:
+                self.iniciar_consulta(pregunta, usar_cache=False)
+                return
+
+        self.add_ai_message(
+            f"♻️ Respuesta reutilizada de una pregunta similar ({similar['similitud']:.0%}): "
+            f"«{similar['pregunta']}»\n\n{similar['respuesta']}"
+        )
+        try:
+            if config_manager.get_conversacion_activa():
+                # La respuesta reutilizada abre la conversación como cualquier primer turno
+                resumen = self.query_processor.actualizar_resumen_conversacion(
+                    "", pregunta, similar['respuesta'])
+                self.conversacion_id = self.db_manager.guardar_conversacion(
+                    self.conversacion_id, resumen, similar['fragmentos_utilizados'])
+            self.db_manager.guardar_consulta(
+                pregunta=pregunta,
+                respuesta=similar['respuesta'],
+                libros_referenciados=similar['libros_referenciados'],
+                fragmentos_utilizados=similar['fragmentos_utilizados'],
+                modelo=config_manager.get_modelo(),
+                ambito_libros=self.libros_consulta,
+                conversacion_id=self.conversacion_id
+            )
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar la consulta reutilizada: {e}")
+        self.rehabilitar_chat_input()
     
     def actualizar_respuesta_chat(self, respuesta):
         """Actualizar con respuesta de IA en el chat"""
         self.add_ai_message(respuesta)
+
+    def on_fragmento_respuesta(self, delta):
+        """Mostrar el texto de la respuesta a medida que llega"""
+        if self.mensaje_en_curso is None:
+            self.mensaje_en_curso = self.add_ai_message("")
+        self.mensaje_en_curso.append_text(delta)
+
+    def on_respuesta_completa(self, respuesta):
+        """Fijar el texto final de la respuesta en streaming"""
+        if self.mensaje_en_curso is None:
+            self.add_ai_message(respuesta)
+        else:
+            self.mensaje_en_curso.set_text(respuesta)
+        self.mensaje_en_curso = None
     
     def rehabilitar_chat_input(self):
         """Rehabilitar entrada de chat"""
@@ -1374,6 +1581,15 @@ class BibliotecaApp(BaseApp):
             self.lista_historial.addItem(item)
             self.lista_historial.setItemWidget(item, widget)
 
+    def on_evento_datos(self, evento, datos):
+        """Refrescar solo las partes de la UI afectadas por un cambio de datos"""
+        if evento in (CONSULTA_GUARDADA, CONSULTA_ELIMINADA):
+            self.actualizar_lista_historial(busqueda=self.history_search.text() or None)
+        elif evento in (STUDIO_ACTUALIZADO, FRAGMENTOS_AGREGADOS, LIBRO_ELIMINADO):
+            afectados = set(datos.get('libro_ids') or [datos.get('libro_id')])
+            if self.libros_consulta and afectados & set(self.libros_consulta):
+                self.actualizar_indicadores_analisis()
+
     def on_history_search_changed(self, text):
         """Manejador para búsqueda en el historial"""
         self.actualizar_lista_historial(busqueda=text)
@@ -1386,10 +1602,16 @@ class BibliotecaApp(BaseApp):
         consulta = next((c for c in historial if c['id'] == consulta_id), None)
         
         if consulta:
-            # Limpiar chat y cargar esta conversación
+            # Limpiar chat y cargar esta conversación (todos sus turnos), que
+            # continúa con la siguiente pregunta
             self.chat_history.clear()
-            self.add_user_message(consulta['pregunta'])
-            self.add_ai_message(consulta['respuesta'])
+            self.conversacion_id = consulta.get('conversacion_id')
+            turnos = []
+            if self.conversacion_id:
+                turnos = self.db_manager.obtener_consultas_conversacion(self.conversacion_id)
+            for turno in turnos or [consulta]:
+                self.add_user_message(turno['pregunta'])
+                self.add_ai_message(turno['respuesta'])
             
             # Si hay libros referenciados, restaurar el contexto
             if consulta['libros_referenciados']:
@@ -1484,50 +1706,55 @@ class BibliotecaApp(BaseApp):
         
         if reply == QMessageBox.Yes:
             if self.db_manager.eliminar_consulta(consulta_id):
-                self.actualizar_lista_historial()
                 self.add_system_message("Consulta eliminada del historial.")
 
     def on_clear_history(self):
-        """Limpiar todo el historial (con confirmación)"""
-        reply = QMessageBox.question(
-            self, "Confirmar", "¿Estás seguro de que deseas eliminar todo el historial de consultas?",
-            QMessageBox.Yes | QMessageBox.No
-        )
+        """Limpiar el historial (todo, o solo lo que coincide con la búsqueda activa)"""
+        busqueda = self.history_search.text().strip() or None
+        if busqueda:
+            pregunta = f"¿Estás seguro de que deseas eliminar las consultas que coinciden con '{busqueda}'?"
+        else:
+            pregunta = "¿Estás seguro de que deseas eliminar todo el historial de consultas?"
+
+        reply = QMessageBox.question(self, "Confirmar", pregunta, QMessageBox.Yes | QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            # Por ahora eliminamos uno por uno o implementamos un clear_all en db_manager
-            historial = self.db_manager.obtener_historial_consultas()
-            for c in historial:
-                self.db_manager.eliminar_consulta(c['id'])
-            self.actualizar_lista_historial()
-            QMessageBox.information(self, "Éxito", "Historial eliminado correctamente.")
+            # Borrado en bloque: una sola sentencia y una sola transacción
+            eliminadas = self.db_manager.eliminar_consultas(busqueda=busqueda)
+            QMessageBox.information(self, "Éxito", f"Se eliminaron {eliminadas} consultas del historial.")
 
 
     def on_nuevo_chat(self):
         """Limpiar el chat y resetear el contexto"""
         self.chat_history.clear()
         self.libros_consulta = None
+        self.conversacion_id = None
         self.label_ambito_actual.setText("📚 Todos los libros")
         self.add_system_message("Nuevo chat iniciado. Contexto reseteado a toda la biblioteca.")
         self.actualizar_indicadores_analisis()
 
     def actualizar_indicadores_analisis(self):
         """Actualizar los iconos de estado de análisis según la selección"""
-        # Regla de Oro: Solo mostrar si hay exactamente UN libro seleccionado
-        if not self.libros_consulta or len(self.libros_consulta) != 1:
+        # Studio funciona con cualquier selección explícita de libros
+        if not self.libros_consulta:
             self.status_indicators.hide()
             self.btn_studio.hide()
-            # Ocultar botones avanzados de NotebookLM si hay varios o ninguno
             self.btn_source_guide.hide()
             self.btn_deep_dive.hide()
             self.btn_play_podcast.hide()
             return
         
-        # Mostrar botones solo para single book selection
         self.btn_source_guide.show()
         self.btn_deep_dive.show()
-        self.btn_play_podcast.show()
         self.btn_studio.show()
+
+        # El audio del podcast y los indicadores son por libro: solo con UN libro seleccionado
+        if len(self.libros_consulta) != 1:
+            self.btn_play_podcast.hide()
+            self.status_indicators.hide()
+            return
+
+        self.btn_play_podcast.show()
         self.status_indicators.show()
         
         # Obtener libro seleccionado
@@ -1565,7 +1792,9 @@ class BibliotecaApp(BaseApp):
         
         # Obtener libro actual para chequear qué ya existe
         libros = self.db_manager.obtener_libros()
-        libro = next((l for l in libros if l['id'] == self.libros_consulta[0]), None) if self.libros_consulta else None
+        libro = None
+        if self.libros_consulta and len(self.libros_consulta) == 1:
+            libro = next((l for l in libros if l['id'] == self.libros_consulta[0]), None)
         
         def get_text(base, field):
             return f"✅ {base}" if libro and libro.get(field) else base
@@ -1591,101 +1820,68 @@ class BibliotecaApp(BaseApp):
             self.generar_studio_output("cuestionario")
 
     def generar_studio_output(self, tipo):
-        """Flujo de generación para Notebook Studio"""
-        if not self.libros_consulta or len(self.libros_consulta) != 1:
+        """
+        Flujo de generación para Notebook Studio (uno o varios libros). El resultado
+        se guarda por (tipo, modelo, versión de prompt, conjunto de fragmentos), así
+        que repetir la misma selección lo recupera sin llamar al modelo.
+        """
+        if not self.libros_consulta:
+            QMessageBox.warning(self, "Atención", "Selecciona al menos un libro para usar Studio.")
             return
-            
-        libro_id = self.libros_consulta[0]
-        libros = self.db_manager.obtener_libros()
-        libro = next((l for l in libros if l['id'] == libro_id), None)
-        
-        # Verificar caché primero
-        field_map = {"mapa": "mapa_mental", "informe": "informe_estudio", "cuestionario": "cuestionario"}
-        emoji_map = {"mapa": "🗺️", "informe": "📄", "cuestionario": "📝"}
-        title_map = {"mapa": "Mapa Mental", "informe": "Informe Profesional", "cuestionario": "Cuestionario de Autoevaluación"}
-        
-        field = field_map[tipo]
-        if libro and libro.get(field):
-            content = libro[field]
-            self.add_system_message(f"Recuperando {title_map[tipo]} guardado...")
-            if tipo == "mapa":
-                # Envolver Mermaid para la UI
-                self.add_ai_message(f"### {emoji_map[tipo]} {title_map[tipo]} (Mermaid)\n\n```mermaid\n{content}\n```")
-            else:
-                self.add_ai_message(f"### {emoji_map[tipo]} {title_map[tipo]}\n\n{content}")
+
+        libros_ids = sorted(self.libros_consulta)
+        libros = [l for l in self.db_manager.obtener_libros() if l['id'] in libros_ids]
+        if not libros:
             return
 
-        self.add_system_message(f"🪄 Studio: Generando {title_map[tipo]}... (puede tardar unos segundos)")
+        titulo = self.STUDIO_TITULOS[tipo]
+        self.add_system_message(f"🪄 Studio: Preparando {titulo} para {len(libros)} libro(s)...")
         self.chat_input.set_enabled(False)
-        
+
         def run():
             try:
-                fragmentos = self.db_manager.obtener_fragmentos_por_libros([libro_id])
-                
+                fragmentos = self.db_manager.obtener_fragmentos_por_libros(libros_ids)
+                if not fragmentos:
+                    self.error_ocurrido.emit("Los libros seleccionados no tienen fragmentos procesados.")
+                    return
+
+                modelo = self.query_processor.modelo_studio(tipo)
+                version = VERSIONES_PROMPT_STUDIO[tipo]
+                clave = hash_fragmentos(fragmentos)
+
+                if len(libros) == 1:
+                    # Si se está precalculando en segundo plano (prioridad más baja),
+                    # cancelarlo y generarlo aquí con prioridad interactiva
+                    precomputo_studio.ceder(libros_ids[0], tipo)
+
+                output = self.db_manager.obtener_artefacto_studio(tipo, modelo, version, clave)
+                if output is None and len(libros) == 1:
+                    # Contenido generado antes de existir la cache de artefactos
+                    output = libros[0].get(self.STUDIO_CAMPOS_LIBRO[tipo])
+                    if output:
+                        self.db_manager.guardar_artefacto_studio(tipo, modelo, version, clave, libros_ids, output)
+                guardado = output is not None
+
+                if not guardado:
+                    try:
+                        output = self.query_processor.generar_studio(tipo, libros, fragmentos)
+                    except ErrorStudio as e:
+                        self.error_ocurrido.emit(str(e))
+                        return
+                    if tipo == "mapa":
+                        # Limpiar Mermaid si viene con bloques de código
+                        output = output.replace("```mermaid", "").replace("```", "").strip()
+
+                    self.db_manager.guardar_artefacto_studio(tipo, modelo, version, clave, libros_ids, output)
+                    if len(libros) == 1:
+                        self._guardar_studio_en_libro(tipo, libros_ids[0], output)
+
+                header = f"### {titulo}" + (" (Guardado)" if guardado else "")
                 if tipo == "mapa":
-                    output = self.query_processor.generar_mapa_mental(fragmentos)
-                elif tipo == "informe":
-                    output = self.query_processor.generar_informe(fragmentos)
-                else:
-                    output = self.query_processor.generar_cuestionario(fragmentos)
-                
-                # Guardar en BD
-                self.db_manager.actualizar_studio_libro(libro_id, tipo, output)
-                
-                header = f"### {emoji_map[tipo]} {title_map[tipo]}"
-                if tipo == "mapa":
-                    # Limpiar Mermaid si viene con bloques de código
-                    output = output.replace("```mermaid", "").replace("```", "").strip()
                     self.respuesta_lista.emit(f"{header}\n\n```mermaid\n{output}\n```")
                 else:
                     self.respuesta_lista.emit(f"{header}\n\n{output}")
-                    
-                # Forzar actualización de indicadores
-                from PyQt5.QtCore import QTimer
-                QTimer.singleShot(100, lambda: self.actualizar_indicadores_analisis())
-                
-            except Exception as e:
-                self.error_ocurrido.emit(str(e))
-            finally:
-                self.habilitar_boton.emit()
-
-        threading.Thread(target=run).start()
-
-    def on_generar_guia_fuente(self):
-        """Generar y mostrar la Guía de Fuente (Solo Single Book)"""
-        if not self.libros_consulta or len(self.libros_consulta) != 1:
-            QMessageBox.warning(self, "Atención", "Selecciona exactamente un libro para la Guía de Fuente.")
-            return
 
-        libros = self.db_manager.obtener_libros()
-
-        libros_a_procesar = [l for l in libros if l['id'] in self.libros_consulta]
-        
-        # --- LÓGICA DE CACHÉ / PERSISTENCIA ---
-        if len(libros_a_procesar) == 1:
-            libro = libros_a_procesar[0]
-            if libro.get('guia_fuente'):
-                self.add_system_message(f"Recuperando guía guardada para: {libro['titulo']}")
-                self.add_ai_message(f"### ✨ Guía de Fuente (Guardada)\n\n{libro['guia_fuente']}")
-                return
-
-        self.add_system_message(f"Generando Guía de Fuente para {len(libros_a_procesar)} libro(s)...")
-        self.chat_input.set_enabled(False)
-        
-        def run():
-            try:
-                if self.libros_consulta:
-                    fragmentos = self.db_manager.obtener_fragmentos_por_libros(self.libros_consulta)
-                else:
-                    fragmentos = self.db_manager.obtener_todos_fragmentos()
-                
-                guia = self.query_processor.generar_guia_fuente(libros_a_procesar, fragmentos)
-                
-                # Guardar si es un solo libro
-                if len(libros_a_procesar) == 1:
-                    self.db_manager.actualizar_guia_fuente(libros_a_procesar[0]['id'], guia)
-                
-                self.respuesta_lista.emit(f"### ✨ Guía de Fuente\n\n{guia}")
             except Exception as e:
                 self.error_ocurrido.emit(str(e))
             finally:
@@ -1693,47 +1889,22 @@ class BibliotecaApp(BaseApp):
 
         threading.Thread(target=run).start()
 
-    def on_generar_deep_dive(self):
-        """Generar un guion de podcast (Deep Dive) - Solo Single Book"""
-        if not self.libros_consulta or len(self.libros_consulta) != 1:
-            QMessageBox.warning(self, "Atención", "Selecciona exactamente un libro para generar un Deep Dive.")
-            return
-
-        libros = self.db_manager.obtener_libros()
-
-        libros_a_procesar = [l for l in libros if l['id'] in self.libros_consulta]
-
-        # --- CACHÉ PARA DEEP DIVE (Solo si es 1 libro) ---
-        if len(libros_a_procesar) == 1:
-            libro = libros_a_procesar[0]
-            if libro.get('guion_podcast'):
-                self.add_system_message(f"Recuperando Deep Dive guardado para: {libro['titulo']}")
-                self.add_ai_message(f"### 🎧 Deep Dive (Guardado)\n\n{libro['guion_podcast']}")
-                return
-
-        self.add_system_message("Sumergiéndome en los documentos para generar un Deep Dive (Podcast)...")
-        self.chat_input.set_enabled(False)
-
-        def run():
-            try:
-                if self.libros_consulta:
-                    fragmentos = self.db_manager.obtener_fragmentos_por_libros(self.libros_consulta)
-                else:
-                    fragmentos = self.db_manager.obtener_todos_fragmentos()
-                
-                guion = self.query_processor.generar_guion_podcast(fragmentos)
-
-                # Guardar si es un solo libro
-                if self.libros_consulta and len(self.libros_consulta) == 1:
-                    self.db_manager.actualizar_guion_podcast(self.libros_consulta[0], guion)
+    def _guardar_studio_en_libro(self, tipo, libro_id, contenido):
+        """Mantener la columna del libro (indicadores de estado y audio del podcast)"""
+        if tipo == "guia":
+            self.db_manager.actualizar_guia_fuente(libro_id, contenido)
+        elif tipo == "podcast":
+            self.db_manager.actualizar_guion_podcast(libro_id, contenido)
+        else:
+            self.db_manager.actualizar_studio_libro(libro_id, tipo, contenido)
 
-                self.respuesta_lista.emit(f"### 🎧 Deep Dive (Podcast Script)\n\n{guion}")
-            except Exception as e:
-                self.error_ocurrido.emit(str(e))
-            finally:
-                self.habilitar_boton.emit()
+    def on_generar_guia_fuente(self):
+        """Generar y mostrar la Guía de Fuente de los libros seleccionados"""
+        self.generar_studio_output("guia")
 
-        threading.Thread(target=run).start()
+    def on_generar_deep_dive(self):
+        """Generar un guion de podcast (Deep Dive) de los libros seleccionados"""
+        self.generar_studio_output("podcast")
 
     def on_play_podcast(self):
         """Generar o reproducir el audio del podcast"""
@@ -1750,6 +1921,7 @@ class BibliotecaApp(BaseApp):
         # Si ya existe el audio, reproducirlo
         if libro.get('ruta_audio_podcast') and os.path.exists(libro['ruta_audio_podcast']):
             self.add_system_message(f"Reproduciendo podcast: {libro['titulo']}")
+            storage_manager.registrar_uso(libro['ruta_audio_podcast'])
             try:
                 os.startfile(libro['ruta_audio_podcast'])  # Windows
             except AttributeError:
@@ -1774,7 +1946,8 @@ class BibliotecaApp(BaseApp):
                 from ai.audio_processor import AudioProcessor
                 processor = AudioProcessor()
                 
-                ruta_final = processor.generar_podcast_audio(guion, libro['id'], libro['titulo'])
+                ruta_final = processor.generar_podcast_audio(guion, libro['id'], libro['titulo'],
+                                                             progreso=self.progreso_podcast.emit)
                 
                 # Guardar ruta en la DB
                 self.db_manager.actualizar_ruta_audio_podcast(libro['id'], ruta_final)
@@ -1788,9 +1961,17 @@ class BibliotecaApp(BaseApp):
                 # Volver a habilitar el botón
                 from PyQt5.QtCore import QTimer
                 QTimer.singleShot(0, lambda: self.btn_play_podcast.setEnabled(True))
+                self.progreso_podcast.emit(0, 0)
 
         threading.Thread(target=run).start()
 
+    def on_progreso_podcast(self, completadas, total):
+        """Mostrar en el botón cuántas líneas del guion ya tienen voz (total 0 = terminado)"""
+        if total:
+            self.btn_play_podcast.setText(f"🎤 {completadas}/{total}")
+        else:
+            self.btn_play_podcast.setText("▶️ Play Audio")
+
     def set_current_book_context(self, book_id, title):
         """Establecer un libro específico como contexto del chat desde el Manager"""
         self.libros_consulta = [book_id]
@@ -1824,8 +2005,7 @@ class BibliotecaApp(BaseApp):
 
     def seleccionar_libros_consulta(self):
         """Abrir diálogo para seleccionar múltiples libros"""
-        # Forzar refresco para ver libros acabados de agregar
-        libros = self.db_manager.obtener_libros(force_refresh=True)
+        libros = self.db_manager.obtener_libros()
         if not libros:
             QMessageBox.warning(self, "Sin libros", "No hay libros disponibles para seleccionar.")
             # self.combo_ambito.setCurrentText("Todos los libros") # ELIMINADO
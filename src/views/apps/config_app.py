@@ -133,6 +133,20 @@ class ConfigApp(BaseApp):
         
         group_layout = QVBoxLayout(group)
         
+        # Proveedor de modelos
+        provider_layout = QHBoxLayout()
+        provider_label = QLabel("Proveedor de modelos:")
+        provider_label.setFixedWidth(180)
+        self.provider_combo = QComboBox()
+        self.provider_combo.addItem("OpenAI", "openai")
+        self.provider_combo.addItem("Local (simulado, sin red)", "local")
+        self.provider_combo.setToolTip("El proveedor local responde de forma determinista y sin conexión; "
+                                       "sirve para pruebas de carga y equipos sin internet.")
+        provider_layout.addWidget(provider_label)
+        provider_layout.addWidget(self.provider_combo)
+        provider_layout.addStretch()
+        group_layout.addLayout(provider_layout)
+        
         # API Key con toggle de visibilidad
         api_layout = QHBoxLayout()
         api_label = QLabel("API Key de OpenAI:")
@@ -400,6 +414,10 @@ class ConfigApp(BaseApp):
         self.include_references.setChecked(True)
         query_layout.addRow("", self.include_references)
         
+        self.precompute_studio = QCheckBox("Preparar Guía y Mapa mental al importar (en segundo plano)")
+        self.precompute_studio.setChecked(False)
+        query_layout.addRow("", self.precompute_studio)
+        
         layout.addWidget(query_group)
         layout.addStretch()
         
@@ -439,13 +457,21 @@ class ConfigApp(BaseApp):
         group_layout.addLayout(limit_layout)
         
         # Auto limpieza
-        self.auto_clean_cb = QCheckBox("Eliminar archivos temporales automáticamente")
+        self.auto_clean_cb = QCheckBox("Liberar espacio automáticamente al superar el límite")
+        self.auto_clean_cb.setToolTip("Elimina primero los audios de podcast y cachés regenerables menos usados")
         group_layout.addWidget(self.auto_clean_cb)
         
         # Conservar PDFs
         self.keep_pdfs_cb = QCheckBox("Conservar archivos PDF originales después de procesar")
         group_layout.addWidget(self.keep_pdfs_cb)
         
+        # Compactación manual de la base de datos
+        self.compact_db_btn = QPushButton("🗜️ Compactar base de datos")
+        self.compact_db_btn.setToolTip("VACUUM completo de SQLite: puede tardar minutos en bases grandes "
+                                       "y requiere temporalmente el doble de espacio en disco")
+        self.compact_db_btn.clicked.connect(self.on_compact_database)
+        group_layout.addWidget(self.compact_db_btn)
+        
         layout.addWidget(group)
         
         # Grupo de transcripción
@@ -550,6 +576,8 @@ class ConfigApp(BaseApp):
         
         # IA
         self.api_key_input.setText(config_manager.get("ia", "api_key", ""))
+        indice_proveedor = self.provider_combo.findData(config_manager.get_proveedor_ia())
+        self.provider_combo.setCurrentIndex(max(0, indice_proveedor))
         self.model_combo.setCurrentText(config_manager.get("ia", "modelo", "gpt-3.5-turbo"))
         self.whisper_combo.setCurrentText(config_manager.get("ia", "modelo_whisper", "whisper-1"))
         
@@ -594,6 +622,7 @@ class ConfigApp(BaseApp):
         self.similarity_threshold_value.setText(f"{similarity:.1f}")
         self.max_response_tokens.setValue(config_manager.get_max_tokens_respuesta())
         self.include_references.setChecked(config_manager.get("biblioteca_ia", "consulta.incluir_referencias", True))
+        self.precompute_studio.setChecked(config_manager.get_precomputo_studio_activo())
         
         # Almacenamiento
         self.storage_path_input.setText(config_manager.get("almacenamiento", "ruta_datos", "./data"))
@@ -629,6 +658,22 @@ class ConfigApp(BaseApp):
         """Cuando cambia el umbral de similitud"""
         self.similarity_threshold_value.setText(f"{value/100:.1f}")
         
+    def on_compact_database(self):
+        """Compactar la base de datos en segundo plano (acción de mantenimiento explícita)"""
+        respuesta = QMessageBox.question(
+            self,
+            "Compactar base de datos",
+            "La compactación bloquea el guardado de datos mientras dura y necesita "
+            "temporalmente el doble de espacio en disco.\n\n¿Continuar?"
+        )
+        if respuesta != QMessageBox.Yes:
+            return
+        import threading
+        from utils.storage_manager import storage_manager
+        threading.Thread(target=storage_manager.compactar_base_datos, name="CompactarBD", daemon=True).start()
+        QMessageBox.information(self, "Compactar base de datos",
+                                "🗜️ Compactación iniciada en segundo plano.")
+        
     def on_browse_storage(self):
         """Abrir diálogo para seleccionar ruta de almacenamiento"""
         path = QFileDialog.getExistingDirectory(
@@ -677,6 +722,7 @@ class ConfigApp(BaseApp):
             
             # IA
             config_manager.set("ia", "api_key", self.api_key_input.text())
+            config_manager.set("ia", "proveedor", self.provider_combo.currentData())
             config_manager.set("ia", "modelo", self.model_combo.currentText())
             config_manager.set("ia", "modelo_whisper", self.whisper_combo.currentText())
             config_manager.set("ia", "temperatura", self.temp_slider.value() / 100)
@@ -720,12 +766,16 @@ class ConfigApp(BaseApp):
             config_manager.set("biblioteca_ia", "consulta.umbral_similitud", self.similarity_threshold.value() / 100)
             config_manager.set("biblioteca_ia", "consulta.max_tokens_respuesta", self.max_response_tokens.value())
             config_manager.set("biblioteca_ia", "consulta.incluir_referencias", self.include_references.isChecked())
+            config_manager.set("biblioteca_ia", "studio.precomputo.activo", self.precompute_studio.isChecked())
             
             # Almacenamiento
             config_manager.set("almacenamiento", "ruta_datos", self.storage_path_input.text())
             config_manager.set("almacenamiento", "limite_almacenamiento_mb", self.limit_spin.value())
             config_manager.set("almacenamiento", "auto_limpieza", self.auto_clean_cb.isChecked())
             config_manager.set("almacenamiento", "conservar_pdfs", self.keep_pdfs_cb.isChecked())
+            # Aplicar el nuevo límite sin esperar al próximo cambio de datos
+            from utils.storage_manager import storage_manager
+            storage_manager.programar_revision(0)
             
             # Transcripción
             config_manager.set("transcripcion", "segment_length_min", self.segment_spin.value())
@@ -9,6 +9,10 @@ from datetime import datetime, timedelta
 
 from views.apps.base_app import BaseApp
 from database.db_manager import DatabaseManager
+from controllers.data_events_controller import get_data_events
+from utils.storage_manager import storage_manager
+from ai.llm_scheduler import llm_scheduler
+from utils.event_bus import COLA_TRANSCRIPCION_ACTUALIZADA
 
 class DashboardApp(BaseApp):
     """Dashboard principal con datos reales del sistema"""
@@ -24,11 +28,20 @@ class DashboardApp(BaseApp):
         self.setup_ui()
         self.load_real_data()
         
-        # Timer para actualizaciones automáticas
+        # Actualización por eventos de datos (sin polling). Las ráfagas de
+        # eventos (p.ej. importación por lotes) se agrupan en un solo refresco.
         self.update_timer = QTimer()
+        self.update_timer.setSingleShot(True)
         self.update_timer.timeout.connect(self.load_real_data)
-        self.update_timer.start(30000)  # Actualizar cada 30 segundos
-        
+        get_data_events().evento_datos.connect(self.on_evento_datos)
+        
+    def on_evento_datos(self, evento, datos):
+        """Programar un refresco agrupado tras un cambio de datos"""
+        # La cola de transcripción no cambia ninguna cifra del dashboard
+        if evento == COLA_TRANSCRIPCION_ACTUALIZADA:
+            return
+        self.update_timer.start(500)
+
     def get_title(self):
         return "Dashboard"
         
@@ -119,8 +132,9 @@ class DashboardApp(BaseApp):
         )
         grid.addWidget(self.metric_fragmentos, 0, 2)
         self.metric_espacio = self.create_metric_card(
-            "Espacio en BD", "0 MB", "#c0392b", "Cargando..."
+            "Almacenamiento", "0 MB", "#c0392b", "Cargando..."
         )
+        grid.addWidget(self.metric_espacio, 0, 3)
         
         return grid
         
@@ -211,6 +225,9 @@ class DashboardApp(BaseApp):
         self.chart_libros = self.create_libros_chart()
         layout.addWidget(self.chart_libros)
         
+        self.chart_uso_modelos = self.create_uso_modelos_chart()
+        layout.addWidget(self.chart_uso_modelos)
+        
         return section
         
     def create_consultas_chart(self):
@@ -275,6 +292,42 @@ class DashboardApp(BaseApp):
         
         return chart
         
+    def create_uso_modelos_chart(self):
+        """Gráfico de tiempo de modelo por origen (tabla uso_modelos)"""
+        chart = QFrame()
+        chart.setStyleSheet(f"""
+            QFrame {{
+                background-color: white;
+                border: 1px solid #ecf0f1;
+                border-radius: {int(6 * self.scale_factor)}px;
+                padding: {int(15 * self.scale_factor)}px;
+                margin: {int(5 * self.scale_factor)}px;
+            }}
+        """)
+        
+        layout = QVBoxLayout(chart)
+        
+        title_label = QLabel("🤖 Tiempo de Modelos por Origen (s, últimos 7 días)")
+        title_label.setStyleSheet("""
+            QLabel {
+                font-size: 16px;
+                font-weight: bold;
+                color: #2c3e50;
+                padding-bottom: 10px;
+            }
+        """)
+        layout.addWidget(title_label)
+        
+        self.bars_container_uso = QVBoxLayout()
+        layout.addLayout(self.bars_container_uso)
+        
+        self.resumen_uso_label = QLabel("")
+        self.resumen_uso_label.setWordWrap(True)
+        self.resumen_uso_label.setStyleSheet(f"font-size: {int(11 * self.scale_factor)}px; color: #7f8c8d;")
+        layout.addWidget(self.resumen_uso_label)
+        
+        return chart
+        
     def create_activity_section(self):
         """Crear sección de actividad reciente con datos reales"""
         section = QGroupBox("🕒 Actividad Reciente")
@@ -353,6 +406,7 @@ class DashboardApp(BaseApp):
         try:
             stats = self.db_manager.obtener_estadisticas()
             advanced_stats = self.db_manager.obtener_estadisticas_avanzadas()
+            almacenamiento = storage_manager.obtener_resumen()
             
             # Actualizar métricas principales
             self.update_metric_card(self.metric_libros, str(stats['total_libros']), 
@@ -364,13 +418,18 @@ class DashboardApp(BaseApp):
             self.update_metric_card(self.metric_fragmentos, str(stats['total_fragmentos']), 
                                   f"{advanced_stats.get('total_tokens', 0):,} tokens")
             
-            espacio = advanced_stats.get('espacio_estimado_mb', 0)
-            self.update_metric_card(self.metric_espacio, f"{espacio} MB", 
-                                  "Base de datos SQLite")
+            mb = 1024 * 1024
+            categorias = almacenamiento['por_categoria']
+            mayores = sorted(categorias.items(), key=lambda c: c[1], reverse=True)[:2]
+            detalle = ", ".join(f"{nombre} {valor / mb:.0f} MB" for nombre, valor in mayores)
+            self.update_metric_card(self.metric_espacio,
+                                  f"{almacenamiento['total_bytes'] / mb:.1f} / {almacenamiento['limite_bytes'] / mb:.0f} MB",
+                                  detalle or "Sin datos")
             
             # Actualizar gráficos
             self.update_consultas_chart()
             self.update_libros_chart()
+            self.update_uso_modelos_chart()
             
             # Actualizar actividad reciente
             self.update_recent_activity()
@@ -463,6 +522,42 @@ class DashboardApp(BaseApp):
         except Exception as e:
             print(f"❌ Error actualizando gráfico de libros: {e}")
 
+    def update_uso_modelos_chart(self):
+        """Actualizar el tiempo, tokens y costo por origen, y la cola del planificador"""
+        self.clear_layout(self.bars_container_uso)
+        
+        try:
+            resumen = self.db_manager.obtener_resumen_uso_modelos(dias=7)
+            por_origen = {}
+            for fila in resumen:
+                entrada = por_origen.setdefault(fila['origen'], {'segundos': 0.0, 'llamadas': 0})
+                entrada['segundos'] += fila['latencia_total_s']
+                entrada['llamadas'] += fila['llamadas']
+            
+            total_segundos = sum(e['segundos'] for e in por_origen.values())
+            if not por_origen:
+                empty_label = QLabel("🤖 Aún no hay llamadas a modelos registradas")
+                empty_label.setStyleSheet("font-size: 12px; color: #95a5a6; text-align: center;")
+                self.bars_container_uso.addWidget(empty_label)
+            
+            for origen, datos in sorted(por_origen.items(), key=lambda o: o[1]['segundos'], reverse=True)[:6]:
+                self.add_bar_to_chart(self.bars_container_uso, origen.replace('_', ' ').capitalize(),
+                                      int(round(datos['segundos'])), max(int(round(total_segundos)), 1))
+            
+            llamadas = sum(f['llamadas'] for f in resumen)
+            errores = sum(f['errores'] for f in resumen)
+            tokens = sum(f['tokens_entrada'] + f['tokens_salida'] for f in resumen)
+            costo = sum(f['costo_estimado'] for f in resumen)
+            metricas = llm_scheduler.obtener_metricas()
+            self.resumen_uso_label.setText(
+                f"{llamadas:,} llamadas ({errores} con error) · {tokens:,} tokens · "
+                f"~${costo:.2f} USD · En cola: {metricas['total_en_cola']} · "
+                f"Activas: {metricas['activas']}/{metricas['max_concurrencia_global']}"
+            )
+                
+        except Exception as e:
+            print(f"❌ Error actualizando uso de modelos: {e}")
+
     def add_bar_to_chart(self, layout, label: str, value: int, max_value: int):
         """Añadir una barra a un gráfico"""
         bar_container = QHBoxLayout()
@@ -1,5 +1,4 @@
 import os
-import tempfile
 import sys
 import os
 # Agregar raíz del proyecto al path
@@ -7,14 +6,28 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QLabel, QLineEdit, QTextEdit, QProgressBar,
-                             QFileDialog, QMessageBox, QGroupBox)
+                             QFileDialog, QMessageBox, QGroupBox, QTableWidget,
+                             QTableWidgetItem, QHeaderView, QAbstractItemView)
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from pydub import AudioSegment
-from openai import OpenAI
 
 from config.config_manager import config_manager
+from ai.llm_scheduler import llm_scheduler
+from processing.transcripcion import transcribir_a_archivo
+from processing.sonda_medios import sonda_medios
+from processing.cola_transcripcion import cola_transcripcion
+from controllers.data_events_controller import get_data_events
+from utils.event_bus import COLA_TRANSCRIPCION_ACTUALIZADA
 from views.apps.base_app import BaseApp
 
+# Texto de cada estado de la cola por lotes
+ESTADOS_COLA = {
+    'pendiente': "⏳ Pendiente",
+    'en_curso': "🎙️ En curso",
+    'completado': "✅ Completado",
+    'error': "❌ Error",
+    'cancelado': "🚫 Cancelado"
+}
+
 class TranscripcionWorker(QThread):
     """Hilo para procesar la transcripción sin bloquear la UI"""
     
@@ -28,20 +41,10 @@ class TranscripcionWorker(QThread):
 
     def run(self):
         try:
-            # Obtener configuración desde el manager
-            api_key = config_manager.get_api_key()
-            modelo_whisper = config_manager.get("ia", "modelo_whisper", "whisper-1")
-            segment_length_min = config_manager.get("transcripcion", "segment_length_min", 10)
-            formatear_automaticamente = config_manager.get("transcripcion", "formatear_automaticamente", True)
-            
-            if not api_key:
+            if not llm_scheduler.disponible():
                 self.finished_error.emit("No se encontró API Key. Configúrala en la sección de Configuración.")
                 return
             
-            # CORRECCIÓN: Inicializar cliente de OpenAI correctamente
-            self.client = OpenAI(api_key=api_key)
-            self.segment_length_ms = segment_length_min * 60 * 1000
-            
             self.progress_updated.emit(0, "Iniciando transcripción...")
             
             # Verificar archivo
@@ -49,141 +52,41 @@ class TranscripcionWorker(QThread):
                 self.finished_error.emit("El archivo no existe")
                 return
             
-            # Cargar audio
-            self.progress_updated.emit(5, "Cargando archivo de audio...")
-            audio = AudioSegment.from_file(self.archivo_path)
-            duracion_ms = len(audio)
-            
-            # Crear directorio temporal
-            temp_dir = tempfile.mkdtemp()
-            segmentos = []
-            
-            # Dividir en segmentos
-            self.progress_updated.emit(10, "Dividiendo archivo en segmentos...")
-            for i, start in enumerate(range(0, len(audio), self.segment_length_ms)):
-                segmento = audio[start:start + self.segment_length_ms]
-                nombre_segmento = os.path.join(temp_dir, f"segment_{i}.mp3")
-                segmento.export(nombre_segmento, format="mp3")
-                segmentos.append(nombre_segmento)
-            
-            # Transcribir segmentos
-            self.progress_updated.emit(20, f"Transcribiendo {len(segmentos)} segmentos...")
-            textos = []
-            
-            for i, segmento in enumerate(segmentos):
-                progreso = 20 + (i / len(segmentos)) * 60
-                self.progress_updated.emit(int(progreso), f"Transcribiendo segmento {i+1}/{len(segmentos)}...")
-                
-                try:
-                    with open(segmento, "rb") as f:
-                        resultado = self.client.audio.transcriptions.create(
-                            model=modelo_whisper,
-                            file=f
-                        )
-                        textos.append(resultado.text)
-                except Exception as e:
-                    self.finished_error.emit(f"Error en transcripción del segmento {i+1}: {str(e)}")
-                    return
-            
-            # Unir texto
-            self.progress_updated.emit(85, "Uniendo transcripciones...")
-            texto_completo = "\n".join(textos)
-            
-            # Formatear con GPT si está activado
-            if formatear_automaticamente:
-                self.progress_updated.emit(90, "Formateando texto con GPT...")
-                texto_final = self.formatear_texto(texto_completo)
-            else:
-                texto_final = texto_completo
-                self.progress_updated.emit(90, "Saltando formateo automático...")
-            
-            # Guardar archivo
-            self.progress_updated.emit(95, "Guardando archivo...")
-            
-            # Obtener ruta de almacenamiento configurada por el usuario
-            # Si no está configurada, usar './data' por defecto
-            ruta_base_datos = config_manager.get("almacenamiento", "ruta_datos", "./data")
-            
-            # Asegurar que la carpeta de transcripciones exista dentro de la ruta configurada
-            ruta_transcripciones = os.path.join(ruta_base_datos, "transcripciones")
-            os.makedirs(ruta_transcripciones, exist_ok=True)
-            
-            nombre_base = os.path.basename(self.archivo_path)
-            nombre_sin_ext = os.path.splitext(nombre_base)[0]
-            archivo_salida_nombre = f"{nombre_sin_ext}_transcripcion.txt"
-            archivo_salida_full = os.path.join(ruta_transcripciones, archivo_salida_nombre)
-            
-            with open(archivo_salida_full, "w", encoding="utf-8") as f:
-                f.write(texto_final)
-            
-            # Limpiar temporales
-            for segmento in segmentos:
-                if os.path.exists(segmento):
-                    os.remove(segmento)
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
+            archivo_salida_full = transcribir_a_archivo(self.archivo_path, progreso=self.progress_updated.emit)
             
             self.progress_updated.emit(100, "¡Transcripción completada!")
             self.finished_success.emit(archivo_salida_full)
             
         except Exception as e:
             self.finished_error.emit(f"Error: {str(e)}")
-        
 
-    def formatear_texto(self, texto):
-        """Formatear el texto usando GPT"""
+class SondeoWorker(QThread):
+    """Hilo para leer la información de un archivo multimedia sin bloquear la UI"""
+    
+    sondeo_listo = pyqtSignal(str, dict)
+    sondeo_error = pyqtSignal(str, str)
+    
+    def __init__(self, archivo_path):
+        super().__init__()
+        self.archivo_path = archivo_path
+    
+    def run(self):
         try:
-            fragmentos = self.dividir_texto(texto)
-            resultado_final = ""
-            
-            for i, frag in enumerate(fragmentos, 1):
-                prompt = f"""
-                Formatea este texto como una transcripción profesional:
-                - Corrige ortografía y puntuación
-                - Añade saltos de línea y párrafos donde corresponda
-                - Mantén nombres, fechas y horas sin alterarlos
-                - Mantén todo en español
-
-                Fragmento {i} de {len(fragmentos)}:
-                {frag}
-                """
-                
-                respuesta = self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0
-                )
-                resultado_final += respuesta.choices[0].message.content + "\n\n"
-            
-            return resultado_final.strip()
+            self.sondeo_listo.emit(self.archivo_path, sonda_medios.sondear(self.archivo_path))
         except Exception as e:
-            # Si falla el formateo, devolver el texto original
-            return f"Texto original (error en formateo: {str(e)}):\n\n{texto}"
-    
-    def dividir_texto(self, texto, max_chars=3000):
-        """Dividir texto en fragmentos manejables"""
-        lineas = texto.split("\n")
-        fragmentos = []
-        fragmento_actual = ""
-
-        for linea in lineas:
-            if len(fragmento_actual) + len(linea) + 1 > max_chars:
-                fragmentos.append(fragmento_actual.strip())
-                fragmento_actual = linea + "\n"
-            else:
-                fragmento_actual += linea + "\n"
-
-        if fragmento_actual.strip():
-            fragmentos.append(fragmento_actual.strip())
-
-        return fragmentos
+            self.sondeo_error.emit(self.archivo_path, str(e))
 
 class TranscripcionApp(BaseApp):
     """Aplicación de Transcripción de Audio/Video - Versión actualizada"""
     
+    # Progreso de la cola por lotes (se emite desde sus hilos, se recibe en el de la UI)
+    progreso_cola = pyqtSignal(int, int, str)
+    
     def __init__(self):
         super().__init__()
         self.worker = None
+        # Sondeos en curso (se conservan hasta terminar aunque se elija otro archivo)
+        self.sondeos = set()
         self.setup_ui()
         self.apply_styles()
         
@@ -274,6 +177,9 @@ class TranscripcionApp(BaseApp):
         
         layout.addLayout(button_layout)
         
+        # Cola por lotes
+        layout.addWidget(self.create_batch_group())
+        
         # Área de logs
         log_group = QGroupBox("📝 Registro de Actividad")
         log_layout = QVBoxLayout(log_group)
@@ -291,6 +197,55 @@ class TranscripcionApp(BaseApp):
         # Verificar estado inicial
         self.verificar_configuracion()
     
+    def create_batch_group(self):
+        """Crear grupo de transcripción por lotes (cola persistente)"""
+        group = QGroupBox("🗂️ Transcripción por Lotes")
+        batch_layout = QVBoxLayout(group)
+        
+        batch_buttons = QHBoxLayout()
+        self.import_folder_btn = QPushButton("📂 Importar Carpeta")
+        self.import_folder_btn.clicked.connect(self.importar_carpeta_lote)
+        batch_buttons.addWidget(self.import_folder_btn)
+        
+        self.add_files_btn = QPushButton("➕ Agregar Archivos")
+        self.add_files_btn.clicked.connect(self.agregar_archivos_lote)
+        batch_buttons.addWidget(self.add_files_btn)
+        
+        self.retry_btn = QPushButton("🔁 Reintentar")
+        self.retry_btn.clicked.connect(self.reintentar_lote)
+        batch_buttons.addWidget(self.retry_btn)
+        
+        self.cancel_batch_btn = QPushButton("⏹️ Cancelar Pendientes")
+        self.cancel_batch_btn.clicked.connect(self.cancelar_lote)
+        batch_buttons.addWidget(self.cancel_batch_btn)
+        
+        self.clear_batch_btn = QPushButton("🧹 Limpiar Terminados")
+        self.clear_batch_btn.clicked.connect(self.limpiar_lote)
+        batch_buttons.addWidget(self.clear_batch_btn)
+        batch_layout.addLayout(batch_buttons)
+        
+        self.batch_table = QTableWidget(0, 4)
+        self.batch_table.setHorizontalHeaderLabels(["Archivo", "Estado", "Progreso", "Detalle"])
+        self.batch_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.batch_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.Stretch)
+        self.batch_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.batch_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.batch_table.setMaximumHeight(220)
+        batch_layout.addWidget(self.batch_table)
+        
+        self.batch_summary_label = QLabel("")
+        self.batch_summary_label.setStyleSheet("color: #34495e; font-size: 11px;")
+        batch_layout.addWidget(self.batch_summary_label)
+        
+        # Fila de cada elemento de la cola (para actualizar el progreso sin recargar)
+        self.batch_rows = {}
+        get_data_events().evento_datos.connect(self.on_evento_cola)
+        self.progreso_cola.connect(self.on_progreso_cola)
+        cola_transcripcion.suscribir_progreso(self.progreso_cola.emit)
+        self.actualizar_tabla_lote()
+        
+        return group
+    
     def create_config_status(self):
         """Crear grupo con información de configuración actual"""
         group = QGroupBox("⚙️ Configuración Actual")
@@ -328,14 +283,14 @@ class TranscripcionApp(BaseApp):
 
     def verificar_configuracion(self):
         """Verificar si la configuración está completa"""
-        api_key = config_manager.get_api_key()
+        proveedor_listo = llm_scheduler.disponible()
         has_file = bool(self.file_input.text().strip())
         
         # CORREGIDO: Convertir a booleano explícito
-        config_ok = bool(api_key) and has_file
+        config_ok = proveedor_listo and has_file
         self.transcribe_btn.setEnabled(config_ok)
         
-        if not api_key:
+        if not proveedor_listo:
             self.status_label.setText("⚠️ Configura API Key en la app de Configuración")
             self.status_label.setStyleSheet("color: #e74c3c; font-size: 11px; font-weight: bold;")
         else:
@@ -399,28 +354,116 @@ class TranscripcionApp(BaseApp):
             self.verificar_configuracion()
     
     def actualizar_info_archivo(self, file_path):
-        """Actualizar información del archivo seleccionado"""
-        try:
-            audio = AudioSegment.from_file(file_path)
-            duracion_ms = len(audio)
-            minutos = duracion_ms / 1000 / 60
-            tamaño = os.path.getsize(file_path) / (1024 * 1024)  # MB
-            
-            info_text = f"""
-            📄 Archivo: {os.path.basename(file_path)}
-            ⏱ Duración: {minutos:.2f} minutos
-            📊 Tamaño: {tamaño:.2f} MB
-            💰 Costo estimado: ${minutos * 0.006:.4f} USD
-            """
-            self.info_label.setText(info_text)
+        """Leer la información del archivo seleccionado en segundo plano (solo la cabecera)"""
+        self.info_label.setText(f"⏳ Analizando {os.path.basename(file_path)}...")
+        sondeo = SondeoWorker(file_path)
+        sondeo.sondeo_listo.connect(self.mostrar_info_archivo)
+        sondeo.sondeo_error.connect(self.mostrar_error_archivo)
+        sondeo.finished.connect(lambda: self.sondeos.discard(sondeo))
+        self.sondeos.add(sondeo)
+        sondeo.start()
+    
+    def mostrar_info_archivo(self, file_path, medio):
+        """Mostrar duración, tamaño y costo del archivo (si sigue siendo el seleccionado)"""
+        if file_path != self.file_input.text():
+            return
+        minutos = medio['duracion_s'] / 60
+        tamaño = medio['tamano_bytes'] / (1024 * 1024)  # MB
+        modelo_whisper = config_manager.get("ia", "modelo_whisper", "whisper-1")
+        precio_minuto = config_manager.get_precios_modelo(modelo_whisper).get('minuto_audio', 0.006)
+        
+        info_text = f"""
+        📄 Archivo: {os.path.basename(file_path)}
+        ⏱ Duración: {minutos:.2f} minutos
+        📊 Tamaño: {tamaño:.2f} MB
+        💰 Costo estimado: ${minutos * precio_minuto:.4f} USD
+        """
+        if not medio['tiene_audio']:
+            info_text += "\n        ⚠️ El archivo no contiene una pista de audio"
+        self.info_label.setText(info_text)
+    
+    def mostrar_error_archivo(self, file_path, mensaje_error):
+        if file_path == self.file_input.text():
+            self.info_label.setText(f"❌ Error al cargar archivo: {mensaje_error}")
+    
+    # ============ TRANSCRIPCIÓN POR LOTES ============
+    
+    def importar_carpeta_lote(self):
+        """Agregar a la cola los archivos de audio/video de una carpeta (y subcarpetas)"""
+        carpeta = QFileDialog.getExistingDirectory(self, "Selecciona una carpeta de grabaciones")
+        if carpeta:
+            agregados = cola_transcripcion.importar_carpeta(carpeta)
+            self.log(f"🗂️ {agregados} archivo(s) de {os.path.basename(carpeta)} agregados a la cola")
+    
+    def agregar_archivos_lote(self):
+        """Agregar archivos sueltos a la cola"""
+        rutas, _ = QFileDialog.getOpenFileNames(
+            self,
+            "Selecciona archivos de audio o video",
+            "",
+            "Archivos multimedia (*.mp3 *.wav *.m4a *.mp4 *.mov *.mkv *.avi);;Todos los archivos (*.*)"
+        )
+        if rutas:
+            agregados = cola_transcripcion.agregar_archivos(rutas)
+            self.log(f"🗂️ {agregados} archivo(s) agregados a la cola")
+    
+    def ids_seleccionados_lote(self):
+        filas = {indice.row() for indice in self.batch_table.selectionModel().selectedRows()}
+        return [self.batch_table.item(fila, 0).data(Qt.UserRole) for fila in sorted(filas)]
+    
+    def reintentar_lote(self):
+        """Volver a encolar los seleccionados (o todos los fallidos si no hay selección)"""
+        ids = self.ids_seleccionados_lote() or None
+        cambiados = cola_transcripcion.reintentar(ids)
+        self.log(f"🔁 {cambiados} archivo(s) vuelven a la cola")
+    
+    def cancelar_lote(self):
+        """Cancelar los pendientes seleccionados (o todos si no hay selección)"""
+        ids = self.ids_seleccionados_lote() or None
+        cambiados = cola_transcripcion.cancelar(ids)
+        self.log(f"⏹️ {cambiados} archivo(s) pendientes cancelados")
+    
+    def limpiar_lote(self):
+        cola_transcripcion.limpiar_terminados()
+    
+    def on_evento_cola(self, evento, datos):
+        """Recargar la tabla ante cambios de estado de la cola (recibido en el hilo de la UI)"""
+        if evento == COLA_TRANSCRIPCION_ACTUALIZADA:
+            self.actualizar_tabla_lote()
+    
+    def on_progreso_cola(self, elemento_id, porcentaje, mensaje):
+        """Actualizar el progreso de un archivo de la cola sin recargar la tabla"""
+        fila = self.batch_rows.get(elemento_id)
+        if fila is not None:
+            self.batch_table.item(fila, 2).setText(f"{porcentaje}%")
+            self.batch_table.item(fila, 3).setText(mensaje)
+    
+    def actualizar_tabla_lote(self):
+        """Recargar la tabla de la cola desde la base de datos"""
+        elementos = cola_transcripcion.obtener_elementos()
+        self.batch_table.setRowCount(len(elementos))
+        self.batch_rows = {}
+        conteo = {}
+        for fila, elemento in enumerate(elementos):
+            self.batch_rows[elemento['id']] = fila
+            conteo[elemento['estado']] = conteo.get(elemento['estado'], 0) + 1
+            detalle = elemento['error'] or elemento['ruta_salida'] or elemento['mensaje']
             
-        except Exception as e:
-            self.info_label.setText(f"❌ Error al cargar archivo: {str(e)}")
+            nombre = QTableWidgetItem(os.path.basename(elemento['ruta']))
+            nombre.setData(Qt.UserRole, elemento['id'])
+            nombre.setToolTip(elemento['ruta'])
+            self.batch_table.setItem(fila, 0, nombre)
+            self.batch_table.setItem(fila, 1, QTableWidgetItem(ESTADOS_COLA.get(elemento['estado'], elemento['estado'])))
+            self.batch_table.setItem(fila, 2, QTableWidgetItem(f"{elemento['progreso']}%"))
+            self.batch_table.setItem(fila, 3, QTableWidgetItem(detalle or ""))
+        
+        self.batch_summary_label.setText(" · ".join(
+            f"{ESTADOS_COLA.get(estado, estado)}: {cantidad}" for estado, cantidad in conteo.items()
+        ) if elementos else "La cola está vacía")
     
     def iniciar_transcripcion(self):
         """Iniciar proceso de transcripción"""
-        api_key = config_manager.get_api_key()
-        if not api_key:
+        if not llm_scheduler.disponible():
             QMessageBox.warning(
                 self, 
                 "API Key Requerida", 